@@ -155,7 +155,7 @@ const AIAssistant: React.FC = () => {
     let timer: any;
     const poll = async () => {
       try {
-        const { data } = await getChatVendorSummary(selectedVendorName);
+        const { data } = await getChatVendorSummary(selectedVendorName, resolveUserId() || undefined);
         console.log("[AIAssistant] vendor summary poll", selectedVendorName, data);
         const chunks = data.vendor_info?.total_chunks || 0;
         if (chunks > 0) {
@@ -175,7 +175,7 @@ const AIAssistant: React.FC = () => {
     };
     poll();
     return () => timer && clearTimeout(timer);
-  }, [selectedVendorName]);
+  }, [selectedVendorName, USER_ID]);
 
   const formatTime = () =>
     new Date().toLocaleTimeString([], { hour: "2-digit", minute: "2-digit" });
@@ -105,6 +105,19 @@ export interface ChatVendorSummary {
   message?: string;
 }
 
+export interface ChatKnowledgeJob {
+  jobId: string;
+  kind: "load" | "ingest";
+  userId: string | null;
+  status: "queued" | "running" | "succeeded" | "failed";
+  incremental: boolean;
+  coalesced: number;
+  elapsed_seconds: number;
+  progress: { stage: string; chunks_total: number; chunks_embedded: number; chunks_stored: number };
+  result: { success: boolean; message?: string; stats?: Record<string, unknown> } | null;
+  error: string | null;
+}
+
 export interface AnalyticsResponse {
   success?: boolean;
   insights: {
@@ -449,16 +462,58 @@ export async function getChatAnswer(question: string, vendorName?: string, userI
   );
 }
 
-export async function loadChatKnowledge(userId: string, incremental = true) {
-  return apiCall(
-    `/chat/api/v1/knowledge/load?userId=${userId}&incremental=${incremental}`,
+export async function getChatKnowledgeJob(jobId: string) {
+  return apiCall<ChatKnowledgeJob>(`/chat/api/v1/knowledge/jobs/${jobId}`);
+}
+
+/**
+ * Queue a knowledge load and poll its job until it finishes.
+ * The chat service answers 202 with a jobId; the returned data is the finished job
+ * (status "succeeded" also covers an incremental load with nothing new to index).
+ */
+export async function loadChatKnowledge(
+  userId: string,
+  incremental = true,
+  onProgress?: (job: ChatKnowledgeJob) => void,
+  maxAttempts = 120,
+  interval = 2000
+) {
+  const { data: started, response } = await apiCall<{ jobId?: string; detail?: string }>(
+    `/chat/api/v1/knowledge/load?userId=${encodeURIComponent(userId)}&incremental=${incremental}`,
     { method: "POST" }
   );
+
+  if (response.status !== 202 || !started.jobId) {
+    throw new Error(started.detail || `Failed to start knowledge load: ${response.statusText}`);
+  }
+
+  for (let attempt = 0; attempt < maxAttempts; attempt++) {
+    await new Promise(resolve => setTimeout(resolve, interval));
+    const { data: job, response: statusResponse } = await getChatKnowledgeJob(started.jobId);
+
+    if (!statusResponse.ok) {
+      throw new Error(`Failed to get knowledge job status: ${statusResponse.statusText}`);
+    }
+
+    onProgress?.(job);
+
+    if (job.status === "succeeded") {
+      return { data: job, response: statusResponse };
+    }
+    if (job.status === "failed") {
+      throw new Error(job.error || "Knowledge load failed");
+    }
+  }
+
+  throw new Error("Knowledge load polling timeout - max attempts reached");
 }
 
-export async function getChatVendorSummary(vendorName: string) {
+export async function getChatVendorSummary(vendorName: string, userId?: string) {
+  const qs = new URLSearchParams({ vendor_name: vendorName });
+  if (userId) qs.append("userId", userId);
+
   return apiCall<ChatVendorSummary>(
-    `/chat/api/v1/vendor/summary?vendor_name=${encodeURIComponent(vendorName)}`
+    `/chat/api/v1/vendor/summary?${qs.toString()}`
   );
 }
 
@@ -492,6 +547,7 @@ export const api = {
   // Chat
   getChatAnswer,
   loadChatKnowledge,
+  getChatKnowledgeJob,
   getChatVendorSummary,
   getAnalytics,
 };
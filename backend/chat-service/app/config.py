@@ -4,6 +4,91 @@ import os
 load_dotenv()
 
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-mpnet-base-v2")
+# Embedding inference backend: "torch" | "onnx" | "onnx-int8" (dynamic int8 quantization, exported once)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+EMBEDDING_ONNX_DIRECTORY = os.getenv("EMBEDDING_ONNX_DIRECTORY", "data/onnx")
+EMBEDDING_ONNX_QUANTIZATION = os.getenv("EMBEDDING_ONNX_QUANTIZATION", "avx2")  # arm64 | avx2 | avx512 | avx512_vnni
 GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-2.5-flash")
+# Thread pools for blocking work in async routes (see app/core/executors.py)
+ML_EXECUTOR_WORKERS = int(os.getenv("ML_EXECUTOR_WORKERS", str(max(2, min(4, os.cpu_count() or 1)))))
+ML_EXECUTOR_RESERVED_INTERACTIVE = int(os.getenv("ML_EXECUTOR_RESERVED_INTERACTIVE", "1"))  # threads ingest may never take
+IO_EXECUTOR_WORKERS = int(os.getenv("IO_EXECUTOR_WORKERS", "16"))
+# Background ingest jobs (app/core/jobs.py): finished jobs kept for /knowledge/jobs polling
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", "200"))
+# Per-call Gemini timeout (seconds)
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+# RAG answer cache keyed by (collection data version, prompt version, question, vendor, retrieved chunk IDs)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+# Analytics (+ Gemini summary) cache per (tenant collection, period), validated by a hash of the aggregates
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "256"))
+ANALYTICS_CACHE_TTL_SECONDS = float(os.getenv("ANALYTICS_CACHE_TTL_SECONDS", "0"))  # 0 = until the numbers change
+# Vendor detection: fuzzy matches at/above this score (and this far ahead of the runner-up) skip the LLM
+VENDOR_MATCH_THRESHOLD = float(os.getenv("VENDOR_MATCH_THRESHOLD", "0.75"))
+VENDOR_MATCH_MARGIN = float(os.getenv("VENDOR_MATCH_MARGIN", "0.05"))
+VENDOR_LLM_FALLBACK = os.getenv("VENDOR_LLM_FALLBACK", "true").lower() in ("1", "true", "yes")
+# Centroid routing for questions that name no vendor: vendors within MARGIN of the best centroid score (>= MIN_SCORE)
+VENDOR_ROUTING_ENABLED = os.getenv("VENDOR_ROUTING_ENABLED", "true").lower() in ("1", "true", "yes")
+VENDOR_ROUTING_MIN_SCORE = float(os.getenv("VENDOR_ROUTING_MIN_SCORE", "0.3"))
+VENDOR_ROUTING_MARGIN = float(os.getenv("VENDOR_ROUTING_MARGIN", "0.05"))
+VENDOR_ROUTING_MAX_VENDORS = int(os.getenv("VENDOR_ROUTING_MAX_VENDORS", "3"))
+# Semantic answer cache: reuse an answer when a same-vendor question embeds within this cosine similarity
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "2048"))
+# JSONL log of semantic hits/misses (with similarity and retrieved-source overlap) for threshold tuning; empty disables
+SEMANTIC_CACHE_AUDIT_LOG = os.getenv("SEMANTIC_CACHE_AUDIT_LOG", "data/semantic_cache_audit.jsonl")
 VECTORDB_PERSIST_DIRECTORY = os.getenv("VECTORDB_PERSIST_DIRECTORY", "data/vectordb")
-VENDOR_DATA_DIRECTORY = os.getenv("VENDOR_DATA_DIRECTORY", "sample-data")
\ No newline at end of file
+VENDOR_DATA_DIRECTORY = os.getenv("VENDOR_DATA_DIRECTORY", "sample-data")
+# Remote (Drive) master.json loading: Drive REST base and OAuth token endpoint (overridable for a local
+# fake Drive), concurrent folder fetches over one keep-alive client, and the manifest of indexed versions
+DRIVE_API_BASE = os.getenv("DRIVE_API_BASE", "https://www.googleapis.com/drive/v3").rstrip("/")
+GOOGLE_TOKEN_URI = os.getenv("GOOGLE_TOKEN_URI", "https://oauth2.googleapis.com/token")
+DRIVE_FETCH_CONCURRENCY = int(os.getenv("DRIVE_FETCH_CONCURRENCY", "8"))
+DRIVE_TIMEOUT_SECONDS = float(os.getenv("DRIVE_TIMEOUT_SECONDS", "20"))
+DRIVE_MANIFEST_PATH = os.getenv("DRIVE_MANIFEST_PATH", os.path.join(VECTORDB_PERSIST_DIRECTORY, "drive_manifest.sqlite3"))
+# Persistent (model, content hash) -> vector cache so unchanged chunks are never re-encoded; <= 0 disables
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(VECTORDB_PERSIST_DIRECTORY, "embedding_cache.sqlite3"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+# Vector store backend: "chroma" (default) or "numpy" (memory-mapped float32 matrix, exact top-k)
+VECTORDB_BACKEND = os.getenv("VECTORDB_BACKEND", "chroma").lower()
+NUMPY_SEARCH_BLOCK_ROWS = int(os.getenv("NUMPY_SEARCH_BLOCK_ROWS", "65536"))
+# One collection per userId (tenant) with a bounded LRU of open handles. Opt-in: existing data lives in the
+# shared collection and is not migrated, so enable it only with a fresh index (or re-run /knowledge/load per user)
+VECTORDB_PER_TENANT_COLLECTIONS = os.getenv("VECTORDB_PER_TENANT_COLLECTIONS", "false").lower() in ("1", "true", "yes")
+TENANT_MAX_OPEN_COLLECTIONS = int(os.getenv("TENANT_MAX_OPEN_COLLECTIONS", "32"))
+# Query embedding LRU (normalized question text -> vector); TTL 0 = no expiry; disk tier reuses the cache above
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048"))
+QUERY_EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL_SECONDS", "0"))
+QUERY_EMBEDDING_CACHE_DISK = os.getenv("QUERY_EMBEDDING_CACHE_DISK", "true").lower() in ("1", "true", "yes")
+# Query vectors get their own table in the embedding cache file, bounded separately from chunk vectors
+QUERY_EMBEDDING_CACHE_DISK_MAX_ENTRIES = int(os.getenv("QUERY_EMBEDDING_CACHE_DISK_MAX_ENTRIES", "20000"))
+# Cross-request micro-batching of query embeddings: wait up to WINDOW_MS or MAX_SIZE texts, then one forward pass
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32"))
+# Bulk ingest encoding: one worker-process pool per service process, shared by concurrent ingests
+# (1 = single process); the encode batch size adapts to available memory within [8, EMBEDDING_MAX_BULK_BATCH_SIZE]
+EMBEDDING_POOL_WORKERS = int(os.getenv("EMBEDDING_POOL_WORKERS", str(max(1, min(4, os.cpu_count() or 1)))))
+EMBEDDING_POOL_MIN_CHUNKS = int(os.getenv("EMBEDDING_POOL_MIN_CHUNKS", "2000"))
+EMBEDDING_MAX_BULK_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BULK_BATCH_SIZE", "128"))
+# Shared embedding server (python -m app.core.embedding_server): "unix:///path.sock" or "http://127.0.0.1:4006";
+# empty = load the model in-process
+EMBEDDING_SERVER_URL = os.getenv("EMBEDDING_SERVER_URL", "").strip()
+EMBEDDING_SERVER_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_SERVER_TIMEOUT_SECONDS", "30"))
+# Chunking: token budget per chunk (embedding model's max sequence length) and line items
+# shared between consecutive windows of a long invoice; tokenizer defaults to the embedding model's
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "384"))
+CHUNK_LINE_ITEM_OVERLAP = int(os.getenv("CHUNK_LINE_ITEM_OVERLAP", "2"))
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", EMBEDDING_MODEL)
+# Max chunks per upsert call when writing to the vector DB
+VECTORDB_WRITE_BATCH_SIZE = int(os.getenv("VECTORDB_WRITE_BATCH_SIZE", "256"))
+# Streaming ingest (app/core/pipeline.py): chunks per embed/upsert window, embedded windows
+# buffered ahead of the writer, and windows between vector store flushes (numpy backend)
+INGEST_WINDOW_CHUNKS = int(os.getenv("INGEST_WINDOW_CHUNKS", "512"))
+INGEST_QUEUE_WINDOWS = int(os.getenv("INGEST_QUEUE_WINDOWS", "2"))
+INGEST_FLUSH_EVERY_WINDOWS = int(os.getenv("INGEST_FLUSH_EVERY_WINDOWS", "8"))
+
+# Cross-vendor retrieval (no vendor detected): one ANN query over-fetching
+# candidates, then at most N chunks per vendor kept in the final top-k.
+RETRIEVAL_MAX_CHUNKS_PER_VENDOR = int(os.getenv("RETRIEVAL_MAX_CHUNKS_PER_VENDOR", "2"))
+RETRIEVAL_CANDIDATE_MULTIPLIER = int(os.getenv("RETRIEVAL_CANDIDATE_MULTIPLIER", "4"))
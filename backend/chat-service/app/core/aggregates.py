@@ -0,0 +1,193 @@
+import json
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+_DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%y", "%d/%m/%y", "%d %b %Y", "%d %B %Y", "%b %d, %Y", "%B %d, %Y")
+
+
+def parse_amount(val: Any) -> float:
+    """Parse a currency-ish value ("₹2,809.30", "2809.3", 12) into a float (0.0 on failure)."""
+    if val is None:
+        return 0.0
+    if isinstance(val, (int, float)) and not isinstance(val, bool):
+        return float(val)
+    s = str(val).strip()
+    s = re.sub(r"[₹$,]", "", s)
+    s = re.sub(r"[^0-9.]", "", s)
+    try:
+        return float(s) if s else 0.0
+    except Exception:
+        return 0.0
+
+
+def parse_invoice_date(val: Any) -> Optional[str]:
+    """Normalize an OCR'd invoice date ("16.12.2021", "2021-12-16T..", "16 Dec 2021") to ISO YYYY-MM-DD."""
+    if not val:
+        return None
+    s = str(val).strip()
+    try:
+        return datetime.fromisoformat(s[:10]).date().isoformat()
+    except ValueError:
+        pass
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(s, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def invoice_amount(metadata: Dict[str, Any]) -> float:
+    """Invoice total from chunk metadata; falls back to the sum of line item amounts when missing/zero."""
+    amount = parse_amount(metadata.get("total_amount"))
+    if amount == 0.0 and metadata.get("line_items"):
+        try:
+            line_items = metadata.get("line_items")
+            if isinstance(line_items, str):
+                line_items = json.loads(line_items)
+            li_total = 0.0
+            if isinstance(line_items, list):
+                for li in line_items:
+                    if isinstance(li, dict):
+                        li_total += parse_amount(li.get("amount"))
+            if li_total > 0:
+                amount = li_total
+        except Exception:
+            pass
+    return amount
+
+
+class VendorAggregateStore:
+    """Materialized per-vendor spend aggregates persisted next to the vector DB.
+
+    One row per invoice chunk (so re-indexing an invoice replaces its amount
+    instead of double counting) plus one rolled-up row per vendor. Writers
+    call `record` with the chunks they just stored; readers get the ranking
+    from the vendor table in O(vendors).
+
+    The same database holds the collection's data versions: a counter bumped
+    by every `record` and `clear` and, per vendor, the counter value of its
+    last write. They are part of the answer cache keys. Being on disk, they
+    survive restarts and reopened tenant handles and are shared by every
+    worker process.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS invoice_amounts ("
+                "chunk_id TEXT PRIMARY KEY, vendor_name TEXT NOT NULL, amount REAL NOT NULL DEFAULT 0, invoice_date TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_invoice_amounts_vendor ON invoice_amounts(vendor_name)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS vendor_totals ("
+                "vendor_name TEXT PRIMARY KEY, total_spend REAL NOT NULL DEFAULT 0, "
+                "invoice_count INTEGER NOT NULL DEFAULT 0, min_date TEXT, max_date TEXT)"
+            )
+            # vendor_floor: version of the last clear, for vendors not written since
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS collection_version ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL, vendor_floor INTEGER NOT NULL)"
+            )
+            self._conn.execute("INSERT OR IGNORE INTO collection_version (id, version, vendor_floor) VALUES (0, 0, 0)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS vendor_versions (vendor_name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    def record(self, entries: Iterable[Dict[str, Any]], written_vendors: Iterable[str] = ()) -> None:
+        """Apply stored chunks to the aggregates and bump the data versions in the same transaction.
+
+        Each entry: {"chunk_id", "vendor_name", "type", "metadata"} where metadata is
+        the un-flattened chunk metadata (line_items still a list). `written_vendors`
+        names vendors whose chunks were written without an entry (later line-item windows).
+        """
+        touched: set[str] = set(written_vendors)
+        with self._lock, self._conn:
+            for entry in entries:
+                vendor = entry.get("vendor_name") or "Unknown"
+                touched.add(vendor)
+                if entry.get("type") != "invoice":
+                    continue
+                meta = entry.get("metadata") or {}
+                chunk_id = entry["chunk_id"]
+                previous = self._conn.execute(
+                    "SELECT vendor_name FROM invoice_amounts WHERE chunk_id = ?", (chunk_id,)
+                ).fetchone()
+                if previous:
+                    touched.add(previous[0])
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO invoice_amounts (chunk_id, vendor_name, amount, invoice_date) VALUES (?, ?, ?, ?)",
+                    (chunk_id, vendor, invoice_amount(meta), parse_invoice_date(meta.get("invoice_date"))),
+                )
+            for vendor in touched:
+                self._refresh_vendor(vendor)
+            version = self._bump_version()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vendor_versions (vendor_name, version) VALUES (?, ?)", [(v, version) for v in touched]
+            )
+
+    def _bump_version(self) -> int:
+        self._conn.execute("UPDATE collection_version SET version = version + 1 WHERE id = 0")
+        return self._conn.execute("SELECT version FROM collection_version WHERE id = 0").fetchone()[0]
+
+    def data_version(self, vendor_name: Optional[str] = None) -> int:
+        """Collection data version, or the version of one vendor's data (its last write, else the last clear)."""
+        with self._lock:
+            if vendor_name is None:
+                return self._conn.execute("SELECT version FROM collection_version WHERE id = 0").fetchone()[0]
+            row = self._conn.execute("SELECT version FROM vendor_versions WHERE vendor_name = ?", (vendor_name,)).fetchone()
+            if row:
+                return row[0]
+            return self._conn.execute("SELECT vendor_floor FROM collection_version WHERE id = 0").fetchone()[0]
+
+    def _refresh_vendor(self, vendor: str) -> None:
+        total, count, min_date, max_date = self._conn.execute(
+            "SELECT COALESCE(SUM(amount), 0), COUNT(*), MIN(invoice_date), MAX(invoice_date) "
+            "FROM invoice_amounts WHERE vendor_name = ?",
+            (vendor,),
+        ).fetchone()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO vendor_totals (vendor_name, total_spend, invoice_count, min_date, max_date) VALUES (?, ?, ?, ?, ?)",
+            (vendor, total, count, min_date, max_date),
+        )
+
+    def ranking(self) -> List[Dict[str, Any]]:
+        """Vendors ordered by total spend (descending), including zero-spend vendors."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT vendor_name, total_spend, invoice_count, min_date, max_date FROM vendor_totals ORDER BY total_spend DESC"
+            ).fetchall()
+        return [
+            {
+                "vendor_name": r[0],
+                "total_spend": r[1],
+                "invoice_count": r[2],
+                "first_invoice_date": r[3],
+                "last_invoice_date": r[4],
+            }
+            for r in rows
+        ]
+
+    def vendor_names(self) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT vendor_name FROM vendor_totals ORDER BY vendor_name")]
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM vendor_totals LIMIT 1").fetchone() is None
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM invoice_amounts")
+            self._conn.execute("DELETE FROM vendor_totals")
+            self._conn.execute("DELETE FROM vendor_versions")
+            version = self._bump_version()
+            self._conn.execute("UPDATE collection_version SET vendor_floor = ? WHERE id = 0", (version,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,127 @@
+"""Embedding backend parity & performance check on the sample vendor data.
+
+Usage (from backend/chat-service):
+    python -m app.core.benchmark                      # torch vs onnx vs onnx-int8
+    python -m app.core.benchmark --backends torch onnx-int8 --min-cosine 0.99
+    python -m app.core.benchmark --memory 20000        # list-of-floats vs float32 footprint
+
+Every backend encodes the same knowledge chunks built from VENDOR_DATA_DIRECTORY.
+Each vector is compared to the PyTorch reference by cosine similarity, together
+with single-query latency and bulk throughput. The exit code is non-zero when
+any backend's minimum cosine falls below --min-cosine, so the script can serve
+as a parity test in CI.
+
+--memory skips the model. It measures the traced allocation of N 768-dim
+chunk embeddings held as Python float lists (the old `.tolist()` path) and as
+rows of one float32 matrix (the current path).
+"""
+import argparse
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+import numpy as np
+
+from app.config import EMBEDDING_MODEL, VENDOR_DATA_DIRECTORY
+from app.core.embedder import load_sentence_transformer
+from app.core.loader import VendorDataLoader
+
+
+def _sample_texts(data_directory: str) -> List[str]:
+    loader = VendorDataLoader(data_directory)
+    chunks = loader.convert_to_knowledge_chunks(loader.load_vendor_json_files())
+    return [c.content for c in chunks]
+
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    m = np.asarray(m, dtype=np.float32)
+    return m / np.clip(np.linalg.norm(m, axis=1, keepdims=True), 1e-12, None)
+
+
+def compare_backends(texts: List[str], backends: List[str], model_name: str = EMBEDDING_MODEL, repeats: int = 20, batch_size: int = 16) -> Dict[str, Dict[str, Any]]:
+    queries = ["top vendors by spend", "total spend for Zencorporations", "what items were purchased in invoice 1213"]
+    report: Dict[str, Dict[str, Any]] = {}
+    reference = None
+    for backend in ["torch"] + [b for b in backends if b != "torch"]:
+        model = load_sentence_transformer(model_name, backend)
+        model.encode(texts[:2], batch_size=batch_size)  # warm-up (graph/session init)
+        t0 = time.perf_counter()
+        vectors = _normalize(model.encode(texts, batch_size=batch_size, show_progress_bar=False))
+        bulk_seconds = time.perf_counter() - t0
+        latencies = []
+        for i in range(repeats):
+            t = time.perf_counter()
+            model.encode([queries[i % len(queries)]])
+            latencies.append((time.perf_counter() - t) * 1000)
+        if reference is None:
+            reference = vectors
+        cosines = np.sum(vectors * reference, axis=1)
+        report[backend] = {
+            "chunks": len(texts),
+            "chunks_per_sec": round(len(texts) / bulk_seconds, 2) if bulk_seconds else None,
+            "query_latency_ms_p50": round(statistics.median(latencies), 2),
+            "query_latency_ms_max": round(max(latencies), 2),
+            "cosine_vs_torch_min": round(float(cosines.min()), 5),
+            "cosine_vs_torch_mean": round(float(cosines.mean()), 5),
+        }
+    return report
+
+
+def embedding_memory_report(n_chunks: int, dim: int = 768) -> Dict[str, Any]:
+    """Traced bytes for n_chunks embeddings as Python float lists vs float32 matrix rows."""
+    matrix = np.random.default_rng(0).standard_normal((n_chunks, dim)).astype(np.float32)
+
+    def traced(build):
+        tracemalloc.start()
+        held = build()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del held
+        return current, peak
+
+    as_lists, _ = traced(lambda: [row.tolist() for row in matrix])
+    as_rows, _ = traced(lambda: list(matrix))  # views into `matrix`, i.e. what KnowledgeChunk now holds
+    matrix_bytes = matrix.nbytes
+    return {
+        "chunks": n_chunks,
+        "dim": dim,
+        "float32_matrix_mb": round(matrix_bytes / 2**20, 1),
+        "python_lists_mb": round(as_lists / 2**20, 1),
+        "float32_row_views_overhead_mb": round(as_rows / 2**20, 1),
+        "float32_total_mb": round((matrix_bytes + as_rows) / 2**20, 1),
+        "reduction_factor": round(as_lists / (matrix_bytes + as_rows), 1),
+    }
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default=VENDOR_DATA_DIRECTORY)
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    parser.add_argument("--memory", type=int, metavar="N", help="only run the embedding memory comparison for N chunks")
+    args = parser.parse_args(argv)
+
+    if args.memory:
+        for key, value in embedding_memory_report(args.memory).items():
+            print(f"{key:>30}: {value}")
+        return 0
+
+    texts = _sample_texts(args.data_dir)
+    if not texts:
+        print(f"No sample chunks found in {args.data_dir}")
+        return 1
+    report = compare_backends(texts, args.backends, args.model)
+    failed = False
+    for backend, row in report.items():
+        ok = row["cosine_vs_torch_min"] >= args.min_cosine
+        failed = failed or not ok
+        print(f"{backend:>10} | {row['chunks_per_sec']:>8} chunks/s | p50 {row['query_latency_ms_p50']:>7} ms | "
+              f"cos min {row['cosine_vs_torch_min']:.4f} mean {row['cosine_vs_torch_mean']:.4f} | {'OK' if ok else 'PARITY FAIL'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
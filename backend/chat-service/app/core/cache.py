@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+
+import numpy as np
+
+
+class LRUCache:
+    """Thread-safe bounded LRU with optional per-entry TTL and hit/miss counters."""
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 0.0):
+        self.max_size = max(1, max_size)
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                stored_at, value = item
+                if not self.ttl_seconds or time.monotonic() - stored_at <= self.ttl_seconds:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class SemanticCache:
+    """Nearest-neighbour cache over unit-normalized query embeddings.
+
+    Entries are partitioned by `scope` and carry the data `version` they were
+    computed from; `nearest` only considers live entries of the same scope and
+    version. Bounded as one LRU across scopes, with optional TTL.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 0.0):
+        self.max_size = max(1, max_size)
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple[Hashable, Hashable], tuple[float, Hashable, np.ndarray, Any]]" = OrderedDict()
+        self._by_scope: Dict[Hashable, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @staticmethod
+    def _unit(vector: Any) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = float(np.linalg.norm(v))
+        return v / norm if norm else v
+
+    def _drop(self, scope: Hashable, key: Hashable) -> None:
+        self._entries.pop((scope, key), None)
+        keys = self._by_scope.get(scope)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_scope[scope]
+
+    def nearest(self, scope: Hashable, version: Hashable, vector: Any) -> Optional[Tuple[float, Hashable, Any]]:
+        """(cosine similarity, key, value) of the closest live entry, or None when the scope is empty."""
+        query = self._unit(vector)
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            for key in list(self._by_scope.get(scope, ())):
+                stored_at, entry_version, entry_vector, value = self._entries[(scope, key)]
+                if entry_version != version or (self.ttl_seconds and now - stored_at > self.ttl_seconds):
+                    self._drop(scope, key)
+                    continue
+                candidates.append((key, entry_vector, value))
+            if not candidates:
+                return None
+            similarities = np.stack([c[1] for c in candidates]) @ query
+            best = int(np.argmax(similarities))
+            key, _, value = candidates[best]
+            self._entries.move_to_end((scope, key))
+            return float(similarities[best]), key, value
+
+    def put(self, scope: Hashable, version: Hashable, key: Hashable, vector: Any, value: Any) -> None:
+        with self._lock:
+            self._entries[(scope, key)] = (time.monotonic(), version, self._unit(vector), value)
+            self._entries.move_to_end((scope, key))
+            self._by_scope.setdefault(scope, set()).add(key)
+            while len(self._entries) > self.max_size:
+                (old_scope, old_key), _ = next(iter(self._entries.items()))
+                self._drop(old_scope, old_key)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_scope.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "scopes": len(self._by_scope),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,122 @@
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm else v
+
+
+class VendorCentroidStore:
+    """Per-vendor centroid embeddings persisted next to the vector DB.
+
+    Keeps a running float64 sum and chunk count per vendor. The centroid is
+    the normalized mean of a vendor's invoice, window and summary chunks.
+    Writers pass the vectors they replaced or deleted, as read back from
+    the vector store, so re-indexing a chunk swaps its contribution instead
+    of double counting it, without storing a second copy of every vector.
+    Readers get all centroids as one (vendors, dim) matrix, rebuilt in
+    memory only after a write.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._matrix: Optional[Tuple[List[str], np.ndarray]] = None
+        self._seen_data_version: Optional[int] = None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS vendor_centroids ("
+                "vendor_name TEXT PRIMARY KEY, chunk_count INTEGER NOT NULL DEFAULT 0, vector_sum BLOB NOT NULL)"
+            )
+
+    def record(self, entries: Iterable[Tuple[str, str, np.ndarray]], replaced: Iterable[Tuple[str, str, np.ndarray]] = ()) -> None:
+        """Apply stored chunks, given as (chunk_id, vendor_name, embedding), to the vendor sums.
+
+        `replaced` holds the stored (chunk_id, vendor_name, embedding) of
+        chunks these entries overwrite; their contribution is subtracted.
+        """
+        self._apply(entries, replaced)
+
+    def remove(self, entries: Iterable[Tuple[str, str, np.ndarray]]) -> None:
+        """Take deleted chunks, given as (chunk_id, vendor_name, stored embedding), out of the vendor sums."""
+        self._apply((), entries)
+
+    def _apply(self, added: Iterable[Tuple[str, str, np.ndarray]], removed: Iterable[Tuple[str, str, np.ndarray]]) -> None:
+        sums: Dict[str, List] = {}
+
+        def _sum(vendor: str, dim: int) -> List:
+            if vendor not in sums:
+                row = self._conn.execute(
+                    "SELECT chunk_count, vector_sum FROM vendor_centroids WHERE vendor_name = ?", (vendor,)
+                ).fetchone()
+                sums[vendor] = [row[0], np.frombuffer(row[1], dtype=np.float64).copy()] if row else [0, np.zeros(dim)]
+            return sums[vendor]
+
+        with self._lock, self._conn:
+            for _, vendor, embedding in removed:
+                vector = _unit(embedding)
+                old = _sum(vendor, vector.shape[0])
+                if old[0] > 0:
+                    old[0] -= 1
+                    old[1] -= vector
+            for _, vendor, embedding in added:
+                vector = _unit(embedding)
+                new = _sum(vendor, vector.shape[0])
+                new[0] += 1
+                new[1] += vector
+            for vendor, (count, total) in sums.items():
+                if count <= 0:
+                    self._conn.execute("DELETE FROM vendor_centroids WHERE vendor_name = ?", (vendor,))
+                else:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO vendor_centroids (vendor_name, chunk_count, vector_sum) VALUES (?, ?, ?)",
+                        (vendor, count, total.tobytes()),
+                    )
+            self._matrix = None
+
+    def matrix(self) -> Tuple[List[str], np.ndarray]:
+        """(vendor names, unit centroid matrix) in matching row order."""
+        with self._lock:
+            # PRAGMA data_version changes when another connection (e.g. another worker's ingest) commits
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if self._matrix is None or data_version != self._seen_data_version:
+                self._seen_data_version = data_version
+                rows = self._conn.execute("SELECT vendor_name, vector_sum FROM vendor_centroids ORDER BY vendor_name").fetchall()
+                vendors = [r[0] for r in rows]
+                if rows:
+                    sums = np.stack([np.frombuffer(r[1], dtype=np.float64) for r in rows]).astype(np.float32)
+                    sums /= np.clip(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12, None)
+                else:
+                    sums = np.zeros((0, 0), dtype=np.float32)
+                self._matrix = (vendors, sums)
+            return self._matrix
+
+    def route(self, query_embedding: np.ndarray, top_k: int = 3) -> List[Tuple[str, float]]:
+        """Vendors by cosine similarity of their centroid to the query (one matrix-vector product)."""
+        vendors, centroids = self.matrix()
+        if not vendors:
+            return []
+        scores = centroids @ _unit(query_embedding)
+        k = min(top_k, len(vendors))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(vendors[i], float(scores[i])) for i in top]
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM vendor_centroids LIMIT 1").fetchone() is None
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM vendor_centroids")
+            self._matrix = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
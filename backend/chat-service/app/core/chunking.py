@@ -0,0 +1,102 @@
+import math
+import re
+import textwrap
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.config import CHUNK_LINE_ITEM_OVERLAP, CHUNK_MAX_TOKENS, CHUNK_TOKENIZER
+
+
+def compact_text(text: str) -> str:
+    """Dedent, strip every line, collapse runs of spaces and drop blank lines."""
+    lines = (re.sub(r"[ \t]+", " ", line).strip() for line in textwrap.dedent(text).splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+class TokenCounter:
+    """Token counts with the embedding model's tokenizer (loaded lazily, tokenizer files only).
+
+    If the tokenizer cannot be loaded (offline, unknown model), counts fall
+    back to a ~4 characters/token estimate so chunking still bounds size.
+    """
+
+    def __init__(self, model_name: str = CHUNK_TOKENIZER):
+        self.model_name = model_name
+        self._tokenizer = None
+        self._loaded = False
+
+    @property
+    def tokenizer(self):
+        if not self._loaded:
+            self._loaded = True
+            try:
+                from transformers import AutoTokenizer
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            except Exception as e:
+                print(f"Tokenizer for {self.model_name} unavailable ({e}); estimating tokens from text length")
+        return self._tokenizer
+
+    def count_many(self, texts: Sequence[str], special_tokens: bool = True) -> List[int]:
+        if not texts:
+            return []
+        if self.tokenizer is None:
+            return [math.ceil(len(t) / 4) + (2 if special_tokens else 0) for t in texts]
+        encoded = self.tokenizer(list(texts), add_special_tokens=special_tokens)["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    def count(self, text: str, special_tokens: bool = True) -> int:
+        return self.count_many([text], special_tokens)[0]
+
+
+class InvoiceChunker:
+    """Packs an invoice's line items into token-bounded, overlapping windows.
+
+    Every window repeats the invoice header and closing sentence, so each
+    chunk can be retrieved on its own. An invoice that fits in `max_tokens`
+    stays a single chunk under the parent ID. Longer invoices become windows
+    of consecutive line items that share their last `overlap` items with the
+    next window. The first window keeps the parent ID, so it replaces the
+    previous single chunk on upsert. Later windows use `<parent>-w<n>`.
+    """
+
+    def __init__(self, counter: Optional[TokenCounter] = None, max_tokens: int = CHUNK_MAX_TOKENS, overlap: int = CHUNK_LINE_ITEM_OVERLAP):
+        self.counter = counter or TokenCounter()
+        self.max_tokens = max_tokens
+        self.overlap = max(0, overlap)
+
+    def window_item_lines(self, header: str, footer: str, item_lines: List[str]) -> List[tuple[int, int]]:
+        """[start, end) line-item ranges whose chunk text stays within max_tokens."""
+        if not item_lines:
+            return [(0, 0)]
+        base = self.counter.count(f"{header}\n{footer}") + self.counter.count("Line Items (INR) [000-000 of 000]:", special_tokens=False)
+        item_tokens = self.counter.count_many(item_lines, special_tokens=False)
+        if base + sum(item_tokens) <= self.max_tokens:
+            return [(0, len(item_lines))]
+        windows: List[tuple[int, int]] = []
+        start = 0
+        while start < len(item_lines):
+            end, used = start, base
+            # Always take at least one item so a single oversized line still progresses
+            while end < len(item_lines) and (end == start or used + item_tokens[end] <= self.max_tokens):
+                used += item_tokens[end]
+                end += 1
+            windows.append((start, end))
+            if end >= len(item_lines):
+                break
+            start = max(start + 1, end - self.overlap)
+        return windows
+
+
+def token_stats(counts: Sequence[int], max_tokens: int = CHUNK_MAX_TOKENS) -> Dict[str, Any]:
+    """Summary of per-chunk token counts for ingest responses."""
+    if not counts:
+        return {"chunks": 0, "tokens_total": 0, "tokens_mean": 0.0, "tokens_p95": 0, "tokens_max": 0, "over_limit": 0, "max_tokens": max_tokens}
+    ordered = sorted(counts)
+    return {
+        "chunks": len(counts),
+        "tokens_total": sum(counts),
+        "tokens_mean": round(sum(counts) / len(counts), 1),
+        "tokens_p95": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+        "tokens_max": ordered[-1],
+        "over_limit": sum(1 for c in counts if c > max_tokens),
+        "max_tokens": max_tokens,
+    }
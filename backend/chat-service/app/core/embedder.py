@@ -1,21 +1,352 @@
-from typing import List
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Dict, Any
+
+import numpy as np
 from app.models import KnowledgeChunk
+from app.core.cache import LRUCache
+from app.core.embedding_cache import EmbeddingCache, content_hash
+from app.config import (
+    EMBEDDING_MODEL,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    QUERY_EMBEDDING_CACHE_SIZE,
+    QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+    QUERY_EMBEDDING_CACHE_DISK,
+    QUERY_EMBEDDING_CACHE_DISK_MAX_ENTRIES,
+    EMBEDDING_BACKEND,
+    EMBEDDING_ONNX_DIRECTORY,
+    EMBEDDING_ONNX_QUANTIZATION,
+    EMBEDDING_BATCH_WINDOW_MS,
+    EMBEDDING_BATCH_MAX_SIZE,
+    EMBEDDING_POOL_WORKERS,
+    EMBEDDING_POOL_MIN_CHUNKS,
+    EMBEDDING_MAX_BULK_BATCH_SIZE,
+    EMBEDDING_SERVER_URL,
+)
 from sentence_transformers import SentenceTransformer
 
+
+def normalize_query(text: str) -> str:
+    """Cache key form of a question: trimmed, lower-cased, whitespace collapsed."""
+    return re.sub(r"\s+", " ", text.strip().lower())
+
+def load_sentence_transformer(model_name: str, backend: str = EMBEDDING_BACKEND) -> SentenceTransformer:
+    """Load the encoder on the requested inference backend.
+
+    - "torch": PyTorch (default).
+    - "onnx": exported ONNX graph run through ONNX Runtime.
+    - "onnx-int8": ONNX graph with dynamic int8 quantization. It is exported
+      once into EMBEDDING_ONNX_DIRECTORY and reused afterwards.
+    """
+    if backend == "onnx":
+        return SentenceTransformer(model_name, backend="onnx")
+    if backend == "onnx-int8":
+        export_dir = os.path.join(EMBEDDING_ONNX_DIRECTORY, model_name.replace("/", "__"))
+        quantized_file = f"onnx/model_qint8_{EMBEDDING_ONNX_QUANTIZATION}.onnx"
+        if not os.path.exists(os.path.join(export_dir, quantized_file)):
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+            print(f"Exporting int8-quantized ONNX model for {model_name} to {export_dir} ...")
+            onnx_model = SentenceTransformer(model_name, backend="onnx")
+            onnx_model.save(export_dir)
+            export_dynamic_quantized_onnx_model(onnx_model, EMBEDDING_ONNX_QUANTIZATION, export_dir)
+        return SentenceTransformer(export_dir, backend="onnx", model_kwargs={"file_name": quantized_file})
+    if backend != "torch":
+        print(f"Unknown EMBEDDING_BACKEND '{backend}', using torch")
+    return SentenceTransformer(model_name)
+
+
+def available_memory_bytes() -> Optional[int]:
+    """Free physical memory as reported by the OS (None where sysconf lacks it)."""
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def adaptive_batch_size(model: SentenceTransformer, workers: int = 1, max_batch_size: int = EMBEDDING_MAX_BULK_BATCH_SIZE) -> int:
+    """Largest power-of-two batch whose activations fit a quarter of free memory per worker.
+
+    Per-item cost is estimated as max_seq_length x hidden size x float32 x 16
+    (about 19 MB for mpnet at 384 tokens), which is conservative for CPU inference.
+    """
+    free = available_memory_bytes()
+    if not free:
+        return 16
+    seq_len = getattr(model, "max_seq_length", None) or 384
+    hidden = model.get_sentence_embedding_dimension() or 768
+    per_item = seq_len * hidden * 4 * 16
+    fits = int(free * 0.25 / max(1, workers) / per_item)
+    size = 8
+    while size * 2 <= min(fits, max_batch_size):
+        size *= 2
+    return size
+
+
+class EmbeddingBatcher:
+    """Coalesces single-text encode calls from concurrent requests into one batch.
+
+    Callers block on a future. A daemon thread takes the first queued text,
+    waits up to `window_ms` for more (or until `max_size` are queued),
+    encodes the distinct texts in one forward pass and resolves every
+    future. With `window_ms <= 0` or `max_size <= 1`, texts are encoded
+    inline.
+    """
+
+    def __init__(self, encode_batch: Callable[[List[str]], np.ndarray], window_ms: float = EMBEDDING_BATCH_WINDOW_MS, max_size: int = EMBEDDING_BATCH_MAX_SIZE):
+        self.encode_batch = encode_batch
+        self.window_ms = window_ms
+        self.max_size = max_size
+        self.enabled = window_ms > 0 and max_size > 1
+        self._queue: "queue.Queue[tuple[str, Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.last_batch_ms = 0.0
+
+    def encode(self, text: str) -> np.ndarray:
+        if not self.enabled:
+            return self.encode_batch([text])[0]
+        return self.submit(text).result()
+
+    def submit(self, text: str) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+        self._queue.put((text, future))
+        return future
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window_ms / 1000.0
+            while len(batch) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            started = time.perf_counter()
+            try:
+                vectors = dict(zip(texts, self.encode_batch(texts)))
+                for text, future in batch:
+                    future.set_result(vectors[text])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+                self.last_batch_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "window_ms": self.window_ms,
+                "max_size": self.max_size,
+                "queue_depth": self._queue.qsize(),
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "last_batch_ms": self.last_batch_ms,
+            }
+
+
 class EmbeddingService:
-    def __init__(self, model_name: str = "sentence-transformers/all-mpnet-base-v2"):
-        self.embedding_model = model_name
-        self.model = SentenceTransformer(model_name)
-    
-    def generate_embeddings(self, chunks: List[KnowledgeChunk]) -> List[KnowledgeChunk]:
-        texts = [c.content for c in chunks]
-        vectors = self.model.encode(texts, batch_size=16, show_progress_bar=False).tolist()
-        for c, v in zip(chunks, vectors):
-            c.embedding = v
+    def __init__(self, model_name: str = EMBEDDING_MODEL, cache: Optional[EmbeddingCache] = None, backend: str = EMBEDDING_BACKEND, server_url: str = EMBEDDING_SERVER_URL):
+        self.remote = False
+        if server_url:
+            # Thin client: the model lives in the shared embedding server (see embedding_server.py)
+            from app.core.embedding_server import RemoteEncoder
+            try:
+                self.model = RemoteEncoder(server_url)
+                model_name, backend, self.remote = self.model.model_name, self.model.backend, True
+                print(f"Using embedding server at {server_url} ({model_name}, {backend})")
+            except Exception as e:
+                print(f"Embedding server {server_url} unavailable ({e}); loading the model in-process")
+        if not self.remote:
+            self.model = load_sentence_transformer(model_name, backend)
+        self.backend = backend
+        # Cache namespace: quantized/ONNX vectors differ slightly from PyTorch ones, so keep them apart
+        self.embedding_model = model_name if backend == "torch" else f"{model_name}@{backend}"
+        self.model_name = model_name
+        # Content-hash cache so unchanged chunk text is never re-encoded (disabled when max entries <= 0)
+        if cache is None and EMBEDDING_CACHE_MAX_ENTRIES > 0:
+            cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES)
+        self.cache = cache
+        # In-memory LRU for query embeddings (canned dashboard/frontend questions repeat constantly),
+        # backed by a separate, separately bounded table so one-off questions never evict chunk vectors
+        self.query_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL_SECONDS)
+        self.query_disk_cache: Optional[EmbeddingCache] = None
+        if QUERY_EMBEDDING_CACHE_DISK and QUERY_EMBEDDING_CACHE_DISK_MAX_ENTRIES > 0:
+            self.query_disk_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, QUERY_EMBEDDING_CACHE_DISK_MAX_ENTRIES, table="query_embeddings")
+        # Query-time cache misses from concurrent requests share one forward pass
+        self.batcher = EmbeddingBatcher(lambda texts: self.model.encode(texts, batch_size=len(texts), show_progress_bar=False))
+        # Per-thread bulk session (see bulk_session): concurrent tenant ingests each get their own
+        self._local = threading.local()
+        # One encode pool per process, shared by every open bulk session and stopped when the last one ends
+        self._pool = None
+        self._pool_size = 0
+        self._pool_users = 0
+        self._pool_lock = threading.Lock()
+        # The pool's input/output queues are shared, so one encode_multi_process call at a time
+        self._pool_encode_lock = threading.Lock()
+
+    @contextmanager
+    def bulk_session(self) -> Iterator[None]:
+        """Use the process-wide multi-process encode pool across the generate_embeddings calls of a streaming ingest.
+
+        Inside the session the pool is joined once the texts encoded so far
+        reach EMBEDDING_POOL_MIN_CHUNKS, and then serves every later window.
+        Concurrent sessions (other tenants' jobs) share the same
+        EMBEDDING_POOL_WORKERS processes and take turns encoding, so N
+        ingests never start N pools. The pool stops when the last session
+        using it ends. Without a session each call joins and leaves on its own.
+        """
+        session: Dict[str, Any] = {"texts": 0, "pool": None, "disabled": False}
+        self._local.session = session
+        try:
+            yield
+        finally:
+            self._local.session = None
+            if session["pool"] is not None:
+                self._release_pool()
+
+    def _acquire_pool(self, workers: int):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = self.model.start_multi_process_pool(target_devices=["cpu"] * workers)
+                self._pool_size = workers
+            self._pool_users += 1
+            return self._pool
+
+    def _release_pool(self) -> None:
+        with self._pool_lock:
+            self._pool_users -= 1
+            if self._pool_users <= 0 and self._pool is not None:
+                self.model.stop_multi_process_pool(self._pool)
+                self._pool, self._pool_size, self._pool_users = None, 0, 0
+
+    def generate_embeddings(self, chunks: List[KnowledgeChunk], stats: Optional[Dict[str, Any]] = None) -> List[KnowledgeChunk]:
+        """Set `embedding` on every chunk (cache hits first, then one encode of each new text).
+
+        When given, `stats` is filled with this call's counters (chunks,
+        cache_hits, encoded, mode, workers, batch_size, encode_seconds). They
+        are per call because concurrent tenant ingests share this service.
+        """
+        hashes = [content_hash(c.content) for c in chunks]
+        cached = self.cache.get_many(self.embedding_model, hashes) if self.cache else {}
+        pending = [(c, h) for c, h in zip(chunks, hashes) if h not in cached]
+        # Encode each distinct new/changed text once
+        unique_texts = {h: c.content for c, h in pending}
+        encoded: Dict[str, np.ndarray] = {}
+        encode_stats: Dict[str, Any] = {"mode": "none", "workers": 0, "batch_size": 0, "encode_seconds": 0.0}
+        if unique_texts:
+            # Longest first so each batch holds similar lengths (little padding), then restore order
+            order = sorted(unique_texts, key=lambda h: len(unique_texts[h]), reverse=True)
+            started = time.perf_counter()
+            vectors, encode_stats = self._encode_bulk([unique_texts[h] for h in order])
+            encode_stats["encode_seconds"] = round(time.perf_counter() - started, 3)
+            # Rows are views into the single float32 matrix returned by encode (no per-vector copies)
+            encoded = dict(zip(order, vectors))
+            if self.cache:
+                self.cache.put_many(self.embedding_model, encoded)
+        for c, h in zip(chunks, hashes):
+            c.embedding = cached[h] if h in cached else encoded.get(h)
+        seconds = encode_stats["encode_seconds"]
+        if stats is not None:
+            stats.update(
+                chunks=len(chunks),
+                cache_hits=len(chunks) - len(pending),
+                encoded=len(unique_texts),
+                **encode_stats,
+                chunks_per_sec=round(len(unique_texts) / seconds, 2) if seconds else None,
+            )
         return chunks
-    
-    def generate_single_embedding(self, text: str) -> List[float]:
-        return self.model.encode([text])[0].tolist()
-    
+
+    def _pool_workers(self, n_texts: int) -> int:
+        if n_texts < EMBEDDING_POOL_MIN_CHUNKS:
+            return 1
+        return max(1, EMBEDDING_POOL_WORKERS)
+
+    def _encode_bulk(self, texts: List[str]) -> tuple[np.ndarray, Dict[str, Any]]:
+        """Encode many texts, spreading them over a worker-process pool for large ingests."""
+        if self.remote:
+            # The server owns batching and memory sizing
+            return self.model.encode(texts), {"mode": "remote", "workers": 1, "batch_size": None}
+        session = getattr(self._local, "session", None)
+        if session is not None:
+            session["texts"] += len(texts)
+            workers = 1 if session["disabled"] else self._pool_workers(session["texts"])
+        else:
+            workers = self._pool_workers(len(texts))
+        batch_size = adaptive_batch_size(self.model, workers)
+        if workers > 1:
+            pool = session["pool"] if session is not None else None
+            try:
+                if pool is None:
+                    pool = self._acquire_pool(workers)
+                    if session is not None:
+                        session["pool"] = pool
+                workers = self._pool_size
+                # Contiguous slices of the length-sorted list keep each worker's batches uniform
+                chunk_size = max(batch_size, -(-len(texts) // (workers * 4)))
+                with self._pool_encode_lock:
+                    vectors = self.model.encode_multi_process(texts, pool, batch_size=batch_size, chunk_size=chunk_size)
+                return np.asarray(vectors, dtype=np.float32), {"mode": "multi_process", "workers": workers, "batch_size": batch_size}
+            except Exception as e:
+                print(f"Multi-process embedding failed ({e}); falling back to a single process")
+                batch_size = adaptive_batch_size(self.model, 1)
+                if session is not None:
+                    session["disabled"] = True
+            finally:
+                # A session keeps its place in the pool until the session ends
+                if pool is not None and (session is None or session["disabled"]):
+                    self._release_pool()
+                    if session is not None:
+                        session["pool"] = None
+        vectors = self.model.encode(texts, batch_size=batch_size, show_progress_bar=False)
+        return np.asarray(vectors, dtype=np.float32), {"mode": "single_process", "workers": 1, "batch_size": batch_size}
+
+    def generate_single_embedding(self, text: str) -> np.ndarray:
+        # The normalized form is only the cache key: the model sees the question as typed
+        normalized = normalize_query(text)
+        key = (self.embedding_model, normalized)
+        vector = self.query_cache.get(key)
+        if vector is not None:
+            return vector
+        h = content_hash(normalized)
+        if self.query_disk_cache is not None:
+            vector = self.query_disk_cache.get_many(self.embedding_model, [h]).get(h)
+        if vector is None:
+            vector = self.batcher.encode(text)
+            if self.query_disk_cache is not None:
+                self.query_disk_cache.put_many(self.embedding_model, {h: vector})
+        self.query_cache.put(key, vector)
+        return vector
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return {
+            "query_memory": self.query_cache.stats(),
+            "query_disk": self.query_disk_cache.stats() if self.query_disk_cache else None,
+            "disk": self.cache.stats() if self.cache else None,
+            "query_batching": self.batcher.stats(),
+        }
+
     def get_embedding_dimension(self) -> int:
-        return len(self.generate_single_embedding("dimension probe"))
\ No newline at end of file
+        return len(self.generate_single_embedding("dimension probe"))
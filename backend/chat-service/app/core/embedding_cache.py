@@ -0,0 +1,95 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Sequence
+
+import numpy as np
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent (embedding model, sha256(chunk text)) -> float32 vector cache.
+
+    Lets re-ingests skip SentenceTransformer for chunks whose text is
+    unchanged. Bounded to `max_entries`; least-recently-used rows are evicted
+    after each write. Each `table` is a separately bounded namespace in the
+    same SQLite file (query vectors use their own, see embedder.py).
+    """
+
+    def __init__(self, db_path: str, max_entries: int = 200_000, table: str = "embeddings"):
+        if not table.isidentifier():
+            raise ValueError(f"Invalid embedding cache table name: {table}")
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        parent = os.path.dirname(db_path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "model TEXT NOT NULL, content_hash TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL, "
+                "PRIMARY KEY (model, content_hash))"
+            )
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_last_used ON {table}(last_used)")
+            self._count = self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def get_many(self, model: str, hashes: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Return {hash: vector} for the hashes present in the cache (and refresh their LRU stamp)."""
+        found: Dict[str, np.ndarray] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT content_hash, vector FROM {self.table} WHERE model = ? AND content_hash IN ({placeholders})",
+                    (model, *part),
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                now = time.time()
+                with self._conn:
+                    self._conn.executemany(
+                        f"UPDATE {self.table} SET last_used = ? WHERE model = ? AND content_hash = ?",
+                        [(now, model, h) for h in found],
+                    )
+            self.hits += len(found)
+            self.misses += len(unique) - len(found)
+        return found
+
+    def put_many(self, model: str, items: Dict[str, Sequence[float]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (model, content_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, h, np.asarray(v, dtype=np.float32).tobytes(), now) for h, v in items.items()],
+            )
+            self._count = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+            overflow = self._count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE rowid IN (SELECT rowid FROM {self.table} ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self._count -= overflow
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": self._count, "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._count = 0
@@ -0,0 +1,135 @@
+"""Shared embedding model server.
+
+One process loads the SentenceTransformer model and serves encode requests.
+Any number of chat-service workers then connect to it with
+EMBEDDING_SERVER_URL and run `EmbeddingService` as a thin client
+(`RemoteEncoder`), so the ~400 MB model is resident once per host instead
+of once per worker.
+
+Run (from backend/chat-service):
+    python -m app.core.embedding_server --uds /tmp/vendoriq-embeddings.sock
+    python -m app.core.embedding_server --port 4006          # localhost HTTP
+
+then start the workers with
+    EMBEDDING_SERVER_URL=unix:///tmp/vendoriq-embeddings.sock   (or http://127.0.0.1:4006)
+
+Wire format: POST /encode {"texts": [...], "batch_size": n}. The response
+body is the raw float32 matrix (row-major) with its shape in the
+X-Embedding-Rows / X-Embedding-Dim headers, so vectors are never boxed into
+JSON floats. Single-text requests from different workers go through one
+`EmbeddingBatcher`, so concurrent queries share forward passes here too.
+"""
+import argparse
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+from fastapi import FastAPI, Response
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+
+from app.config import EMBEDDING_BACKEND, EMBEDDING_MODEL, EMBEDDING_SERVER_TIMEOUT_SECONDS
+
+REQUEST_MAX_TEXTS = 1024
+
+
+class RemoteEncoder:
+    """Client for the embedding server exposing the parts of SentenceTransformer that EmbeddingService uses."""
+
+    def __init__(self, server_url: str, timeout: float = EMBEDDING_SERVER_TIMEOUT_SECONDS):
+        self.server_url = server_url
+        if server_url.startswith("unix://"):
+            transport = httpx.HTTPTransport(uds=server_url[len("unix://"):])
+            self._client = httpx.Client(transport=transport, base_url="http://embedding-server", timeout=timeout)
+        else:
+            self._client = httpx.Client(base_url=server_url.rstrip("/"), timeout=timeout)
+        # Fails fast (httpx error) when the server is unreachable; EmbeddingService falls back to a local model
+        info = self._client.get("/info").raise_for_status().json()
+        self.model_name: str = info["model"]
+        self.backend: str = info["backend"]
+        self.max_seq_length: int = info["max_seq_length"]
+        self._dimension: int = info["dimension"]
+
+    def encode(self, texts: List[str], batch_size: Optional[int] = None, show_progress_bar: bool = False, **_: Any) -> np.ndarray:
+        texts = list(texts)
+        parts = []
+        # Bounded request bodies for bulk ingests
+        for i in range(0, len(texts), REQUEST_MAX_TEXTS):
+            resp = self._client.post("/encode", json={"texts": texts[i:i + REQUEST_MAX_TEXTS], "batch_size": batch_size})
+            resp.raise_for_status()
+            rows, dim = int(resp.headers["X-Embedding-Rows"]), int(resp.headers["X-Embedding-Dim"])
+            parts.append(np.frombuffer(resp.content, dtype=np.float32).reshape(rows, dim))
+        if not parts:
+            return np.zeros((0, self._dimension), dtype=np.float32)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self._dimension
+
+
+class EncodeRequest(BaseModel):
+    texts: List[str]
+    batch_size: Optional[int] = None
+
+
+def create_app(model_name: str = EMBEDDING_MODEL, backend: str = EMBEDDING_BACKEND) -> FastAPI:
+    from app.core.embedder import EmbeddingBatcher, adaptive_batch_size, load_sentence_transformer
+
+    model = load_sentence_transformer(model_name, backend)
+    batcher = EmbeddingBatcher(lambda texts: model.encode(texts, batch_size=len(texts), show_progress_bar=False))
+    stats: Dict[str, int] = {"requests": 0, "texts": 0}
+    app = FastAPI(title="VendorIQ Embedding Server")
+
+    @app.get("/info")
+    def info() -> Dict[str, Any]:
+        return {
+            "model": model_name,
+            "backend": backend,
+            "dimension": model.get_sentence_embedding_dimension(),
+            "max_seq_length": getattr(model, "max_seq_length", None) or 384,
+        }
+
+    @app.get("/health")
+    def health() -> Dict[str, Any]:
+        return {"status": "ok", **info(), **stats, "query_batching": batcher.stats()}
+
+    @app.post("/encode")
+    async def encode(payload: EncodeRequest) -> Response:
+        stats["requests"] += 1
+        stats["texts"] += len(payload.texts)
+        if len(payload.texts) == 1:
+            # Per-query calls from all workers are micro-batched together
+            vectors = np.asarray([await run_in_threadpool(batcher.encode, payload.texts[0])], dtype=np.float32)
+        else:
+            batch_size = payload.batch_size or adaptive_batch_size(model)
+            vectors = await run_in_threadpool(model.encode, payload.texts, batch_size=batch_size, show_progress_bar=False)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(payload.texts), -1)
+        return Response(
+            content=vectors.tobytes(),
+            media_type="application/octet-stream",
+            headers={"X-Embedding-Rows": str(vectors.shape[0]), "X-Embedding-Dim": str(vectors.shape[1])},
+        )
+
+    return app
+
+
+def main(argv: List[str] | None = None) -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Shared embedding model server")
+    parser.add_argument("--uds", help="serve on this Unix socket path instead of TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4006)
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--backend", default=EMBEDDING_BACKEND)
+    args = parser.parse_args(argv)
+
+    app = create_app(args.model, args.backend)
+    if args.uds:
+        uvicorn.run(app, uds=args.uds)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Bounded thread pools for the blocking parts of the chat service.
+
+The orchestrator is synchronous: SentenceTransformer encoding, Chroma/SQLite
+reads and writes, and Drive downloads. Async routes hand that work to one of
+two pools instead of running it on the event loop:
+
+- ML_EXECUTOR (ML_EXECUTOR_WORKERS): embedding, retrieval and ingest pipelines.
+- IO_EXECUTOR (IO_EXECUTOR_WORKERS): vector store / sidecar reads and other short blocking calls.
+
+Gemini calls stay async-native and use neither pool.
+
+Bulk work (ingest) is submitted with bulk=True and may occupy at most
+`max_workers - reserved_interactive` threads of a pool. The remaining threads
+are kept for interactive queries, so a long /knowledge/load cannot starve
+/query. Each pool reports queue depth, running tasks and queue wait times,
+split by interactive and bulk (see `executor_stats`, included in /health).
+"""
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.config import IO_EXECUTOR_WORKERS, ML_EXECUTOR_RESERVED_INTERACTIVE, ML_EXECUTOR_WORKERS
+
+
+class BoundedExecutor:
+    """ThreadPoolExecutor with queue/wait metrics and bulk slots capped below max_workers."""
+
+    def __init__(self, name: str, max_workers: int, reserved_interactive: int = 0):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.reserved_interactive = min(max(0, reserved_interactive), self.max_workers - 1)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{name}-worker")
+        self._lock = threading.Lock()
+        self._bulk_gate: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+        self._stats: Dict[str, Dict[str, float]] = {
+            kind: {"queued": 0, "running": 0, "completed": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0, "waiting_for_slot": 0}
+            for kind in ("interactive", "bulk")
+        }
+
+    def _gate(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._bulk_gate is None or self._bulk_gate[0] is not loop:
+            self._bulk_gate = (loop, asyncio.Semaphore(self.max_workers - self.reserved_interactive))
+        return self._bulk_gate[1]
+
+    def _instrument(self, kind: str, fn: Callable[..., Any], submitted: float) -> Callable[[], Any]:
+        stats = self._stats[kind]
+        with self._lock:
+            stats["queued"] += 1
+
+        def run() -> Any:
+            waited = time.perf_counter() - submitted
+            with self._lock:
+                stats["queued"] -= 1
+                stats["running"] += 1
+                stats["wait_seconds_total"] += waited
+                stats["wait_seconds_max"] = max(stats["wait_seconds_max"], waited)
+            try:
+                return fn()
+            finally:
+                with self._lock:
+                    stats["running"] -= 1
+                    stats["completed"] += 1
+
+        return run
+
+    async def run(self, fn: Callable[..., Any], *args: Any, bulk: bool = False, **kwargs: Any) -> Any:
+        """Run fn(*args, **kwargs) on this pool and await its result.
+
+        Cancelling the awaiting task does not interrupt a call that has already
+        started; its result is discarded.
+        """
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args, **kwargs)
+        if not bulk:
+            return await loop.run_in_executor(self._pool, self._instrument("interactive", call, time.perf_counter()))
+        # Bulk wait time includes the time spent waiting for a bulk slot
+        submitted = time.perf_counter()
+        gate = self._gate()
+        with self._lock:
+            self._stats["bulk"]["waiting_for_slot"] += 1
+        try:
+            await gate.acquire()
+        finally:
+            with self._lock:
+                self._stats["bulk"]["waiting_for_slot"] -= 1
+        try:
+            return await loop.run_in_executor(self._pool, self._instrument("bulk", call, submitted))
+        finally:
+            gate.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = {
+                "max_workers": self.max_workers,
+                "reserved_interactive": self.reserved_interactive,
+                "queue_depth": int(sum(s["queued"] for s in self._stats.values())),
+            }
+            for kind, s in self._stats.items():
+                started = s["completed"] + s["running"]
+                out[kind] = {
+                    "queued": int(s["queued"]),
+                    "running": int(s["running"]),
+                    "completed": int(s["completed"]),
+                    "avg_wait_ms": round(1000 * s["wait_seconds_total"] / started, 2) if started else 0.0,
+                    "max_wait_ms": round(1000 * s["wait_seconds_max"], 2),
+                    **({"waiting_for_slot": int(s["waiting_for_slot"])} if kind == "bulk" else {}),
+                }
+            return out
+
+
+ML_EXECUTOR = BoundedExecutor("ml", ML_EXECUTOR_WORKERS, reserved_interactive=ML_EXECUTOR_RESERVED_INTERACTIVE)
+IO_EXECUTOR = BoundedExecutor("io", IO_EXECUTOR_WORKERS, reserved_interactive=max(1, IO_EXECUTOR_WORKERS // 4))
+
+
+async def run_ml(fn: Callable[..., Any], *args: Any, bulk: bool = False, **kwargs: Any) -> Any:
+    return await ML_EXECUTOR.run(fn, *args, bulk=bulk, **kwargs)
+
+
+async def run_io(fn: Callable[..., Any], *args: Any, bulk: bool = False, **kwargs: Any) -> Any:
+    return await IO_EXECUTOR.run(fn, *args, bulk=bulk, **kwargs)
+
+
+def executor_stats() -> Dict[str, Any]:
+    return {"ml": ML_EXECUTOR.stats(), "io": IO_EXECUTOR.stats()}
@@ -0,0 +1,148 @@
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.core.aggregates import parse_amount, parse_invoice_date
+
+_INVOICE_COLUMNS = (
+    "invoice_id", "vendor_name", "invoice_number", "invoice_date", "invoice_date_raw", "total_amount",
+    "drive_file_id", "file_name", "processed_at", "web_view_link", "web_content_link",
+)
+
+
+class InvoiceFactStore:
+    """Typed invoice / line item fact tables kept next to the vector DB.
+
+    Populated from the same chunks `store_embeddings` writes. Amounts are
+    stored as REAL, dates as ISO strings, and line items as rows, so the
+    structured answer paths (full vendor detail, vendor summary, safety
+    fallbacks, monthly analytics) can use indexed vendor and date lookups
+    instead of re-decoding Chroma's JSON-string metadata on every request.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS invoices ("
+                "invoice_id TEXT PRIMARY KEY, vendor_name TEXT NOT NULL, invoice_number TEXT, "
+                "invoice_date TEXT, invoice_date_raw TEXT, total_amount REAL NOT NULL DEFAULT 0, "
+                "drive_file_id TEXT, file_name TEXT, processed_at TEXT, web_view_link TEXT, web_content_link TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_vendor_date ON invoices(vendor_name, invoice_date)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices(invoice_date)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS line_items ("
+                "invoice_id TEXT NOT NULL, position INTEGER NOT NULL, vendor_name TEXT NOT NULL, "
+                "item_description TEXT, quantity REAL, unit_price REAL, amount REAL, "
+                "PRIMARY KEY (invoice_id, position))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_line_items_vendor ON line_items(vendor_name)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS vendors ("
+                "vendor_name TEXT PRIMARY KEY, last_updated TEXT, invoice_count INTEGER, total_amount REAL)"
+            )
+
+    def record(self, entries: Iterable[Dict[str, Any]]) -> None:
+        """Upsert facts for stored chunks ({"chunk_id", "vendor_name", "type", "metadata"})."""
+        with self._lock, self._conn:
+            for entry in entries:
+                meta = entry.get("metadata") or {}
+                vendor = entry.get("vendor_name") or meta.get("vendor_name") or "Unknown"
+                kind = entry.get("type")
+                if kind == "vendor_summary":
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO vendors (vendor_name, last_updated, invoice_count, total_amount) VALUES (?, ?, ?, ?)",
+                        (vendor, str(meta.get("last_updated") or ""), int(parse_amount(meta.get("invoice_count"))), parse_amount(meta.get("total_amount"))),
+                    )
+                    continue
+                if kind != "invoice":
+                    continue
+                invoice_id = entry["chunk_id"]
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO invoices ({', '.join(_INVOICE_COLUMNS)}) VALUES ({', '.join('?' * len(_INVOICE_COLUMNS))})",
+                    (
+                        invoice_id,
+                        vendor,
+                        str(meta.get("invoice_number") or ""),
+                        parse_invoice_date(meta.get("invoice_date")),
+                        str(meta.get("invoice_date") or ""),
+                        parse_amount(meta.get("total_amount")),
+                        str(meta.get("drive_file_id") or ""),
+                        str(meta.get("file_name") or ""),
+                        str(meta.get("processed_at") or ""),
+                        str(meta.get("web_view_link") or ""),
+                        str(meta.get("web_content_link") or ""),
+                    ),
+                )
+                line_items = meta.get("line_items") or []
+                if isinstance(line_items, str):
+                    try:
+                        line_items = json.loads(line_items)
+                    except Exception:
+                        line_items = []
+                self._conn.execute("DELETE FROM line_items WHERE invoice_id = ?", (invoice_id,))
+                self._conn.executemany(
+                    "INSERT INTO line_items (invoice_id, position, vendor_name, item_description, quantity, unit_price, amount) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            invoice_id, pos, vendor, str(li.get("item_description") or ""),
+                            parse_amount(li.get("quantity")) if li.get("quantity") not in (None, "") else None,
+                            parse_amount(li.get("unit_price")), parse_amount(li.get("amount")),
+                        )
+                        for pos, li in enumerate(line_items) if isinstance(li, dict)
+                    ],
+                )
+
+    def invoices_for_vendor(self, vendor_name: str, date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Invoices for a vendor ordered by date; optional ISO date bounds (inclusive)."""
+        sql = "SELECT * FROM invoices WHERE vendor_name = ?"
+        params: List[Any] = [vendor_name]
+        if date_from:
+            sql += " AND invoice_date >= ?"
+            params.append(date_from)
+        if date_to:
+            sql += " AND invoice_date <= ?"
+            params.append(date_to)
+        sql += " ORDER BY invoice_date IS NULL, invoice_date, invoice_number"
+        with self._lock:
+            return [dict(r) for r in self._conn.execute(sql, params).fetchall()]
+
+    def line_items_for_invoice(self, invoice_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT item_description, quantity, unit_price, amount FROM line_items WHERE invoice_id = ? ORDER BY position",
+                (invoice_id,),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def vendor_profile(self, vendor_name: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM vendors WHERE vendor_name = ?", (vendor_name,)).fetchone()
+        return dict(row) if row else None
+
+    def monthly_totals(self) -> Dict[str, float]:
+        """Declared invoice totals summed per YYYY-MM (invoices with an unparseable date are skipped)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT substr(invoice_date, 1, 7) AS month, SUM(total_amount) FROM invoices "
+                "WHERE invoice_date IS NOT NULL GROUP BY month ORDER BY month"
+            ).fetchall()
+        return {r[0]: r[1] for r in rows}
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return (
+                self._conn.execute("SELECT 1 FROM invoices LIMIT 1").fetchone() is None
+                and self._conn.execute("SELECT 1 FROM vendors LIMIT 1").fetchone() is None
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM line_items")
+            self._conn.execute("DELETE FROM invoices")
+            self._conn.execute("DELETE FROM vendors")
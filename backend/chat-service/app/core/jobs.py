@@ -0,0 +1,176 @@
+"""Background ingest jobs for /knowledge/load and /knowledge/ingest.
+
+The routes enqueue a job and return its ID at once. Clients then poll
+`/knowledge/jobs/{id}`. Each tenant (the `userId`, or the shared collection
+when omitted) gets one asyncio worker task. The worker runs that tenant's
+jobs one at a time, so two ingests never write the same collection
+concurrently, while different tenants proceed in parallel. Each job runs
+on the ML pool as bulk work (see executors.py).
+
+A job that is still queued absorbs later submissions of the same kind for
+the same tenant instead of queueing another pass:
+
+- ingest: when the vendor sets overlap, vendor payloads are merged and newer
+  records for a vendor replace the queued ones.
+- load: the queued reload is kept and takes the newest refresh token
+  (a submission without one keeps the queued token).
+
+The merged job is incremental only if every absorbed request was. Finished
+jobs are kept in a bounded history (JOB_HISTORY_SIZE).
+"""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from app.config import JOB_HISTORY_SIZE
+from app.core.executors import run_ml
+
+SHARED_TENANT = "_shared"
+FINISHED = ("succeeded", "failed")
+
+
+class IngestJob:
+    """One queued or running ingest and its progress counters."""
+
+    def __init__(self, kind: str, tenant: Optional[str], incremental: bool, params: Dict[str, Any], vendors: Optional[Dict[str, list]] = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.tenant = tenant
+        self.incremental = incremental
+        # Not reported: may hold credentials (refresh token) or large record arrays
+        self.params = params
+        self.vendors = vendors
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.coalesced = 0
+        # Updated in place by the ingest pipeline while the job runs
+        self.progress: Dict[str, Any] = {"stage": "queued", "chunks_total": 0, "chunks_embedded": 0, "chunks_stored": 0}
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        # Set when the job finishes (created on the event loop by submit)
+        self.done: Optional[asyncio.Event] = None
+
+    def absorb(self, other: "IngestJob") -> None:
+        self.incremental = self.incremental and other.incremental
+        # A later request without a value (e.g. no refresh token) keeps the queued one's
+        self.params.update({k: v for k, v in other.params.items() if v is not None})
+        if self.vendors is not None and other.vendors is not None:
+            self.vendors.update(other.vendors)
+        self.coalesced += 1
+
+    def release(self) -> None:
+        """Drop the payload once finished: history only needs vendor names, never records or tokens."""
+        self.params = {}
+        if self.vendors is not None:
+            self.vendors = dict.fromkeys(self.vendors)
+
+    def elapsed_seconds(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return round((self.finished_at or time.time()) - self.started_at, 3)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "jobId": self.id,
+            "kind": self.kind,
+            "userId": self.tenant,
+            "status": self.status,
+            "incremental": self.incremental,
+            "vendors": sorted(self.vendors) if self.vendors is not None else None,
+            "coalesced": self.coalesced,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queue_seconds": round((self.started_at or time.time()) - self.created_at, 3),
+            "elapsed_seconds": self.elapsed_seconds(),
+            "progress": dict(self.progress),
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class IngestJobManager:
+    """Per-tenant FIFO job queues with coalescing and a bounded finished-job history.
+
+    `handler(job)` does the actual ingest on a worker thread and returns the
+    orchestrator's result dict. It should keep `job.progress` current.
+    """
+
+    def __init__(self, handler: Callable[[IngestJob], Dict[str, Any]], history_size: int = JOB_HISTORY_SIZE):
+        self.handler = handler
+        self.history_size = max(1, history_size)
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._queues: Dict[str, Deque[IngestJob]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+
+    def submit(self, kind: str, tenant: Optional[str], incremental: bool, params: Optional[Dict[str, Any]] = None, vendors: Optional[Dict[str, list]] = None) -> IngestJob:
+        """Queue a job (or fold it into a queued one) and make sure the tenant's worker is running."""
+        job = IngestJob(kind, tenant, incremental, dict(params or {}), vendors)
+        key = tenant or SHARED_TENANT
+        queue = self._queues.setdefault(key, deque())
+        for queued in queue:
+            if queued.kind != kind:
+                continue
+            if kind == "ingest" and not set(queued.vendors or ()) & set(vendors or ()):
+                continue
+            queued.absorb(job)
+            return queued
+        job.done = asyncio.Event()
+        queue.append(job)
+        self._jobs[job.id] = job
+        self._trim()
+        worker = self._workers.get(key)
+        if worker is None or worker.done():
+            self._workers[key] = asyncio.get_running_loop().create_task(self._drain(key))
+        return job
+
+    async def wait(self, job: IngestJob) -> IngestJob:
+        await job.done.wait()
+        return job
+
+    async def _drain(self, key: str) -> None:
+        queue = self._queues[key]
+        while queue:
+            # The job stays visible in the queue (and open to coalescing) until it starts
+            job = queue.popleft()
+            job.status = "running"
+            job.started_at = time.time()
+            job.progress["stage"] = "running"
+            try:
+                result = await run_ml(self.handler, job, bulk=True)
+                job.result = result
+                job.status = "succeeded" if result.get("success") else "failed"
+                if not result.get("success"):
+                    job.error = result.get("message", "Ingest failed")
+            except Exception as e:
+                print(f"Ingest job {job.id} failed: {e}")
+                job.status = "failed"
+                job.error = str(e)
+            job.finished_at = time.time()
+            job.progress["stage"] = job.status
+            job.release()
+            job.done.set()
+        self._queues.pop(key, None)
+        self._workers.pop(key, None)
+
+    def _trim(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED]
+        for job_id in finished[: max(0, len(finished) - self.history_size)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self._jobs.get(job_id)
+
+    def list(self, tenant: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        jobs = [job for job in reversed(self._jobs.values()) if tenant is None or job.tenant == tenant]
+        return [job.to_dict() for job in jobs[:limit]]
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {"queued": 0, "running": 0, "succeeded": 0, "failed": 0}
+        for job in self._jobs.values():
+            counts[job.status] += 1
+        return {**counts, "tenants_active": len(self._workers), "coalesced": sum(j.coalesced for j in self._jobs.values())}
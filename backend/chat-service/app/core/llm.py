@@ -1,11 +1,16 @@
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
+import asyncio
 import os
 from dotenv import load_dotenv
 import google.generativeai as genai
+from app.config import LLM_TIMEOUT_SECONDS
 
 load_dotenv()  # Ensure .env is loaded even if config not imported yet
 
 GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-2.5-flash")
+SAFETY_BLOCKED_MESSAGE = (
+    "Response blocked by safety filters. Please rephrase the question to be strictly factual about vendor invoices/invoice data without requesting disallowed content."
+)
 
 class GeminiLLM:
     def __init__(self, model_name: str = GEMINI_MODEL_NAME, temperature: float = 0.7, max_tokens: int = 256):
@@ -36,31 +41,77 @@ class GeminiLLM:
         # Combine system + user prompt into a single instruction block; Gemini supports system instruction via model.start_chat but here we inline.
         full_prompt = f"System: {system}\nUser: {prompt}" if system else prompt
         try:
-            response = self.model.generate_content(full_prompt)
-            # Handle safety or empty parts gracefully before accessing response.text
-            if hasattr(response, "candidates") and response.candidates:
-                for c in response.candidates:
-                    # Gemini SDK uses finish_reason (enum) - map known numeric codes
-                    fr = getattr(c, "finish_reason", None) or getattr(c, "finishReason", None)
-                    # Common finish reasons (approx): 0=STOP,1=MAX_TOKENS,2=SAFETY,3=RECITATION,4=OTHER
-                    if fr in (2, "SAFETY") and (not c.content or not getattr(c.content, "parts", [])):
-                        return ("Response blocked by safety filters. Please rephrase the question to be strictly factual about vendor invoices/invoice data without requesting disallowed content.")
-            if hasattr(response, "text") and response.text:
-                return response.text.strip()
-            # Fallback: concatenate parts
-            if hasattr(response, "candidates"):
-                for c in response.candidates:
-                    if c.content and c.content.parts:
-                        texts = []
-                        for p in c.content.parts:
-                            if hasattr(p, "text") and p.text:
-                                texts.append(p.text)
-                        if texts:
-                            return "\n".join(t.strip() for t in texts if t).strip()
-            return str(response)
+            response = self.model.generate_content(full_prompt, request_options={"timeout": LLM_TIMEOUT_SECONDS})
+            return self._response_text(response)
         except Exception as e:
             return f"Error generating content: {e}".strip()
 
+    async def generate_async(self, prompt: str, system: Optional[str] = None, timeout: float = LLM_TIMEOUT_SECONDS) -> str:
+        """Non-blocking `generate` using the SDK's async client.
+
+        Bounded by `timeout` seconds. Cancellation (asyncio.CancelledError)
+        is not swallowed: it propagates so an abandoned request stops waiting
+        on Gemini.
+        """
+        full_prompt = f"System: {system}\nUser: {prompt}" if system else prompt
+        try:
+            response = await asyncio.wait_for(
+                self.model.generate_content_async(full_prompt, request_options={"timeout": timeout}), timeout
+            )
+            return self._response_text(response)
+        except asyncio.TimeoutError:
+            return f"Error generating content: Gemini did not respond within {timeout:g}s"
+        except Exception as e:
+            return f"Error generating content: {e}".strip()
+
+    async def stream_async(self, prompt: str, system: Optional[str] = None, timeout: float = LLM_TIMEOUT_SECONDS) -> AsyncIterator[str]:
+        """Yield answer text pieces as Gemini streams them.
+
+        `timeout` bounds the wait for each piece, not the whole stream. Pieces
+        without text (e.g. a safety-blocked candidate) are skipped. If nothing
+        was yielded, the caller should treat the answer as blocked.
+        """
+        full_prompt = f"System: {system}\nUser: {prompt}" if system else prompt
+        stream = await asyncio.wait_for(
+            self.model.generate_content_async(full_prompt, stream=True, request_options={"timeout": timeout}), timeout
+        )
+        iterator = stream.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), timeout)
+            except StopAsyncIteration:
+                return
+            try:
+                text = chunk.text
+            except Exception:
+                text = ""
+            if text:
+                yield text
+
+    @staticmethod
+    def _response_text(response) -> str:
+        # Handle safety or empty parts gracefully before accessing response.text
+        if hasattr(response, "candidates") and response.candidates:
+            for c in response.candidates:
+                # Gemini SDK uses finish_reason (enum) - map known numeric codes
+                fr = getattr(c, "finish_reason", None) or getattr(c, "finishReason", None)
+                # Common finish reasons (approx): 0=STOP,1=MAX_TOKENS,2=SAFETY,3=RECITATION,4=OTHER
+                if fr in (2, "SAFETY") and (not c.content or not getattr(c.content, "parts", [])):
+                    return SAFETY_BLOCKED_MESSAGE
+        if hasattr(response, "text") and response.text:
+            return response.text.strip()
+        # Fallback: concatenate parts
+        if hasattr(response, "candidates"):
+            for c in response.candidates:
+                if c.content and c.content.parts:
+                    texts = []
+                    for p in c.content.parts:
+                        if hasattr(p, "text") and p.text:
+                            texts.append(p.text)
+                    if texts:
+                        return "\n".join(t.strip() for t in texts if t).strip()
+        return str(response)
+
     def chat(self, messages: List[dict]) -> str:
         # Build history for Gemini chat if needed; last user message used for response
         system_prompt = next((m["content"] for m in messages if m.get("role") == "system"), "")
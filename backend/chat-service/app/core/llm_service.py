@@ -1,7 +1,34 @@
-from typing import Dict, Any, List, Optional
-from app.core.embedder import EmbeddingService
+import json
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Any, Hashable, List, Optional, Tuple
+import numpy as np
+from app.core.cache import LRUCache, SemanticCache
+from app.core.embedder import EmbeddingService, normalize_query
+from app.core.executors import run_io
 from app.core.retriever import VectorDatabase
-from app.core.llm import get_llm_instance
+from app.core.llm import get_llm_instance, SAFETY_BLOCKED_MESSAGE
+from app.config import (
+    ANSWER_CACHE_SIZE,
+    ANSWER_CACHE_TTL_SECONDS,
+    SEMANTIC_CACHE_AUDIT_LOG,
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_SIZE,
+    SEMANTIC_CACHE_THRESHOLD,
+)
+
+# Bump whenever _build_prompt changes so answers generated from the old prompt are not reused
+PROMPT_VERSION = "rag-v1"
+
+# Audit records waiting for the writer thread; beyond this they are dropped (and counted) rather than block
+_AUDIT_QUEUE_SIZE = 10000
+
+# Invoice numbers, amounts and dates: questions that differ only in these embed almost identically
+_NUMBER_TOKEN = re.compile(r"\d[\d,./-]*")
 
 RAG_SYSTEM_PROMPT = (
     "You are a helpful assistant answering questions about vendor invoices. "
@@ -14,6 +41,156 @@ class LLMService:
         self.embedding_service = embedding_service
         self.vector_db = vector_db
         self.llm = get_llm_instance()
+        # Identical question + identical retrieved chunks + unchanged data => identical prompt; skip the paid call
+        self.answer_cache = LRUCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL_SECONDS)
+        self.llm_seconds_saved = 0.0
+        self.llm_seconds_spent = 0.0
+        self.llm_calls = 0
+        # Paraphrased questions for the same vendor scope and data version reuse the stored answer
+        self.semantic_cache = SemanticCache(SEMANTIC_CACHE_SIZE, ANSWER_CACHE_TTL_SECONDS) if SEMANTIC_CACHE_ENABLED else None
+        self.semantic_threshold = SEMANTIC_CACHE_THRESHOLD
+        self.semantic_hits = 0
+        self.semantic_misses = 0
+        self.semantic_suspect_hits = 0
+        self.audit_log_path = SEMANTIC_CACHE_AUDIT_LOG
+        # Cache lookups run on the event loop too: records are queued and appended by a daemon thread
+        self._audit_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=_AUDIT_QUEUE_SIZE)
+        self._audit_lock = threading.Lock()
+        self._audit_thread: Optional[threading.Thread] = None
+        self.audit_dropped = 0
+
+    @staticmethod
+    def _chunk_ids(sources: List[Dict[str, Any]]) -> Tuple[str, ...]:
+        return tuple(sorted(str(s.get("chunk_id") or s.get("invoice_number") or s.get("rank")) for s in sources))
+
+    def _answer_cache_key(self, question: str, sources: List[Dict[str, Any]], cache_scope: Tuple[Hashable, ...]) -> Tuple[Hashable, ...]:
+        """cache_scope is (collection name, vendor data version, vendor) as supplied by the orchestrator."""
+        return (PROMPT_VERSION, *cache_scope, normalize_query(question), self._chunk_ids(sources))
+
+    @staticmethod
+    def _semantic_scope(question: str, cache_scope: Tuple[Hashable, ...]) -> Tuple[Hashable, ...]:
+        collection, _, vendor = cache_scope
+        numbers = tuple(sorted(set(_NUMBER_TOKEN.findall(normalize_query(question)))))
+        return (PROMPT_VERSION, collection, vendor, numbers)
+
+    def cached_answer(self, question: str, sources: List[Dict[str, Any]], cache_scope: Optional[Tuple[Hashable, ...]], query_embedding: Optional[np.ndarray] = None) -> Optional[Dict[str, Any]]:
+        """Exact (question + retrieved chunks) hit first, then the nearest paraphrase if a query embedding is given."""
+        if cache_scope is None:
+            return None
+        hit = self.answer_cache.get(self._answer_cache_key(question, sources, cache_scope))
+        if hit is not None:
+            self.llm_seconds_saved += hit["llm_seconds"]
+            return {**hit["response"], "cached": True}
+        if self.semantic_cache is None or query_embedding is None:
+            return None
+        match = self.semantic_cache.nearest(self._semantic_scope(question, cache_scope), cache_scope[1], query_embedding)
+        if match is None or match[0] < self.semantic_threshold:
+            self.semantic_misses += 1
+            self._audit("miss", question, cache_scope, match)
+            return None
+        similarity, _, hit = match
+        retrieved = set(self._chunk_ids(sources))
+        overlap = len(retrieved & hit["chunk_ids"]) / len(retrieved | hit["chunk_ids"]) if retrieved | hit["chunk_ids"] else 1.0
+        # The new question retrieving mostly different chunks suggests a false hit; logged for threshold tuning
+        suspect = overlap < 0.5
+        self.semantic_hits += 1
+        self.semantic_suspect_hits += int(suspect)
+        self._audit("hit", question, cache_scope, match, source_overlap=round(overlap, 3), suspect_false_hit=suspect)
+        self.llm_seconds_saved += hit["llm_seconds"]
+        return {
+            **hit["response"],
+            "question": question,
+            "cached": True,
+            "semantic_match": {"question": hit["question"], "similarity": round(similarity, 4)},
+        }
+
+    def store_answer(self, question: str, sources: List[Dict[str, Any]], cache_scope: Optional[Tuple[Hashable, ...]], response: Dict[str, Any], llm_seconds: float, query_embedding: Optional[np.ndarray] = None) -> None:
+        self.llm_calls += 1
+        self.llm_seconds_spent += llm_seconds
+        answer = response.get("answer") or ""
+        # Errors, timeouts and safety blocks are not cached
+        if cache_scope is None or not response.get("success") or not answer or answer.startswith("Error generating content") or answer == SAFETY_BLOCKED_MESSAGE:
+            return
+        self.answer_cache.put(self._answer_cache_key(question, sources, cache_scope), {"response": response, "llm_seconds": llm_seconds})
+        if self.semantic_cache is not None and query_embedding is not None:
+            self.semantic_cache.put(
+                self._semantic_scope(question, cache_scope),
+                cache_scope[1],
+                normalize_query(question),
+                query_embedding,
+                {"response": response, "llm_seconds": llm_seconds, "question": question, "chunk_ids": set(self._chunk_ids(sources))},
+            )
+
+    def _audit(self, event: str, question: str, cache_scope: Tuple[Hashable, ...], match: Optional[Tuple[float, Hashable, Any]], **fields: Any) -> None:
+        """Append one semantic cache decision to the JSONL audit log (best effort)."""
+        if not self.audit_log_path:
+            return
+        record = {
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "event": event,
+            "collection": cache_scope[0],
+            "vendor": cache_scope[2],
+            "question": question,
+            "matched_question": match[2]["question"] if match else None,
+            "similarity": round(match[0], 4) if match else None,
+            "threshold": self.semantic_threshold,
+            **fields,
+        }
+        with self._audit_lock:
+            if self._audit_thread is None:
+                self._audit_thread = threading.Thread(target=self._write_audit, name="semantic-cache-audit", daemon=True)
+                self._audit_thread.start()
+        try:
+            self._audit_queue.put_nowait(record)
+        except queue.Full:
+            self.audit_dropped += 1
+
+    def _write_audit(self) -> None:
+        """Writer thread: append queued audit records, a whole backlog per file open."""
+        while True:
+            records = [self._audit_queue.get()]
+            while True:
+                try:
+                    records.append(self._audit_queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if self.audit_log_path:
+                    os.makedirs(os.path.dirname(self.audit_log_path) or ".", exist_ok=True)
+                    with open(self.audit_log_path, "a", encoding="utf-8") as f:
+                        f.write("".join(json.dumps(r) + "\n" for r in records))
+            except OSError as e:
+                print(f"Semantic cache audit log disabled ({e})")
+                self.audit_log_path = ""
+            finally:
+                for _ in records:
+                    self._audit_queue.task_done()
+
+    def flush_audit(self) -> None:
+        """Block until every queued audit record has been written (tests, shutdown)."""
+        self._audit_queue.join()
+
+    def cache_stats(self) -> Dict[str, Any]:
+        lookups = self.semantic_hits + self.semantic_misses
+        return {
+            **self.answer_cache.stats(),
+            "prompt_version": PROMPT_VERSION,
+            "llm_calls": self.llm_calls,
+            "llm_seconds_spent": round(self.llm_seconds_spent, 3),
+            "llm_seconds_saved": round(self.llm_seconds_saved, 3),
+            "avg_llm_seconds": round(self.llm_seconds_spent / self.llm_calls, 3) if self.llm_calls else 0.0,
+            "semantic": {
+                "enabled": self.semantic_cache is not None,
+                "threshold": self.semantic_threshold,
+                "hits": self.semantic_hits,
+                "misses": self.semantic_misses,
+                "hit_ratio": round(self.semantic_hits / lookups, 4) if lookups else 0.0,
+                "suspect_false_hits": self.semantic_suspect_hits,
+                "audit_log": self.audit_log_path or None,
+                "audit_dropped": self.audit_dropped,
+                **(self.semantic_cache.stats() if self.semantic_cache is not None else {}),
+            },
+        }
 
     def _format_context(self, docs: List[str], metas: List[dict]) -> str:
         parts = []
@@ -52,21 +229,62 @@ class LLMService:
 
         return {"system_prompt": system_prompt, "user_prompt": user_prompt}
 
-    def generate_answer(self, question: str, sources: Optional[List[Dict[str, Any]]] = None, system_prompt_override: Optional[str] = None) -> Dict[str, Any]:
+    def generate_answer(self, question: str, sources: Optional[List[Dict[str, Any]]] = None, system_prompt_override: Optional[str] = None, cache_scope: Optional[Tuple[Hashable, ...]] = None, query_embedding: Optional[np.ndarray] = None) -> Dict[str, Any]:
         """Generate an answer given a question and optional retrieved sources.
-        sources may be None (e.g. vendor name detection or fallback cases)."""
+        sources may be None (e.g. vendor name detection or fallback cases).
+        With a cache_scope (and no prompt override) identical requests are served from the answer cache,
+        and with a query_embedding too, close paraphrases are served from the semantic cache."""
         try:
             sources = sources or []
+            if system_prompt_override:
+                cache_scope = None
+            cached = self.cached_answer(question, sources, cache_scope, query_embedding)
+            if cached is not None:
+                return cached
             prompts = self._build_prompt(question, sources)
             if system_prompt_override:
                 prompts["system_prompt"] = system_prompt_override
+            started = time.perf_counter()
             answer = self.llm.generate(prompts["user_prompt"], system=prompts["system_prompt"])
+            response = {
+                "success": True,
+                "question": question,
+                "answer": answer,
+                "sources_used": len(sources)
+            }
+            self.store_answer(question, sources, cache_scope, response, time.perf_counter() - started, query_embedding)
+            return response
+        except Exception as e:
             return {
+                "success": False,
+                "message": f"Error generating answer: {str(e)}",
+                "answer": "",
+                "sources_used": len(sources or [])
+            }
+
+    async def generate_answer_async(self, question: str, sources: Optional[List[Dict[str, Any]]] = None, system_prompt_override: Optional[str] = None, cache_scope: Optional[Tuple[Hashable, ...]] = None, query_embedding: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        """Async generate_answer: awaits Gemini without blocking the event loop (per-call timeout, cancellable)."""
+        try:
+            sources = sources or []
+            if system_prompt_override:
+                cache_scope = None
+            # Semantic-cache scan and write run on the I/O pool, off the event loop
+            cached = await run_io(self.cached_answer, question, sources, cache_scope, query_embedding)
+            if cached is not None:
+                return cached
+            prompts = self._build_prompt(question, sources)
+            if system_prompt_override:
+                prompts["system_prompt"] = system_prompt_override
+            started = time.perf_counter()
+            answer = await self.llm.generate_async(prompts["user_prompt"], system=prompts["system_prompt"])
+            response = {
                 "success": True,
                 "question": question,
                 "answer": answer,
                 "sources_used": len(sources)
             }
+            await run_io(self.store_answer, question, sources, cache_scope, response, time.perf_counter() - started, query_embedding)
+            return response
         except Exception as e:
             return {
                 "success": False,
@@ -78,3 +296,12 @@ class LLMService:
     def quick(self, prompt: str, system: Optional[str] = None) -> str:
         """Lightweight wrapper for direct Gemini prompt usage (no RAG formatting)."""
         return self.llm.generate(prompt, system=system)
+
+    async def quick_async(self, prompt: str, system: Optional[str] = None) -> str:
+        return await self.llm.generate_async(prompt, system=system)
+
+    async def stream_answer_async(self, question: str, sources: Optional[List[Dict[str, Any]]] = None) -> AsyncIterator[str]:
+        """Answer text pieces for the RAG prompt, streamed from Gemini."""
+        prompts = self._build_prompt(question, sources or [])
+        async for piece in self.llm.stream_async(prompts["user_prompt"], system=prompts["system_prompt"]):
+            yield piece
@@ -2,126 +2,210 @@ import json
 import os
 import hashlib
 import re
-from typing import List, Dict, Any
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Iterable, Iterator, Optional
 from datetime import datetime
+import httpx
 from app.models.schema import Vendor, Invoice, VendorDataset, KnowledgeChunk
+from app.core.chunking import InvoiceChunker, compact_text, token_stats
+from app.core.manifest import RemoteMasterManifest
+from app.config import (
+    DRIVE_API_BASE,
+    DRIVE_FETCH_CONCURRENCY,
+    DRIVE_MANIFEST_PATH,
+    DRIVE_TIMEOUT_SECONDS,
+    GOOGLE_TOKEN_URI,
+)
+
+# Vendor folders per Drive files.list query (keeps the `q` expression well under Drive's length limit)
+DRIVE_LIST_FOLDERS_PER_QUERY = 40
 
 class VendorDataLoader:
-    def __init__(self, data_directory: str = "data/vendors"):
+    def __init__(self, data_directory: str = "data/vendors", chunker: Optional[InvoiceChunker] = None, manifest_path: str = DRIVE_MANIFEST_PATH):
         """Initialize the data loader with a directory path for vendor JSON files."""
         self.data_directory = data_directory
         self.vendors_data: List[Vendor] = []
+        # Token-bounded invoice chunking (tokenizer loaded on first use)
+        self.chunker = chunker or InvoiceChunker()
         self.google_client_id = os.getenv("GOOGLE_CLIENT_ID")
         self.google_client_secret = os.getenv("GOOGLE_CLIENT_SECRET")
         self.email_service_base = os.getenv("EMAIL_STORAGE_SERVICE_URL", "http://localhost:4002/api/v1")
+        self.manifest_path = manifest_path
+        self._manifest: Optional[RemoteMasterManifest] = None
         
     def load_vendor_json_files(self) -> VendorDataset:
         """Load all vendor JSON files from the specified directory."""
-        vendors: List[Vendor] = []
-        
+        vendors = list(self.iter_vendor_json_files())
+        dataset = VendorDataset(vendors=vendors)
+        self.vendors_data = vendors
+        return dataset
+
+    def iter_vendor_json_files(self) -> Iterator[Vendor]:
+        """Yield one parsed Vendor per JSON file (only the current file is held in memory)."""
         if not os.path.exists(self.data_directory):
             print(f"Data directory {self.data_directory} does not exist. Creating it...")
             os.makedirs(self.data_directory, exist_ok=True)
-            return VendorDataset(vendors=[])
+            return
         
-        for filename in os.listdir(self.data_directory):
+        for filename in sorted(os.listdir(self.data_directory)):
             if filename.endswith('.json'):
                 file_path = os.path.join(self.data_directory, filename)
                 try:
                     with open(file_path, 'r') as file:
                         vendor_data = json.load(file)
-                        vendor = self._parse_vendor_data(vendor_data)
-                        vendors.append(vendor)
-                        print(f"Loaded vendor data from {filename}")
+                    vendor = self._parse_vendor_data(vendor_data)
+                    print(f"Loaded vendor data from {filename}")
                 except Exception as e:
                     print(f"Error loading {filename}: {str(e)}")
-        
-        dataset = VendorDataset(vendors=vendors)
-        self.vendors_data = vendors
-        return dataset
+                    continue
+                yield vendor
+
+    @property
+    def manifest(self) -> RemoteMasterManifest:
+        """Indexed Drive master versions (opened on first remote load)."""
+        if self._manifest is None:
+            os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+            self._manifest = RemoteMasterManifest(self.manifest_path)
+        return self._manifest
 
-    def _build_drive_creds(self, refresh_token: str):
-        from google.oauth2.credentials import Credentials
-        from google.auth.transport.requests import Request
+    def _drive_access_token(self, client: httpx.Client, refresh_token: str) -> Optional[str]:
+        """Exchange the user's refresh token for a Drive access token (OAuth refresh_token grant)."""
         if not refresh_token or not self.google_client_id or not self.google_client_secret:
             return None
-        creds = Credentials(
-            token=None,
-            refresh_token=refresh_token,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=self.google_client_id,
-            client_secret=self.google_client_secret,
-            scopes=["https://www.googleapis.com/auth/drive.readonly"],
-        )
         try:
-            creds.refresh(Request())
-            return creds
+            resp = client.post(GOOGLE_TOKEN_URI, data={
+                "grant_type": "refresh_token",
+                "refresh_token": refresh_token,
+                "client_id": self.google_client_id,
+                "client_secret": self.google_client_secret,
+            })
+            if resp.status_code != 200:
+                print(f"Drive credential refresh failed status={resp.status_code}")
+                return None
+            return resp.json().get("access_token")
         except Exception as e:
             print(f"Drive credential refresh failed: {e}")
             return None
 
+    def _list_masters(self, client: httpx.Client, headers: Dict[str, str], folder_ids: List[str], report: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """folder_id -> master.json listing entry, one files.list query per group of folders."""
+        found: Dict[str, Dict[str, Any]] = {}
+        for i in range(0, len(folder_ids), DRIVE_LIST_FOLDERS_PER_QUERY):
+            group = folder_ids[i:i + DRIVE_LIST_FOLDERS_PER_QUERY]
+            parents = " or ".join(f"'{folder_id}' in parents" for folder_id in group)
+            params = {
+                "q": f"name='master.json' and trashed=false and ({parents})",
+                "fields": "nextPageToken,files(id,name,parents,modifiedTime,md5Checksum)",
+                "pageSize": 1000,
+            }
+            try:
+                while True:
+                    resp = client.get(f"{DRIVE_API_BASE}/files", params=params, headers=headers)
+                    resp.raise_for_status()
+                    listing = resp.json()
+                    for file_meta in listing.get("files", []):
+                        for parent in file_meta.get("parents") or []:
+                            if parent in group:
+                                found.setdefault(parent, file_meta)
+                    if not listing.get("nextPageToken"):
+                        break
+                    params["pageToken"] = listing["nextPageToken"]
+            except Exception as e:
+                report["failed"] += len([f for f in group if f not in found])
+                print(f"Drive master listing failed for {len(group)} vendor folders: {e}")
+        return found
+
+    def _download_master(self, client: httpx.Client, headers: Dict[str, str], folder_name: str, file_meta: Dict[str, Any]) -> Vendor:
+        resp = client.get(f"{DRIVE_API_BASE}/files/{file_meta['id']}", params={"alt": "media"}, headers=headers)
+        resp.raise_for_status()
+        vendor_model = self._parse_vendor_data(resp.json())
+        # Ensure vendor name consistent
+        if vendor_model.vendor_name == "Unknown" and folder_name:
+            vendor_model.vendor_name = folder_name
+        return vendor_model
+
     def load_remote_master(self, user_id: str, refresh_token: str) -> VendorDataset:
-        """Load vendor data directly from Drive master.json files per vendor folder.
+        """Load vendor data directly from Drive master.json files per vendor folder."""
+        return VendorDataset(vendors=list(self.iter_remote_master(user_id, refresh_token)))
+
+    def iter_remote_master(self, user_id: str, refresh_token: str, skip_unchanged: bool = False, report: Optional[Dict[str, Any]] = None) -> Iterator[Vendor]:
+        """Yield vendors parsed from Drive master.json files as their downloads complete.
 
         Flow:
         1. Use email-storage-service to list vendors for user.
-        2. For each vendor folder, query Drive for a file named master.json.
-        3. Download and parse the master.json (array of invoice objects).
-        4. Convert each into a Vendor model.
-        Falls back to empty dataset if anything fails silently per vendor.
+        2. List the master.json of every vendor folder via Drive REST, many folders per query.
+        3. With skip_unchanged, drop masters whose version matches the manifest.
+        4. Download and parse the rest concurrently (DRIVE_FETCH_CONCURRENCY threads sharing
+           one keep-alive client). At most twice that many masters are in flight or unread.
+        Yields nothing if listing fails; failing vendors are skipped. `report` (optional)
+        receives counters and, under "indexed", the listing entries of the yielded masters,
+        to be passed to `manifest.record` once the ingest has stored them.
         """
-        import httpx
-        from googleapiclient.discovery import build
-        vendors: List[Vendor] = []
+        report = report if report is not None else {}
+        report.update(vendors_listed=0, masters_found=0, unchanged=0, fetched=0, failed=0, indexed=[])
         if not user_id or not refresh_token:
-            return VendorDataset(vendors=[])
-        creds = self._build_drive_creds(refresh_token)
-        if not creds:
-            return VendorDataset(vendors=[])
-        # List vendors via email-storage-service
-        vendor_list_url = f"{self.email_service_base}/drive/users/{user_id}/vendors"
-        try:
-            with httpx.Client(timeout=10.0) as client:
-                resp = client.get(vendor_list_url)
-            if resp.status_code != 200:
-                print(f"Vendor list fetch failed status={resp.status_code}")
-                return VendorDataset(vendors=[])
-            service = build("drive", "v3", credentials=creds)
-            for v in resp.json().get("vendors", []):
-                folder_id = v.get("id")
-                v_name = v.get("name") or "Unknown"
-                if not folder_id:
+            return
+        limits = httpx.Limits(max_connections=DRIVE_FETCH_CONCURRENCY, max_keepalive_connections=DRIVE_FETCH_CONCURRENCY)
+        with httpx.Client(timeout=DRIVE_TIMEOUT_SECONDS, limits=limits) as client:
+            token = self._drive_access_token(client, refresh_token)
+            if not token:
+                return
+            headers = {"Authorization": f"Bearer {token}"}
+            # List vendors via email-storage-service
+            vendor_list_url = f"{self.email_service_base}/drive/users/{user_id}/vendors"
+            try:
+                resp = client.get(vendor_list_url, timeout=10.0)
+                if resp.status_code != 200:
+                    print(f"Vendor list fetch failed status={resp.status_code}")
+                    return
+                folders = [(v["id"], v.get("name") or "Unknown") for v in resp.json().get("vendors", []) if v.get("id")]
+            except Exception as e:
+                print(f"Remote vendor listing failed: {e}")
+                return
+            report["vendors_listed"] = len(folders)
+            masters = self._list_masters(client, headers, [folder_id for folder_id, _ in folders], report)
+            report["masters_found"] = len(masters)
+            indexed_versions = self.manifest.versions(user_id) if skip_unchanged else {}
+            todo = []
+            for folder_id, folder_name in folders:
+                file_meta = masters.get(folder_id)
+                if not file_meta:
                     continue
-                # Query for master.json inside folder
-                q = f"'{folder_id}' in parents and name='master.json' and trashed=false"
-                try:
-                    listing = service.files().list(q=q, fields="files(id,name)").execute()
-                    files = listing.get("files", [])
-                    if not files:
-                        continue
-                    file_id = files[0]["id"]
-                    # Download file content
-                    file_content_url = f"https://www.googleapis.com/drive/v3/files/{file_id}?alt=media"
-                    import requests
-                    headers = {"Authorization": f"Bearer {creds.token}"}
-                    r = requests.get(file_content_url, headers=headers, timeout=20)
-                    if r.status_code != 200:
-                        continue
-                    try:
-                        payload = r.json()
-                    except Exception:
-                        continue
-                    vendor_model = self._parse_vendor_data(payload)
-                    # Ensure vendor name consistent
-                    if vendor_model.vendor_name == "Unknown" and v_name:
-                        vendor_model.vendor_name = v_name
-                    vendors.append(vendor_model)
-                except Exception as e:
-                    print(f"Failed processing remote master for vendor folder {folder_id}: {e}")
-        except Exception as e:
-            print(f"Remote vendor listing failed: {e}")
-            return VendorDataset(vendors=[])
-        return VendorDataset(vendors=vendors)
+                version = self.manifest.version_of(file_meta)
+                if version and indexed_versions.get(folder_id) == version:
+                    report["unchanged"] += 1
+                    continue
+                todo.append((folder_id, folder_name, file_meta))
+
+            pool = ThreadPoolExecutor(max_workers=max(1, DRIVE_FETCH_CONCURRENCY), thread_name_prefix="drive-fetch")
+            pending: Dict[Any, tuple] = {}
+            remaining = iter(todo)
+            try:
+                while True:
+                    # Bounded in-flight downloads: a slow consumer (the ingest pipeline) pauses fetching
+                    while len(pending) < 2 * max(1, DRIVE_FETCH_CONCURRENCY):
+                        item = next(remaining, None)
+                        if item is None:
+                            break
+                        pending[pool.submit(self._download_master, client, headers, item[1], item[2])] = item
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        folder_id, _, file_meta = pending.pop(future)
+                        try:
+                            vendor_model = future.result()
+                        except Exception as e:
+                            report["failed"] += 1
+                            print(f"Failed processing remote master for vendor folder {folder_id}: {e}")
+                            continue
+                        report["fetched"] += 1
+                        report["indexed"].append({**file_meta, "folder_id": folder_id})
+                        yield vendor_model
+            finally:
+                for future in pending:
+                    future.cancel()
+                pool.shutdown(wait=True)
 
     def from_raw_vendor_arrays(self, vendors_payload: List[Dict[str, Any]]) -> VendorDataset:
         """Build a VendorDataset from a list of vendor payload objects.
@@ -130,7 +214,10 @@ class VendorDataLoader:
         {"vendorName": "Acme", "records": [ {...invoice...}, {...} ]}
         Invoice records mirror the master.json array format produced by OCR service.
         """
-        vendors: List[Vendor] = []
+        return VendorDataset(vendors=list(self.iter_raw_vendor_arrays(vendors_payload)))
+
+    def iter_raw_vendor_arrays(self, vendors_payload: Iterable[Dict[str, Any]]) -> Iterator[Vendor]:
+        """Yield a Vendor per payload item (see from_raw_vendor_arrays), parsed lazily."""
         for item in vendors_payload:
             records = item.get("records") or []
             vendor_name_override = item.get("vendorName")
@@ -138,10 +225,10 @@ class VendorDataLoader:
                 vendor_model = self._parse_vendor_data(records)
                 if vendor_name_override and vendor_model.vendor_name == "Unknown":
                     vendor_model.vendor_name = vendor_name_override
-                vendors.append(vendor_model)
             except Exception as e:
                 print(f"Failed parsing raw vendor payload: {e}")
-        return VendorDataset(vendors=vendors)
+                continue
+            yield vendor_model
     
     def _parse_vendor_data(self, data) -> Vendor:
         """Parse raw JSON data into Vendor model."""
@@ -224,19 +311,39 @@ class VendorDataLoader:
     
     def convert_to_knowledge_chunks(self, dataset: VendorDataset) -> List[KnowledgeChunk]:
         """Convert vendor dataset to knowledge text chunks for embedding."""
-        chunks = []
-        
-        for vendor in dataset.vendors:
+        return list(self.iter_knowledge_chunks(dataset.vendors))
+
+    def iter_knowledge_chunks(self, vendors: Iterable[Vendor], stats: Optional[Dict[str, Any]] = None) -> Iterator[KnowledgeChunk]:
+        """Yield each vendor's summary and invoice chunks as the vendors are read.
+
+        When given, `stats` (owned by the caller, so concurrent ingests sharing
+        this loader never see each other's numbers) is filled with token and
+        window counts for every chunk yielded once the iterator is exhausted.
+        """
+        token_counts: List[int] = []
+        split_parents: set = set()
+        invoice_windows = 0
+        for vendor in vendors:
             # Create vendor summary chunk
-            vendor_summary = self._create_vendor_summary_chunk(vendor)
-            chunks.append(vendor_summary)
+            chunks = [self._create_vendor_summary_chunk(vendor)]
             
-            # Create individual invoice chunks
+            # Create invoice chunks (long invoices become several line-item windows)
             for invoice in vendor.invoices:
-                invoice_chunk = self._create_invoice_chunk(vendor, invoice)
-                chunks.append(invoice_chunk)
-        
-        return chunks
+                chunks.extend(self._create_invoice_chunks(vendor, invoice))
+
+            token_counts.extend(self.chunker.counter.count_many([c.content for c in chunks]))
+            for c in chunks:
+                if c.metadata.get("parent_chunk_id"):
+                    split_parents.add(c.metadata["parent_chunk_id"])
+                    invoice_windows += 1
+            yield from chunks
+
+        if stats is not None:
+            stats.update({
+                **token_stats(token_counts, self.chunker.max_tokens),
+                "split_invoices": len(split_parents),
+                "invoice_windows": invoice_windows,
+            })
     
     def _create_vendor_summary_chunk(self, vendor: Vendor) -> KnowledgeChunk:
         """Create a summary chunk for a vendor."""
@@ -269,7 +376,7 @@ class VendorDataLoader:
         return KnowledgeChunk(
             chunk_id=chunk_id,
             vendor_name=vendor.vendor_name,
-            content=content.strip(),
+            content=compact_text(content),
             metadata={
                 "type": "vendor_summary",
                 "vendor_name": vendor.vendor_name,
@@ -279,8 +386,14 @@ class VendorDataLoader:
             }
         )
     
-    def _create_invoice_chunk(self, vendor: Vendor, invoice: Invoice) -> KnowledgeChunk:
-        """Create a knowledge chunk for an individual invoice."""
+    def _create_invoice_chunks(self, vendor: Vendor, invoice: Invoice) -> List[KnowledgeChunk]:
+        """Create knowledge chunks for an individual invoice.
+
+        Chunk text holds only what is worth embedding (vendor, number, amount,
+        date, line items). Drive/file identifiers and links are kept in
+        metadata. Invoices over the token budget are split into overlapping
+        line-item windows sharing `parent_chunk_id` (see InvoiceChunker).
+        """
         def _parse_amount(val: Any) -> float:
             if val is None:
                 return 0.0
@@ -293,34 +406,23 @@ class VendorDataLoader:
                 return 0.0
         numeric_amount = _parse_amount(invoice.total_amount)
         amount_str = f"₹{numeric_amount:,.2f}" if invoice.total_amount else "N/A"
-        
-        # Create a readable line items summary
-        line_items_summary = ""
-        if invoice.line_items:
-            line_items_summary = "\nLine Items (INR):\n"
-            for item in invoice.line_items:
-                item_amt = _parse_amount(item.amount)
-                unit_price_amt = _parse_amount(item.unit_price)
-                line_items_summary += f"- {item.item_description}: {item.quantity or ''} x ₹{unit_price_amt:,.2f} = ₹{item_amt:,.2f}\n"
-        
-        # Include link & file metadata inline so embeddings capture reference context.
-        content = f"""
+
+        # One readable line per item
+        item_lines = [
+            f"- {item.item_description}: {item.quantity or ''} x ₹{_parse_amount(item.unit_price):,.2f} = ₹{_parse_amount(item.amount):,.2f}"
+            for item in (invoice.line_items or [])
+        ]
+        header = compact_text(f"""
         Invoice Details:
         Vendor: {vendor.vendor_name}
         Invoice Number: {invoice.invoice_number}
         Amount: {amount_str}
         Date: {invoice.invoice_date}
-        Drive File ID: {getattr(invoice, 'drive_file_id', '')}
-        File Name: {getattr(invoice, 'file_name', '')}
-        Processed At: {getattr(invoice, 'processed_at', '')}
-        Web View Link: {getattr(invoice, 'web_view_link', '')}
-        Web Content Link: {getattr(invoice, 'web_content_link', '')}
-        {line_items_summary}
-        This is an invoice from {vendor.vendor_name} for {amount_str} dated {invoice.invoice_date}.
-        """
-        
+        """)
+        footer = f"This is an invoice from {vendor.vendor_name} for {amount_str} dated {invoice.invoice_date}."
+
         chunk_id = hashlib.md5(f"{vendor.vendor_name}_{invoice.invoice_number}".encode()).hexdigest()
-        
+
         # Convert line_items to dictionaries for JSON serialization
         line_items_dict = []
         if invoice.line_items:
@@ -331,22 +433,47 @@ class VendorDataLoader:
                     "unit_price": item.unit_price,
                     "amount": item.amount
                 })
-        
-        return KnowledgeChunk(
-            chunk_id=chunk_id,
-            vendor_name=vendor.vendor_name,
-            content=content.strip(),
-            metadata={
-                "type": "invoice",
-                "vendor_name": vendor.vendor_name,
-                "invoice_number": invoice.invoice_number,
-                "invoice_date": invoice.invoice_date,
-                "line_items": line_items_dict,  # Use dict instead of LineItem objects
-                "total_amount": numeric_amount,  # numeric INR value
-                "drive_file_id": getattr(invoice, 'drive_file_id', ''),
-                "file_name": getattr(invoice, 'file_name', ''),
-                "processed_at": getattr(invoice, 'processed_at', ''),
-                "web_view_link": getattr(invoice, 'web_view_link', ''),
-                "web_content_link": getattr(invoice, 'web_content_link', ''),
-            }
-        )
+
+        metadata = {
+            "type": "invoice",
+            "vendor_name": vendor.vendor_name,
+            "invoice_number": invoice.invoice_number,
+            "invoice_date": invoice.invoice_date,
+            "line_items": line_items_dict,  # Use dict instead of LineItem objects
+            "total_amount": numeric_amount,  # numeric INR value
+            "drive_file_id": getattr(invoice, 'drive_file_id', ''),
+            "file_name": getattr(invoice, 'file_name', ''),
+            "processed_at": getattr(invoice, 'processed_at', ''),
+            "web_view_link": getattr(invoice, 'web_view_link', ''),
+            "web_content_link": getattr(invoice, 'web_content_link', ''),
+        }
+
+        windows = self.chunker.window_item_lines(header, footer, item_lines)
+        if len(windows) == 1:
+            items_block = "Line Items (INR):\n" + "\n".join(item_lines) if item_lines else ""
+            return [KnowledgeChunk(
+                chunk_id=chunk_id,
+                vendor_name=vendor.vendor_name,
+                content="\n".join(part for part in (header, items_block, footer) if part),
+                metadata=metadata,
+            )]
+
+        chunks = []
+        for index, (start, end) in enumerate(windows):
+            items_block = f"Line Items (INR) [{start + 1}-{end} of {len(item_lines)}]:\n" + "\n".join(item_lines[start:end])
+            chunks.append(KnowledgeChunk(
+                # First window reuses the parent ID so it overwrites a previously unsplit chunk
+                chunk_id=chunk_id if index == 0 else f"{chunk_id}-w{index}",
+                vendor_name=vendor.vendor_name,
+                content=f"{header}\n{items_block}\n{footer}",
+                metadata={
+                    **metadata,
+                    "line_items": line_items_dict[start:end],
+                    "parent_chunk_id": chunk_id,
+                    "window_index": index,
+                    "window_count": len(windows),
+                    "line_item_offset": start,
+                },
+                parent_metadata=metadata,
+            ))
+        return chunks
@@ -0,0 +1,67 @@
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+
+class RemoteMasterManifest:
+    """Drive master.json versions already indexed, per user and vendor folder.
+
+    The remote loader compares each listed master's `md5Checksum` (or its
+    `modifiedTime` when Drive reports no checksum) with the row stored here.
+    An incremental load skips the download of a master that has not changed.
+    Rows are written only after the ingest that used them succeeded, and a
+    tenant's rows are dropped when its collection is reset, so a skipped
+    master is always one whose chunks are already stored.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS remote_masters ("
+                "user_id TEXT NOT NULL, folder_id TEXT NOT NULL, file_id TEXT NOT NULL, "
+                "md5_checksum TEXT, modified_time TEXT, indexed_at REAL NOT NULL, "
+                "PRIMARY KEY (user_id, folder_id))"
+            )
+
+    @staticmethod
+    def _version(md5_checksum: Optional[str], modified_time: Optional[str]) -> Optional[str]:
+        return md5_checksum or modified_time or None
+
+    def versions(self, user_id: str) -> Dict[str, str]:
+        """folder_id -> version of the master last indexed for that folder."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT folder_id, file_id, md5_checksum, modified_time FROM remote_masters WHERE user_id = ?", (user_id,)
+            ).fetchall()
+        return {folder: f"{file_id}:{self._version(md5, modified)}" for folder, file_id, md5, modified in rows}
+
+    def version_of(self, file_meta: Dict[str, str]) -> Optional[str]:
+        """Comparable version for a Drive file listing entry (None if Drive gave neither field)."""
+        version = self._version(file_meta.get("md5Checksum"), file_meta.get("modifiedTime"))
+        return f"{file_meta.get('id')}:{version}" if version else None
+
+    def record(self, user_id: str, entries: Iterable[Dict[str, str]]) -> None:
+        """Store versions ({"folder_id", "id", "md5Checksum", "modifiedTime"}) of masters just indexed."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO remote_masters (user_id, folder_id, file_id, md5_checksum, modified_time, indexed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(user_id, e["folder_id"], e["id"], e.get("md5Checksum"), e.get("modifiedTime"), now) for e in entries],
+            )
+
+    def forget(self, user_id: Optional[str] = None) -> None:
+        """Drop one user's rows, or every row when user_id is None."""
+        with self._lock, self._conn:
+            if user_id is None:
+                self._conn.execute("DELETE FROM remote_masters")
+            else:
+                self._conn.execute("DELETE FROM remote_masters WHERE user_id = ?", (user_id,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
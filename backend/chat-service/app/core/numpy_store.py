@@ -0,0 +1,367 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX: writers are only serialized within one process
+    fcntl = None
+
+from app.core.retriever import VectorDatabase
+from app.config import VECTORDB_WRITE_BATCH_SIZE, NUMPY_SEARCH_BLOCK_ROWS
+
+_EMPTY_RESULT = {"documents": [], "metadatas": [], "distances": []}
+
+
+class NumpyVectorDatabase(VectorDatabase):
+    """In-process exact-search backend over an append-only, memory-mapped float32 matrix.
+
+    Files under `<persist_directory>/<collection_name>_numpy/`:
+    - `rows.sqlite3`: one row per appended vector (position, chunk ID, vendor,
+      document, metadata JSON) plus a `meta` table holding the row count,
+      dimension and current matrix file.
+    - `embeddings-<generation>.f32`: raw L2-normalized float32 rows, opened with
+      `np.memmap(mode="r")`, so several uvicorn workers share one page-cached copy.
+    - `.lock`: `flock`ed by writers.
+
+    A flush appends the staged vectors to the matrix file, then inserts their
+    rows and the new row count in one SQLite transaction, all under the file
+    lock. Each flush costs O(staged rows), and concurrent writers (other
+    workers or tenants' jobs) append after each other instead of overwriting.
+    Readers only map the rows SQLite has committed and load new rows
+    incrementally. Re-upserting an ID appends a new row and the latest row
+    wins; a delete appends a tombstone row. Once dead rows outnumber live
+    ones, the flush compacts live rows into a new matrix generation.
+    Distances are squared L2 between unit vectors (2 - 2cos), matching
+    Chroma's default space so `1 - distance` scores stay comparable between
+    backends.
+    """
+
+    # Upserts are staged in memory: sidecar rows are written only once a flush has persisted them
+    buffers_writes = True
+
+    def __init__(self, persist_directory: str = "data/vectordb", collection_name: str = "vendor_invoices", write_batch_size: int = VECTORDB_WRITE_BATCH_SIZE, block_rows: int = NUMPY_SEARCH_BLOCK_ROWS):
+        self.block_rows = max(1, block_rows)
+        super().__init__(persist_directory, collection_name, write_batch_size)
+        print(f"Numpy vector store initialized at {self.store_dir} ({len(self._state['row_of'])} rows)")
+
+    def _open_backend(self) -> None:
+        self.store_dir = os.path.join(self.persist_directory, f"{self.collection_name}_numpy")
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.lock_path = os.path.join(self.store_dir, ".lock")
+        self._lock = threading.RLock()
+        self._pending: Dict[str, Optional[Tuple[np.ndarray, str, Dict[str, Any]]]] = {}
+        self._db = sqlite3.connect(os.path.join(self.store_dir, "rows.sqlite3"), check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS rows ("
+                "pos INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL, vendor_name TEXT NOT NULL, document TEXT, metadata TEXT, "
+                "deleted INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._state = self._empty_state()
+        self._snapshot()
+
+    # --- persistence ---
+    @staticmethod
+    def _empty_state() -> Dict[str, Any]:
+        return {
+            "generation": None, "rows": 0, "dim": 0, "matrix": None,
+            "ids": [], "documents": [], "metadatas": [], "vendors": [],
+            # live rows only: latest position of each ID, and each vendor's live positions
+            "row_of": {}, "vendor_rows": {}, "selections": {},
+        }
+
+    def _read_meta(self) -> Dict[str, str]:
+        return dict(self._db.execute("SELECT key, value FROM meta").fetchall())
+
+    @contextmanager
+    def _write_lock(self) -> Iterator[None]:
+        """Serialize writers across threads (RLock) and processes (flock on `.lock`)."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, "a") as fh:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _snapshot(self) -> Dict[str, Any]:
+        """Current state, catching up with rows other writers committed since the last read.
+
+        A state is never changed once published: readers keep using the one
+        they got (its matrix and row lists always match) while a newer state
+        is built from a copy and swapped in with one assignment.
+        """
+        with self._lock:
+            meta = self._read_meta()
+            generation = meta.get("generation")
+            rows = int(meta.get("rows", 0))
+            state = self._state
+            if generation == state["generation"] and rows == state["rows"]:
+                return state
+            if generation != state["generation"] or rows < state["rows"]:
+                state = self._empty_state()
+            state = self._load_rows(state, rows)
+            state["generation"] = generation
+            state["dim"] = int(meta.get("dim", 0))
+            state["rows"] = rows
+            state["matrix"] = (
+                np.memmap(os.path.join(self.store_dir, meta["matrix_file"]), dtype=np.float32, mode="r", shape=(rows, state["dim"]))
+                if rows and meta.get("matrix_file") else None
+            )
+            self._state = state
+            return state
+
+    def _load_rows(self, state: Dict[str, Any], rows: int) -> Dict[str, Any]:
+        """New state holding `state`'s rows plus rows [len(state ids), rows) from SQLite."""
+        new = self._db.execute(
+            "SELECT pos, chunk_id, vendor_name, document, metadata, deleted FROM rows WHERE pos >= ? AND pos < ? ORDER BY pos",
+            (len(state["ids"]), rows),
+        ).fetchall()
+        state = {
+            **state,
+            "ids": list(state["ids"]), "documents": list(state["documents"]),
+            "metadatas": list(state["metadatas"]), "vendors": list(state["vendors"]),
+            "row_of": dict(state["row_of"]), "vendor_rows": dict(state["vendor_rows"]), "selections": {},
+        }
+        row_of, vendor_rows = state["row_of"], state["vendor_rows"]
+        # Vendor position sets are copied the first time this load changes them
+        copied: set = set()
+
+        def _positions(vendor: str) -> set:
+            if vendor not in copied:
+                vendor_rows[vendor] = set(vendor_rows.get(vendor, ()))
+                copied.add(vendor)
+            return vendor_rows[vendor]
+
+        for pos, cid, vendor, document, metadata, deleted in new:
+            previous = row_of.pop(cid, None)
+            if previous is not None:
+                _positions(state["vendors"][previous]).discard(previous)
+            if not deleted:
+                row_of[cid] = pos
+                _positions(vendor).add(pos)
+            state["ids"].append(cid)
+            state["vendors"].append(vendor)
+            state["documents"].append(document)
+            state["metadatas"].append(json.loads(metadata) if metadata else {})
+        return state
+
+    # --- backend primitives ---
+    def _upsert(self, ids: List[str], embeddings: List[Any], documents: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1.0, norms)
+        with self._lock:
+            for cid, vec, doc, meta in zip(ids, vectors, documents, metadatas):
+                self._pending[cid] = (vec, doc, meta)
+
+    def _delete(self, ids: List[str]) -> None:
+        # Tombstones go through the same staged append as upserts (None = delete)
+        with self._lock:
+            for cid in ids:
+                self._pending[cid] = None
+
+    def _stored_vectors(self, ids: List[str]) -> List[tuple]:
+        """As VectorDatabase._stored_vectors, but a staged upsert is what a second write of its ID replaces.
+
+        Without this, two writes of one ID before a flush would both
+        subtract the last flushed vector from the centroids. A staged
+        delete replaces nothing (its own removal is already queued).
+        """
+        with self._lock:
+            staged = {cid: self._pending[cid] for cid in ids if cid in self._pending}
+        stored = super()._stored_vectors([cid for cid in ids if cid not in staged])
+        return stored + [(cid, entry[2].get("vendor_name") or "", entry[0]) for cid, entry in staged.items() if entry is not None]
+
+    def _flush(self) -> None:
+        with self._write_lock():
+            if not self._pending:
+                return
+            started = time.perf_counter()
+            pending = list(self._pending.items())
+            self._pending.clear()
+            # Row count and generation as committed by any writer, not this process's last view
+            meta = self._read_meta()
+            rows = int(meta.get("rows", 0))
+            staged_dim = next((entry[0].shape[0] for _, entry in pending if entry is not None), 0)
+            dim = int(meta.get("dim", 0)) or staged_dim
+            if not dim:
+                return
+            if staged_dim and staged_dim != dim:
+                raise ValueError(f"Embedding dimension {staged_dim} does not match stored dimension {dim}")
+            tombstone = np.zeros(dim, dtype=np.float32)
+            matrix_file = meta.get("matrix_file") or f"embeddings-{time.time_ns()}.f32"
+            with open(os.path.join(self.store_dir, matrix_file), "ab") as fh:
+                # Drop a partial tail left by a writer that died before committing its rows
+                fh.truncate(rows * dim * 4)
+                fh.write(np.stack([entry[0] if entry is not None else tombstone for _, entry in pending]).astype(np.float32, copy=False).tobytes())
+                fh.flush()
+                os.fsync(fh.fileno())
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO rows (pos, chunk_id, vendor_name, document, metadata, deleted) VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (rows + i, cid, entry[2].get("vendor_name") or "", entry[1], json.dumps(entry[2]), 0)
+                        if entry is not None else (rows + i, cid, "", None, None, 1)
+                        for i, (cid, entry) in enumerate(pending)
+                    ],
+                )
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    [("rows", str(rows + len(pending))), ("dim", str(dim)), ("matrix_file", matrix_file), ("generation", meta.get("generation") or matrix_file)],
+                )
+            state = self._snapshot()
+            if len(state["ids"]) - len(state["row_of"]) > len(state["row_of"]):
+                self._compact(state)
+            print(f"Numpy store appended {len(pending)} rows in {time.perf_counter() - started:.3f}s")
+
+    def _compact(self, state: Dict[str, Any]) -> None:
+        """Rewrite live rows into a new matrix generation (caller holds the write lock)."""
+        live = sorted(state["row_of"].values())
+        matrix_file = f"embeddings-{time.time_ns()}.f32"
+        with open(os.path.join(self.store_dir, matrix_file), "wb") as fh:
+            for b in range(0, len(live), self.block_rows):
+                fh.write(np.ascontiguousarray(state["matrix"][live[b:b + self.block_rows]]).tobytes())
+            fh.flush()
+            os.fsync(fh.fileno())
+        previous_file = self._read_meta().get("matrix_file")
+        with self._db:
+            self._db.execute("DELETE FROM rows")
+            self._db.executemany(
+                "INSERT INTO rows (pos, chunk_id, vendor_name, document, metadata) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (new_pos, state["ids"][pos], state["vendors"][pos], state["documents"][pos], json.dumps(state["metadatas"][pos]))
+                    for new_pos, pos in enumerate(live)
+                ],
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [("rows", str(len(live))), ("matrix_file", matrix_file), ("generation", matrix_file)],
+            )
+        self._snapshot()
+        if previous_file and previous_file != matrix_file:
+            try:
+                # Readers still mapping the old generation keep their pages until they reload
+                os.remove(os.path.join(self.store_dir, previous_file))
+            except OSError:
+                pass
+        print(f"Numpy store compacted {len(state['ids'])} rows to {len(live)}")
+
+    def _live_rows(self, state: Dict[str, Any], key: Any, positions: Any) -> np.ndarray:
+        """Sorted live positions, cached per state until new rows arrive."""
+        rows = state["selections"].get(key)
+        if rows is None:
+            rows = state["selections"][key] = np.fromiter(sorted(positions), dtype=np.int64)
+        return rows
+
+    def _row_ranges(self, state: Dict[str, Any], where: Dict[str, Any] | None) -> List[Tuple[int, int]] | np.ndarray:
+        """Contiguous row ranges when every row is live and unfiltered, else explicit live row indices."""
+        total = len(state["ids"])
+        if not where:
+            if len(state["row_of"]) == total:
+                return [(0, total)]
+            return self._live_rows(state, None, state["row_of"].values())
+        if set(where.keys()) == {"vendor_name"}:
+            cond = where["vendor_name"]
+            vendors = cond.get("$in", []) if isinstance(cond, dict) else [cond]
+            selected = [self._live_rows(state, ("vendor", v), state["vendor_rows"][v]) for v in vendors if v in state["vendor_rows"]]
+            return np.concatenate(selected) if selected else np.empty(0, dtype=np.int64)
+        # Generic equality / $in filter on metadata (rare; linear scan)
+        def _matches(value: Any, cond: Any) -> bool:
+            return value in cond["$in"] if isinstance(cond, dict) and "$in" in cond else value == cond
+
+        return np.array([
+            pos for pos in sorted(state["row_of"].values())
+            if all(_matches(state["metadatas"][pos].get(k), v) for k, v in where.items())
+        ], dtype=np.int64)
+
+    def _query(self, query_embedding: List[float], n_results: int, where: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        state = self._snapshot()
+        matrix = state["matrix"]
+        if matrix is None or not state["row_of"] or n_results <= 0:
+            return dict(_EMPTY_RESULT)
+        q = np.asarray(query_embedding, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+
+        def _merge(rows: np.ndarray, scores: np.ndarray):
+            nonlocal best_rows, best_scores
+            rows = np.concatenate([best_rows, rows])
+            scores = np.concatenate([best_scores, scores])
+            if scores.shape[0] > n_results:
+                keep = np.argpartition(-scores, n_results - 1)[:n_results]
+                rows, scores = rows[keep], scores[keep]
+            best_rows, best_scores = rows, scores
+
+        selection = self._row_ranges(state, where)
+        if isinstance(selection, np.ndarray):
+            for b in range(0, selection.shape[0], self.block_rows):
+                idx = selection[b:b + self.block_rows]
+                _merge(idx, matrix[idx] @ q)
+        else:
+            # Blocked matrix-vector products keep peak memory at block_rows x dim
+            for start, end in selection:
+                for b in range(start, end, self.block_rows):
+                    e = min(end, b + self.block_rows)
+                    _merge(np.arange(b, e, dtype=np.int64), matrix[b:e] @ q)
+
+        order = np.argsort(-best_scores)
+        rows, scores = best_rows[order], best_scores[order]
+        return {
+            "documents": [state["documents"][i] for i in rows],
+            "metadatas": [dict(state["metadatas"][i]) for i in rows],
+            "distances": [float(2.0 - 2.0 * s) for s in scores],
+        }
+
+    def _get(self, where: Dict[str, Any] | None = None, ids: List[str] | None = None, include: List[str] | None = None) -> Dict[str, Any]:
+        state = self._snapshot()
+        include = include if include is not None else ["documents", "metadatas"]
+        if ids is not None:
+            rows = [state["row_of"][cid] for cid in ids if cid in state["row_of"]]
+        else:
+            selection = self._row_ranges(state, where)
+            if isinstance(selection, np.ndarray):
+                rows = selection.tolist()
+            else:
+                rows = [i for start, end in selection for i in range(start, end)]
+        result: Dict[str, Any] = {"ids": [state["ids"][i] for i in rows]}
+        if "documents" in include:
+            result["documents"] = [state["documents"][i] for i in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [dict(state["metadatas"][i]) for i in rows]
+        if "embeddings" in include:
+            result["embeddings"] = [state["matrix"][i] for i in rows] if state["matrix"] is not None else []
+        return result
+
+    def count(self) -> int:
+        return len(self._snapshot()["row_of"])
+
+    def _reset_collection(self) -> None:
+        with self._write_lock():
+            self._pending.clear()
+            previous_file = self._read_meta().get("matrix_file")
+            with self._db:
+                self._db.execute("DELETE FROM rows")
+                self._db.execute("DELETE FROM meta")
+                # A new generation makes other processes drop their cached rows
+                self._db.execute("INSERT INTO meta (key, value) VALUES ('generation', ?)", (f"reset-{time.time_ns()}",))
+            if previous_file:
+                try:
+                    os.remove(os.path.join(self.store_dir, previous_file))
+                except OSError:
+                    pass
+            self._state = self._empty_state()
+            self._snapshot()
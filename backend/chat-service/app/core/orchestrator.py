@@ -1,9 +1,33 @@
-from typing import Dict, Any, List, Optional
+import copy
+import hashlib
+import itertools
+import json
+import time
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
 from app.core.loader import VendorDataLoader
+from app.core.pipeline import IngestPipeline
 from app.core.embedder import EmbeddingService
-from app.core.retriever import VectorDatabase
+from app.core.retriever import VectorDatabase, create_vector_database
+from app.core.tenancy import TenantVectorStores
+from app.core.cache import LRUCache
+from app.core.vendor_matcher import vendor_matcher_for
+from app.core.executors import run_io, run_ml, executor_stats
 from app.core.llm_service import LLMService  # added
-from app.config import VENDOR_DATA_DIRECTORY, VECTORDB_PERSIST_DIRECTORY
+from app.core.llm import SAFETY_BLOCKED_MESSAGE
+from app.models.schema import VendorDataset
+from app.config import (
+    VENDOR_DATA_DIRECTORY,
+    VECTORDB_PERSIST_DIRECTORY,
+    RETRIEVAL_MAX_CHUNKS_PER_VENDOR,
+    RETRIEVAL_CANDIDATE_MULTIPLIER,
+    ANALYTICS_CACHE_SIZE,
+    ANALYTICS_CACHE_TTL_SECONDS,
+    VENDOR_LLM_FALLBACK,
+    VENDOR_ROUTING_ENABLED,
+    VENDOR_ROUTING_MIN_SCORE,
+    VENDOR_ROUTING_MARGIN,
+    VENDOR_ROUTING_MAX_VENDORS,
+)
 
 
 class VendorKnowledgeOrchestrator:
@@ -17,86 +41,143 @@ class VendorKnowledgeOrchestrator:
     def __init__(self, data_directory: str = VENDOR_DATA_DIRECTORY, vectordb_directory: str = VECTORDB_PERSIST_DIRECTORY):
         self.data_loader = VendorDataLoader(data_directory)
         self.embedding_service = EmbeddingService()
-        self.vector_db = VectorDatabase(vectordb_directory)
+        self.vector_db = create_vector_database(vectordb_directory)
         self.llm_service = LLMService(self.embedding_service, self.vector_db)  # added
+        # Per-tenant (userId) collections; requests without a userId use self.vector_db
+        self.tenant_stores = TenantVectorStores(self.vector_db, vectordb_directory)
+        # (collection, period) -> {"fingerprint", "data"}: analytics + llmSummary reused until the aggregates change
+        self.analytics_cache = LRUCache(ANALYTICS_CACHE_SIZE, ANALYTICS_CACHE_TTL_SECONDS)
+
+    def store_for(self, user_id: Optional[str] = None) -> VectorDatabase:
+        """Vector store holding `user_id`'s invoices (shared default store when None)."""
+        return self.tenant_stores.get(user_id)
+
+    def _stream_ingest(self, vendors, vector_db, incremental: bool, progress: Dict[str, Any]) -> tuple[bool, IngestPipeline]:
+        pipeline = IngestPipeline(self.data_loader, self.embedding_service, vector_db, incremental=incremental, progress=progress)
+        storage_success = pipeline.run(vendors)
+        stats = pipeline.stats
+        print(
+            f"Streamed {stats['vendors_loaded']} vendors / {stats['chunks_created']} chunks in {stats['windows']} windows: "
+            f"{stats['embeddings_generated']} embedded, {pipeline.write_stats['chunks_written']} stored"
+            + (f", {stats['skipped_existing']} already indexed" if incremental else "")
+        )
+        return storage_success, pipeline
+
+    @staticmethod
+    def _remote_stats(report: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in report.items() if k != "indexed"}
+
+    def process_vendor_data(self, incremental: bool = False, user_id: Optional[str] = None, refresh_token: Optional[str] = None, progress: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Load vendor data (remote master or local files), embed and store it.
 
-    def process_vendor_data(self, incremental: bool = False, user_id: Optional[str] = None, refresh_token: Optional[str] = None) -> Dict[str, Any]:
+        Vendors are streamed through IngestPipeline (see pipeline.py), so
+        nothing larger than a few windows of chunks is held at once.
+        `progress` (optional) receives live stage / chunk counters for job polling.
+        """
+        progress = progress if progress is not None else {}
         try:
+            vector_db = self.store_for(user_id)
+            progress["stage"] = "loading"
             # If user_id supplied attempt remote load; fallback to local files
-            dataset = None
+            vendors = None
+            remote_report: Dict[str, Any] = {}
             if user_id and refresh_token:
                 try:
-                    dataset = self.data_loader.load_remote_master(user_id, refresh_token)
-                    print(f"Remote master data loaded for user {user_id}")
+                    # Incremental loads skip Drive masters unchanged since they were last indexed
+                    remote = self.data_loader.iter_remote_master(user_id, refresh_token, skip_unchanged=incremental, report=remote_report)
+                    # Peek: an empty or failing remote source falls back before anything is indexed
+                    first = next(remote, None)
+                    if first is not None:
+                        vendors = itertools.chain([first], remote)
+                        print(f"Remote master data streaming for user {user_id}")
+                    elif remote_report.get("unchanged"):
+                        # Remote worked but had nothing new: do not fall back to the local sample data
+                        failed = remote_report.get("failed", 0)
+                        return {
+                            "success": not failed,
+                            "message": "Remote vendor masters unchanged since last load; nothing to index"
+                            + (f" ({failed} vendor masters failed to load)" if failed else ""),
+                            "stats": {"incremental": incremental, "remote": self._remote_stats(remote_report)},
+                        }
                 except Exception as e:
                     print(f"Remote load failed for user {user_id}: {e}; falling back to local vendor JSON files")
-            if not dataset:
-                dataset = self.data_loader.load_vendor_json_files()
-            print(f"Loaded {len(dataset.vendors)} vendors")
+            if vendors is None:
+                vendors = self.data_loader.iter_vendor_json_files()
+                remote_report = {}
 
-            if not dataset.vendors:
+            storage_success, pipeline = self._stream_ingest(vendors, vector_db, incremental, progress)
+            stats = pipeline.stats
+            if not stats["vendors_loaded"]:
                 return {"success": False, "message": "No vendor data found", "stats": {}}
-            # Convert to chunks
-            chunks = self.data_loader.convert_to_knowledge_chunks(dataset)
-            print(f"Created {len(chunks)} knowledge chunks")
-
-            if incremental:
-                existing_ids = set(self.vector_db.list_ids())
-                new_chunks = [c for c in chunks if c.chunk_id not in existing_ids]
-                skipped = len(chunks) - len(new_chunks)
-                print(f"Incremental mode: Found {len(existing_ids)} existing chunks. Skipping {skipped}, processing {len(new_chunks)} new chunks.")
-                chunks = new_chunks
-            
-            embedded_chunks = self.embedding_service.generate_embeddings(chunks)
-            successful_embeddings = sum(1 for chunk in embedded_chunks if chunk.embedding)
-            print(f"Generated {successful_embeddings}/{len(embedded_chunks)} embeddings")
-
-            print("\nStoring in vector database...")
-            storage_success = self.vector_db.store_embeddings(embedded_chunks)
-            db_stats = self.vector_db.get_collection_stats()
+            if remote_report.get("indexed") and not stats["failed_windows"]:
+                # Only masters whose chunks are now stored (written or already present) may be
+                # skipped by later incremental loads
+                self.data_loader.manifest.record(user_id, remote_report["indexed"])
+            db_stats = vector_db.get_collection_stats()
 
+            written = pipeline.write_stats["chunks_written"]
             return {
                 "success": storage_success,
-                "message": "Vendor knowledge processing completed successfully!",
+                "message": "Vendor knowledge processing completed successfully!" if written or not storage_success
+                else "Vendor knowledge already up to date; nothing new to index",
                 "stats": {
-                    "vendors_loaded": len(dataset.vendors),
-                    "chunks_created": len(chunks),
-                    "embeddings_generated": successful_embeddings,
+                    "vendors_loaded": stats["vendors_loaded"],
+                    "chunks_written": written,
+                    "chunks_created": stats["chunks_created"] - stats["skipped_existing"],
+                    "embeddings_generated": stats["embeddings_generated"],
                     "stored_in_db": db_stats["total_chunks"],
                     "database_collection": db_stats["collection_name"],
                     "incremental": incremental,
-                    **({} if not incremental else {"skipped_existing": skipped})
+                    "chunking": pipeline.chunk_stats,
+                    "embedding": pipeline.embedding_stats,
+                    "embedding_chunks_per_sec": pipeline.embedding_stats.get("chunks_per_sec"),
+                    "write": pipeline.write_stats,
+                    "pipeline": pipeline.pipeline_stats(),
+                    **({"remote": self._remote_stats(remote_report)} if remote_report else {}),
+                    **({} if not incremental else {"skipped_existing": stats["skipped_existing"]})
                 }
             }
         except Exception as e:
             return {"success": False, "message": f"Error in processing data: {str(e)}", "stats": {}}
 
-    def process_direct_dataset(self, dataset, incremental: bool = False) -> Dict[str, Any]:
-        """Embed & store a pre-built VendorDataset supplied directly (bypasses loading)."""
+    def process_direct_dataset(self, dataset, incremental: bool = False, user_id: Optional[str] = None, progress: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Embed & store vendors supplied directly (bypasses loading).
+
+        `dataset` is a VendorDataset or any iterable of Vendor (e.g.
+        `data_loader.iter_raw_vendor_arrays(...)`), streamed like process_vendor_data.
+        """
+        progress = progress if progress is not None else {}
         try:
-            if not dataset or not getattr(dataset, 'vendors', None):
+            vector_db = self.store_for(user_id)
+            vendors = dataset.vendors if isinstance(dataset, VendorDataset) else dataset
+            if not vendors:
                 return {"success": False, "message": "Empty vendor dataset", "stats": {}}
-            chunks = self.data_loader.convert_to_knowledge_chunks(dataset)
-            if incremental:
-                existing_ids = set(self.vector_db.list_ids())
-                chunks = [c for c in chunks if c.chunk_id not in existing_ids]
-            embedded_chunks = self.embedding_service.generate_embeddings(chunks)
-            storage_success = self.vector_db.store_embeddings(embedded_chunks)
-            db_stats = self.vector_db.get_collection_stats()
+            storage_success, pipeline = self._stream_ingest(vendors, vector_db, incremental, progress)
+            if not pipeline.stats["vendors_loaded"]:
+                return {"success": False, "message": "Empty vendor dataset", "stats": {}}
+            db_stats = vector_db.get_collection_stats()
+            written = pipeline.write_stats["chunks_written"]
             return {
                 "success": storage_success,
-                "message": "Direct vendor dataset ingested",
+                "message": "Direct vendor dataset ingested" if written or not storage_success
+                else "Vendor dataset already indexed; nothing new to ingest",
                 "stats": db_stats,
-                "chunks_processed": len(embedded_chunks),
+                "chunks_written": written,
+                "chunks_processed": pipeline.stats["chunks_created"] - pipeline.stats["skipped_existing"],
                 "incremental": incremental,
+                "chunking": pipeline.chunk_stats,
+                "embedding": pipeline.embedding_stats,
+                "write": pipeline.write_stats,
+                "pipeline": pipeline.pipeline_stats(),
             }
         except Exception as e:
             return {"success": False, "message": f"Direct dataset ingestion failed: {e}", "stats": {}}
 
-    def search_vendor_knowledge(self, query: str, n_results: int = 5) -> Dict[str, Any]:
+    def search_vendor_knowledge(self, query: str, n_results: int = 5, user_id: Optional[str] = None) -> Dict[str, Any]:
         try:
+            vector_db = self.store_for(user_id)
             query_embedding = self.embedding_service.generate_single_embedding(query)
-            search_results = self.vector_db.search_similar(query_embedding, n_results)
+            search_results = vector_db.search_similar(query_embedding, n_results)
 
             formatted_results = []
             for i, (doc, metadata, distance) in enumerate(
@@ -122,37 +203,22 @@ class VendorKnowledgeOrchestrator:
             return {"success": False, "message": f"Search error: {str(e)}", "results": []}
 
     def get_context_for_query(
-        self, vendor_name: str, question: str, n_results: int = 5
+        self, vendor_name: str, question: str, n_results: int = 5, user_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """Retrieve top chunks for a vendor and question for LLM input."""
         try:
+            vector_db = self.store_for(user_id)
             query_emb = self.embedding_service.generate_single_embedding(question)
-            retrieval = self.vector_db.search_similar_filtered(
+            retrieval = vector_db.search_similar_filtered(
                 query_emb, vendor_name, n_results
             )
 
-            sources = []
-            for i, (doc, meta, dist) in enumerate(
-                zip(retrieval["documents"], retrieval["metadatas"], retrieval["distances"])
-            ):
-                sources.append(
-                    {
-                        "rank": i + 1,
-                        "chunk_id": meta.get("chunk_id"),
-                        "vendor_name": meta.get("vendor_name"),
-                        "type": meta.get("type"),
-                        "similarity": 1 - dist,
-                        "content_excerpt": doc[:220]
-                        + ("..." if len(doc) > 220 else ""),
-                        "invoice_number": meta.get("invoice_number"),
-                        "invoice_date": meta.get("invoice_date"),
-                        "total_amount": meta.get("total_amount"),
-                        "drive_file_id": meta.get("drive_file_id"),
-                        "file_name": meta.get("file_name"),
-                        "web_view_link": meta.get("web_view_link"),
-                        "web_content_link": meta.get("web_content_link"),
-                    }
+            sources = [
+                self._build_source(i + 1, doc, meta, dist)
+                for i, (doc, meta, dist) in enumerate(
+                    zip(retrieval["documents"], retrieval["metadatas"], retrieval["distances"])
                 )
+            ]
 
             context_text = "\n\n".join(
                 f"[Source {s['rank']} | sim {s['similarity']:.3f}]\n{s['content_excerpt']}"
@@ -175,18 +241,144 @@ class VendorKnowledgeOrchestrator:
                 "context_text": "",
             }
 
+    @staticmethod
+    def _build_source(rank: int, doc: str, meta: Dict[str, Any], dist: float) -> Dict[str, Any]:
+        """Shape one retrieved chunk into the source dict returned to clients / fed to the LLM."""
+        return {
+            "rank": rank,
+            "chunk_id": meta.get("chunk_id"),
+            "vendor_name": meta.get("vendor_name"),
+            "type": meta.get("type"),
+            "similarity": 1 - dist,
+            "content_excerpt": doc[:220] + ("..." if len(doc) > 220 else ""),
+            "invoice_number": meta.get("invoice_number"),
+            "invoice_date": meta.get("invoice_date"),
+            "total_amount": meta.get("total_amount"),
+            "drive_file_id": meta.get("drive_file_id"),
+            "file_name": meta.get("file_name"),
+            "web_view_link": meta.get("web_view_link"),
+            "web_content_link": meta.get("web_content_link"),
+        }
+
     # New answer_query method used by API router
-    def answer_query(self, question: str, vendor_name: str | None = None, n_results: int = 5) -> Dict[str, Any]:
+    def answer_query(self, question: str, vendor_name: str | None = None, n_results: int = 5, user_id: Optional[str] = None) -> Dict[str, Any]:
+        vector_db = self.store_for(user_id)
+        ranked = self._ranking_answer(question, vendor_name, n_results, vector_db)
+        if ranked is not None:
+            return ranked
+        routed: List[Dict[str, Any]] = []
+        if not vendor_name:
+            vendor_name, routed = self._detect_vendor_locally(question, vector_db)
+            if not vendor_name and not routed:
+                vendor_name = detect_vendor_name(question, vector_db.list_vendors(), self.llm_service)
+        plan = self._prepare_answer(question, vendor_name, n_results, vector_db, user_id, routed)
+        if not plan.get("llm"):
+            return plan
+        rag_response = self.llm_service.generate_answer(question=question, sources=plan["sources"], cache_scope=plan["cache_scope"], query_embedding=plan["query_embedding"])
+        return self._finalize_answer(question, plan, rag_response, vector_db, n_results)
+
+    async def answer_query_async(self, question: str, vendor_name: str | None = None, n_results: int = 5, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """answer_query with Gemini awaited instead of blocking.
+
+        Retrieval and embedding run on the bounded ML/IO pools, and the LLM calls go through
+        the SDK's async client. The event loop is never blocked, so one worker
+        can keep many generations in flight. Cancelling the awaiting task (for
+        example when the client disconnects) aborts the pending Gemini call.
+        """
+        vector_db = await run_io(self.store_for, user_id)
+        ranked = await run_io(self._ranking_answer, question, vendor_name, n_results, vector_db)
+        if ranked is not None:
+            return ranked
+        routed: List[Dict[str, Any]] = []
+        if not vendor_name:
+            vendor_name, routed = await run_ml(self._detect_vendor_locally, question, vector_db)
+            if not vendor_name and not routed:
+                known_vendors = await run_io(vector_db.list_vendors)
+                vendor_name = await detect_vendor_name_async(question, known_vendors, self.llm_service)
+        plan = await run_ml(self._prepare_answer, question, vendor_name, n_results, vector_db, user_id, routed)
+        if not plan.get("llm"):
+            return plan
+        rag_response = await self.llm_service.generate_answer_async(question=question, sources=plan["sources"], cache_scope=plan["cache_scope"], query_embedding=plan["query_embedding"])
+        return await run_io(self._finalize_answer, question, plan, rag_response, vector_db, n_results)
+
+    async def stream_answer(self, question: str, vendor_name: str | None = None, n_results: int = 5, user_id: Optional[str] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """answer_query as a stream of (event, data) pairs for Server-Sent Events.
+
+        Sends "sources" as soon as retrieval finishes, then "token" events as
+        Gemini streams text. The final "done" event carries the final answer
+        (different from the streamed text only when a safety fallback replaced
+        it) and a timing breakdown in milliseconds. Structured answers arrive
+        as one token event. Failures end the stream with "error".
+        """
+        started = time.perf_counter()
+
+        def elapsed_ms() -> float:
+            return round((time.perf_counter() - started) * 1000, 1)
+
+        timings: Dict[str, float] = {}
+        vector_db = await run_io(self.store_for, user_id)
+        plan = await run_io(self._ranking_answer, question, vendor_name, n_results, vector_db)
+        if plan is None:
+            routed: List[Dict[str, Any]] = []
+            if not vendor_name:
+                vendor_name, routed = await run_ml(self._detect_vendor_locally, question, vector_db)
+                if not vendor_name and not routed:
+                    known_vendors = await run_io(vector_db.list_vendors)
+                    vendor_name = await detect_vendor_name_async(question, known_vendors, self.llm_service)
+                timings["vendor_detection_ms"] = elapsed_ms()
+            plan = await run_ml(self._prepare_answer, question, vendor_name, n_results, vector_db, user_id, routed)
+        timings["retrieval_ms"] = elapsed_ms()
+
+        if not plan.get("llm"):
+            if not plan.get("success"):
+                yield "error", {"message": plan.get("message", "Answer generation failed")}
+                return
+            yield "sources", {"vendor_name": plan.get("vendor_name"), "sources": plan.get("sources", [])}
+            yield "token", {"text": plan.get("answer", "")}
+            timings["total_ms"] = elapsed_ms()
+            yield "done", {"success": True, "vendor_name": plan.get("vendor_name"), "answer": plan.get("answer", ""), "message": plan.get("message", "ok"), "timings": timings}
+            return
+
+        yield "sources", {"vendor_name": plan["vendor_name"], "sources": plan["sources"]}
+        rag_response = await run_io(self.llm_service.cached_answer, question, plan["sources"], plan["cache_scope"], plan["query_embedding"])
+        if rag_response is not None:
+            timings["first_token_ms"] = elapsed_ms()
+            yield "token", {"text": rag_response.get("answer", "")}
+        else:
+            pieces: List[str] = []
+            try:
+                async for piece in self.llm_service.stream_answer_async(question, plan["sources"]):
+                    if not pieces:
+                        timings["first_token_ms"] = elapsed_ms()
+                    pieces.append(piece)
+                    yield "token", {"text": piece}
+                # A stream that produced no text was blocked (or empty); let the safety fallback answer
+                rag_response = {"success": True, "question": question, "answer": "".join(pieces) or SAFETY_BLOCKED_MESSAGE, "sources_used": len(plan["sources"])}
+                await run_io(self.llm_service.store_answer, question, plan["sources"], plan["cache_scope"], rag_response, (elapsed_ms() - timings["retrieval_ms"]) / 1000, plan["query_embedding"])
+            except Exception as e:
+                rag_response = {"success": False, "answer": "".join(pieces), "message": f"Streaming generation failed: {e}"}
+        timings["llm_ms"] = round(elapsed_ms() - timings["retrieval_ms"], 1)
+        final = await run_io(self._finalize_answer, question, plan, rag_response, vector_db, n_results)
+        timings["total_ms"] = elapsed_ms()
+        yield "done", {
+            "success": final.get("success", False),
+            "vendor_name": final.get("vendor_name"),
+            "answer": final.get("answer", ""),
+            "message": final.get("message", "ok"),
+            "cached": final.get("cached", False),
+            **({"semantic_match": final["semantic_match"]} if "semantic_match" in final else {}),
+            "timings": timings,
+        }
+
+    def _ranking_answer(self, question: str, vendor_name: str | None, n_results: int, vector_db: VectorDatabase) -> Optional[Dict[str, Any]]:
         q_lower = question.lower()
-        full_detail_requested = any(k in q_lower for k in ["full detail", "all invoices", "invoice view link", "view links", "full vendor detail", "complete vendor"])
-
         multi_vendor_ranking_requested = any(
             k in q_lower for k in ["top vendors", "rank vendors", "most spend", "highest spend", "spent most", "compare vendor spend", "vendor spend ranking", "among all the vendors", "spent most rank"]
         )
 
         # Structured multi-vendor ranking (bypass LLM) when request detected and vendor unspecified or ALL
         if multi_vendor_ranking_requested and (vendor_name is None or vendor_name == 'ALL'):
-            ranking = self.vector_db.get_vendor_spend_totals()
+            ranking = vector_db.get_vendor_spend_totals()
             if not ranking:
                 return {"success": False, "message": "No vendor spend data available", "answer": "", "sources": []}
             # Build ranking answer
@@ -212,13 +404,45 @@ class VendorKnowledgeOrchestrator:
                 "context_text": "multi_vendor_spend_ranking",
                 "message": "Structured multi-vendor spend ranking generated without LLM",
             }
-
-        if not vendor_name:
-            vendor_name = detect_vendor_name(question, self.vector_db.list_vendors(), self.llm_service)
+        return None
+
+    def _detect_vendor_locally(self, question: str, vector_db: VectorDatabase) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """Vendor scope without an LLM call: a name mention, else centroid routing.
+
+        Returns (vendor, routed). `routed` holds the centroid matches
+        ({"vendor_name", "score"}) within VENDOR_ROUTING_MARGIN of the best one.
+        It is empty when the best score is below VENDOR_ROUTING_MIN_SCORE or when
+        more than VENDOR_ROUTING_MAX_VENDORS vendors score about the same (the
+        question is not vendor specific). (None, []) leaves only the LLM fallback.
+        """
+        vendor, _ = _vendor_in_query(question, vector_db.list_vendors())
+        if vendor or not VENDOR_ROUTING_ENABLED:
+            return vendor, []
+        # The query embedding is cached, so retrieval below reuses it
+        scored = vector_db.route_vendors(self.embedding_service.generate_single_embedding(question), VENDOR_ROUTING_MAX_VENDORS + 1)
+        if not scored or scored[0]["score"] < VENDOR_ROUTING_MIN_SCORE:
+            return None, []
+        routed = [r for r in scored if scored[0]["score"] - r["score"] <= VENDOR_ROUTING_MARGIN]
+        if len(routed) > VENDOR_ROUTING_MAX_VENDORS:
+            return None, []
+        return (routed[0]["vendor_name"] if len(routed) == 1 else None), routed
+
+    def _prepare_answer(self, question: str, vendor_name: str | None, n_results: int, vector_db: VectorDatabase, user_id: Optional[str] = None, routed: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """Everything before the LLM call.
+
+        Structured (LLM-free) answers and failures are returned as final
+        responses. Otherwise the result is a plan `{"llm": True, ...}` holding
+        the retrieved sources that `_finalize_answer` needs. `routed` are the
+        centroid-routed vendors from `_detect_vendor_locally`; several of them
+        get one retrieval filtered to those vendors.
+        """
+        detection = "centroid routing: " + ", ".join(f"{r['vendor_name']} ({r['score']:.3f})" for r in routed) if routed else None
+        q_lower = question.lower()
+        full_detail_requested = any(k in q_lower for k in ["full detail", "all invoices", "invoice view link", "view links", "full vendor detail", "complete vendor"])
         if not vendor_name:
             # Structured full detail across ALL vendors (bypass LLM) if explicitly requested
             if full_detail_requested:
-                ranking = self.vector_db.get_vendor_spend_totals()
+                ranking = vector_db.get_vendor_spend_totals()
                 if not ranking:
                     return {"success": False, "message": "No vendor spend data available", "answer": "", "sources": []}
                 total_spend_all = sum(r.get("total_spend", 0.0) for r in ranking)
@@ -255,118 +479,59 @@ class VendorKnowledgeOrchestrator:
                     "vendor_detection": "explicit full detail all vendors"
                 }
             # Fallback: aggregate top chunks across all vendors instead of erroring
-            all_vendors = self.vector_db.list_vendors()
+            all_vendors = vector_db.list_vendors()
             if not all_vendors:
                 return {"success": False, "message": "No vendors loaded", "answer": "", "sources": []}
             query_emb = self.embedding_service.generate_single_embedding(question)
-            aggregated: List[Dict[str, Any]] = []
-            per_vendor_k = max(1, n_results // max(1, len(all_vendors)))
-            for v in all_vendors:
-                try:
-                    retrieval = self.vector_db.search_similar_filtered(query_emb, v, per_vendor_k)
-                    for doc, meta, dist in zip(retrieval["documents"], retrieval["metadatas"], retrieval["distances"]):
-                        aggregated.append({
-                            "rank": 0,  # will set after sorting
-                            "chunk_id": meta.get("chunk_id"),
-                            "vendor_name": meta.get("vendor_name"),
-                            "type": meta.get("type"),
-                            "similarity": 1 - dist,
-                            "content_excerpt": doc[:220] + ("..." if len(doc) > 220 else ""),
-                            "invoice_number": meta.get("invoice_number"),
-                            "invoice_date": meta.get("invoice_date"),
-                            "total_amount": meta.get("total_amount"),
-                            "drive_file_id": meta.get("drive_file_id"),
-                            "file_name": meta.get("file_name"),
-                            "web_view_link": meta.get("web_view_link"),
-                            "web_content_link": meta.get("web_content_link"),
-                        })
-                except Exception as e:
-                    print(f"Retrieval failed for vendor {v}: {e}")
-            if not aggregated:
+            if routed:
+                # One query filtered to the routed vendors
+                retrieval = vector_db.search_similar_vendors(query_emb, [r["vendor_name"] for r in routed], n_results)
+            else:
+                # Single global ANN query with a per-vendor diversity cap (cost independent of vendor count)
+                retrieval = vector_db.search_top_k_diverse(
+                    query_emb,
+                    n_results=n_results,
+                    max_per_vendor=RETRIEVAL_MAX_CHUNKS_PER_VENDOR,
+                    candidate_multiplier=RETRIEVAL_CANDIDATE_MULTIPLIER,
+                )
+            sources = [
+                self._build_source(i + 1, doc, meta, dist)
+                for i, (doc, meta, dist) in enumerate(
+                    zip(retrieval["documents"], retrieval["metadatas"], retrieval["distances"])
+                )
+            ]
+            if not sources:
                 return {"success": False, "message": "No context retrieved for any vendor", "answer": "", "sources": []}
-            aggregated.sort(key=lambda x: x["similarity"], reverse=True)
-            sources = aggregated[:n_results]
-            for i, s in enumerate(sources):
-                s["rank"] = i + 1
             context_text = "\n\n".join(
                 f"[Source {s['rank']} | {s['vendor_name']} | sim {s['similarity']:.3f}]\n{s['content_excerpt']}" for s in sources
             )
-            rag_response = self.llm_service.generate_answer(question=question, sources=sources)
-            answer_text = rag_response.get("answer", "")
-            # Safety fallback for multi-vendor aggregated queries
-            if isinstance(answer_text, str) and "Response blocked by safety filters" in answer_text:
-                ranking = self.vector_db.get_vendor_spend_totals()
-                lines = ["Multi-Vendor Summary (factual aggregate):"]
-                total_spend_all = 0.0
-                total_invoices_all = 0
-                for r in ranking:
-                    total_spend_all += r.get("total_spend", 0.0)
-                    total_invoices_all += r.get("invoice_count", 0)
-                lines.append(f"Total Vendors: {len(ranking)} | Aggregate Spend: ₹{total_spend_all:.2f} | Aggregate Invoices: {total_invoices_all}")
-                lines.append("")
-                for idx, r in enumerate(ranking[:max(n_results, 8)]):
-                    lines.append(
-                        f"{idx+1}. {r['vendor_name']} | Spend: ₹{r['total_spend']:.2f} | Invoices: {r['invoice_count']}"
-                    )
-                answer_text = "\n".join(lines)
-                return {
-                    "success": True,
-                    "vendor_name": None,
-                    "question": question,
-                    "answer": answer_text,
-                    "sources": sources,
-                    "context_text": context_text,
-                    "message": "Safety fallback multi-vendor aggregate summary"
-                }
             return {
-                "success": rag_response.get("success", False),
-                "vendor_name": None,  # Unknown / multiple
-                "question": question,
-                "answer": answer_text,
+                "llm": True,
+                "vendor_name": None,
                 "sources": sources,
                 "context_text": context_text,
-                "message": rag_response.get("message", "ok"),
-                "vendor_detection": "auto-detection failed; aggregated multi-vendor context used"
+                "cache_scope": self._answer_cache_scope(vector_db, None),
+                "query_embedding": query_emb,
+                "vendor_detection": detection or "auto-detection failed; aggregated multi-vendor context used",
             }
         try:
             # Structured path for detailed vendor request
             if full_detail_requested:
-                all_data = self.vector_db.get_all_by_vendor(vendor_name)
-                docs = all_data.get("documents", [])
-                metas = all_data.get("metadatas", [])
-                # Parse invoice metadata entries
-                invoices: List[Dict[str, Any]] = []
-                for doc, meta in zip(docs, metas):
-                    if not isinstance(meta, dict):
-                        continue
-                    if meta.get("type") != "invoice":
-                        continue
-                    # Decode potential JSON string fields
-                    parsed_meta = meta.copy()
-                    for key in ["line_items"]:
-                        val = parsed_meta.get(key)
-                        if isinstance(val, str):
-                            try:
-                                import json
-                                parsed_meta[key] = json.loads(val)
-                            except Exception:
-                                pass
-                    invoices.append({
-                        "invoice_number": parsed_meta.get("invoice_number"),
-                        "invoice_date": parsed_meta.get("invoice_date"),
-                        "total_amount": parsed_meta.get("total_amount"),
-                        "web_view_link": parsed_meta.get("web_view_link"),
-                        "web_content_link": parsed_meta.get("web_content_link"),
-                        "file_name": parsed_meta.get("file_name"),
-                        "drive_file_id": parsed_meta.get("drive_file_id"),
-                    })
+                # Indexed fact-table lookup (numeric amounts, no JSON re-decoding)
+                invoices = [
+                    {
+                        "invoice_number": f["invoice_number"],
+                        "invoice_date": f["invoice_date_raw"],
+                        "total_amount": f["total_amount"],
+                        "web_view_link": f["web_view_link"],
+                        "web_content_link": f["web_content_link"],
+                        "file_name": f["file_name"],
+                        "drive_file_id": f["drive_file_id"],
+                    }
+                    for f in vector_db.get_vendor_invoices(vendor_name)
+                ]
                 total_invoices = len(invoices)
-                total_amount_sum = 0.0
-                for inv in invoices:
-                    try:
-                        total_amount_sum += float(inv.get("total_amount") or 0)
-                    except Exception:
-                        pass
+                total_amount_sum = sum(inv["total_amount"] or 0.0 for inv in invoices)
                 # Build structured answer
                 lines = [
                     f"Vendor: {vendor_name}",
@@ -400,32 +565,87 @@ class VendorKnowledgeOrchestrator:
                     "message": "Structured vendor detail generated without LLM"
                 }
 
-            context = self.get_context_for_query(vendor_name=vendor_name, question=question, n_results=n_results)
+            context = self.get_context_for_query(vendor_name=vendor_name, question=question, n_results=n_results, user_id=user_id)
             if not context.get("success"):
                 return {"success": False, "message": context.get("message", "Context retrieval failed"), "answer": "", "sources": []}
-            rag_response = self.llm_service.generate_answer(question=question, sources=context.get("sources", []))
+            return {
+                "llm": True,
+                "vendor_name": vendor_name,
+                "sources": context.get("sources", []),
+                "context_text": context.get("context_text", ""),
+                "cache_scope": self._answer_cache_scope(vector_db, vendor_name),
+                # Served from the query embedding cache populated by the retrieval above
+                "query_embedding": self.embedding_service.generate_single_embedding(question),
+                "vendor_detection": detection,
+            }
+        except Exception as e:
+            return {"success": False, "message": f"Answer generation failed: {e}", "answer": "", "sources": []}
+
+    @staticmethod
+    def _answer_cache_scope(vector_db: VectorDatabase, vendor_name: str | None) -> Tuple[Any, ...]:
+        """Answer cache scope: tenant collection, the vendor's data version (changes on its ingest or a reset) and vendor."""
+        return (vector_db.collection_name, vector_db.vendor_data_version(vendor_name), vendor_name)
+
+    def _finalize_answer(self, question: str, plan: Dict[str, Any], rag_response: Dict[str, Any], vector_db: VectorDatabase, n_results: int) -> Dict[str, Any]:
+        """Turn the LLM response for a `_prepare_answer` plan into the API response (with safety fallbacks)."""
+        vendor_name = plan["vendor_name"]
+        if vendor_name is None:
+            sources, context_text = plan["sources"], plan["context_text"]
+            answer_text = rag_response.get("answer", "")
+            # Safety fallback for multi-vendor aggregated queries
+            if isinstance(answer_text, str) and "Response blocked by safety filters" in answer_text:
+                ranking = vector_db.get_vendor_spend_totals()
+                lines = ["Multi-Vendor Summary (factual aggregate):"]
+                total_spend_all = 0.0
+                total_invoices_all = 0
+                for r in ranking:
+                    total_spend_all += r.get("total_spend", 0.0)
+                    total_invoices_all += r.get("invoice_count", 0)
+                lines.append(f"Total Vendors: {len(ranking)} | Aggregate Spend: ₹{total_spend_all:.2f} | Aggregate Invoices: {total_invoices_all}")
+                lines.append("")
+                for idx, r in enumerate(ranking[:max(n_results, 8)]):
+                    lines.append(
+                        f"{idx+1}. {r['vendor_name']} | Spend: ₹{r['total_spend']:.2f} | Invoices: {r['invoice_count']}"
+                    )
+                answer_text = "\n".join(lines)
+                return {
+                    "success": True,
+                    "vendor_name": None,
+                    "question": question,
+                    "answer": answer_text,
+                    "sources": sources,
+                    "context_text": context_text,
+                    "message": "Safety fallback multi-vendor aggregate summary"
+                }
+            return {
+                "success": rag_response.get("success", False),
+                "vendor_name": None,  # Unknown / multiple
+                "question": question,
+                "answer": answer_text,
+                "sources": sources,
+                "context_text": context_text,
+                "message": rag_response.get("message", "ok"),
+                "cached": rag_response.get("cached", False),
+                **({"semantic_match": rag_response["semantic_match"]} if "semantic_match" in rag_response else {}),
+                "vendor_detection": plan["vendor_detection"]
+            }
+        try:
             # Safety fallback: structured summary if answer indicates block
             answer_text = rag_response.get("answer", "")
             if isinstance(answer_text, str) and "Response blocked by safety filters" in answer_text:
                 # Re-enter with full_detail flag if vendor summary requested implicitly
-                all_data = self.vector_db.get_all_by_vendor(vendor_name)
-                docs = all_data.get("documents", [])
-                metas = all_data.get("metadatas", [])
-                invoices = []
-                for doc, meta in zip(docs, metas):
-                    if isinstance(meta, dict) and meta.get("type") == "invoice":
-                        invoices.append(meta)
+                invoices = vector_db.get_vendor_invoices(vendor_name)
                 lines = [f"Vendor: {vendor_name}", f"Invoices Returned: {len(invoices)}"]
-                for m in invoices[:n_results]:
-                    lines.append(f"- {m.get('invoice_number')} | {m.get('invoice_date')} | ₹{m.get('total_amount')} | {m.get('web_view_link')}")
+                for f in invoices[:n_results]:
+                    lines.append(f"- {f['invoice_number']} | {f['invoice_date_raw']} | ₹{f['total_amount']} | {f['web_view_link']}")
                 answer_text = "\n".join(lines)
                 return {
                     "success": True,
                     "vendor_name": vendor_name,
                     "question": question,
                     "answer": answer_text,
-                    "sources": context.get("sources", []),
-                    "context_text": context.get("context_text", ""),
+                    "sources": plan["sources"],
+                    "context_text": plan["context_text"],
                     "message": "Safety fallback structured summary"
                 }
             return {
@@ -433,22 +653,32 @@ class VendorKnowledgeOrchestrator:
                 "vendor_name": vendor_name,
                 "question": question,
                 "answer": answer_text,
-                "sources": context.get("sources", []),
-                "context_text": context.get("context_text", ""),
-                "message": rag_response.get("message", "ok")
+                "sources": plan["sources"],
+                "context_text": plan["context_text"],
+                "message": rag_response.get("message", "ok"),
+                "cached": rag_response.get("cached", False),
+                **({"semantic_match": rag_response["semantic_match"]} if "semantic_match" in rag_response else {}),
+                **({"vendor_detection": plan["vendor_detection"]} if plan.get("vendor_detection") else {}),
             }
         except Exception as e:
             return {"success": False, "message": f"Answer generation failed: {e}", "answer": "", "sources": []}
 
-    def get_vendor_summary(self, vendor_name: str) -> Dict[str, Any]:
+    def get_vendor_summary(self, vendor_name: str, user_id: Optional[str] = None) -> Dict[str, Any]:
         try:
-            results = self.vector_db.search_by_vendor(vendor_name)
-            vendor_info = {"vendor_name": vendor_name, "total_chunks": len(results["documents"]), "invoices": [], "summary": {}}
-            for doc, metadata in zip(results["documents"], results["metadatas"]):
-                if metadata.get("type") == "invoice":
-                    vendor_info["invoices"].append({"invoice_number": metadata.get("invoice_number"), "amount": metadata.get("total_amount", 0), "invoice_date": metadata.get("invoice_date")})
-                elif metadata.get("type") == "vendor_summary":
-                    vendor_info["summary"] = {"last_updated": metadata.get("last_updated"), "total_invoices": metadata.get("invoice_count", 0), "total_amount": metadata.get("total_amount", 0)}
+            vector_db = self.store_for(user_id)
+            invoices = vector_db.get_vendor_invoices(vendor_name)
+            profile = vector_db.get_vendor_profile(vendor_name)
+            vendor_info = {
+                "vendor_name": vendor_name,
+                "total_chunks": len(invoices) + (1 if profile else 0),
+                "invoices": [
+                    {"invoice_number": f["invoice_number"], "amount": f["total_amount"], "invoice_date": f["invoice_date_raw"]}
+                    for f in invoices
+                ],
+                "summary": {},
+            }
+            if profile:
+                vendor_info["summary"] = {"last_updated": profile["last_updated"], "total_invoices": profile["invoice_count"], "total_amount": profile["total_amount"]}
             return {"success": True, "vendor_info": vendor_info}
         except Exception as e:
             return {"success": False, "message": f"Error getting vendor summary: {str(e)}"}
@@ -456,22 +686,102 @@ class VendorKnowledgeOrchestrator:
     def get_system_stats(self) -> Dict[str, Any]:
         try:
             db_stats = self.vector_db.get_collection_stats()
+            db_stats["tenants"] = self.tenant_stores.stats()
+            db_stats["embedding_cache"] = self.embedding_service.cache_stats()
+            db_stats["answer_cache"] = self.llm_service.cache_stats()
+            db_stats["analytics_cache"] = self.analytics_cache.stats()
+            db_stats["executors"] = executor_stats()
             return {"success": True, "stats": db_stats}
         except Exception as e:
             return {"success": False, "message": f"Error getting stats: {str(e)}"}
 
-    def reset_database(self) -> Dict[str, Any]:
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Hit ratios of the answer and query-embedding caches, plus LLM time saved by answer hits."""
+        return {
+            "success": True,
+            "answer_cache": self.llm_service.cache_stats(),
+            "embedding_cache": self.embedding_service.cache_stats(),
+            "analytics_cache": self.analytics_cache.stats(),
+        }
+
+    def reset_database(self, user_id: Optional[str] = None) -> Dict[str, Any]:
         try:
-            success = self.vector_db.delete_all()
+            success = self.store_for(user_id).delete_all()
+            # Remote masters must be re-downloaded into the emptied collection. The shared
+            # collection holds every user's data when per-tenant collections are off.
+            if success and not self.tenant_stores.enabled:
+                self.data_loader.manifest.forget()
+            elif success and user_id:
+                self.data_loader.manifest.forget(user_id)
             return {"success": success, "message": "Database reset successfully" if success else "Failed to reset database"}
         except Exception as e:
             return {"success": False, "message": f"Error resetting database: {str(e)}"}
 
-    def get_analytics(self, period: str = "year") -> Dict[str, Any]:
+    def get_analytics(self, period: str = "year", user_id: Optional[str] = None) -> Dict[str, Any]:
         """Compute high-level analytics across all vendors.
         Period influences monthlyTrend range (month, quarter, year, all)."""
+        vector_db = self.store_for(user_id)
+        inputs = self._analytics_inputs(period, vector_db)
+        if inputs["cached"] is not None:
+            return inputs["cached"]
+        data = self._compute_analytics(period, inputs)
+        if not data.get("success"):
+            return data
+        # Gemini summary only when the numbers changed since the cached one
+        try:
+            llm_text = self.llm_service.quick(self._analytics_summary_prompt(data), system="Spend Analytics Summarizer")
+            self._apply_analytics_summary(data, llm_text, vector_db)
+        except Exception as e:
+            data["llmSummary"] = f"LLM summary unavailable: {e}"
+        return self._store_analytics(inputs, data)
+
+    async def get_analytics_async(self, period: str = "year", user_id: Optional[str] = None) -> Dict[str, Any]:
+        """get_analytics with the Gemini summary awaited (aggregate reads run on the IO pool)."""
+        vector_db = await run_io(self.store_for, user_id)
+        inputs = await run_io(self._analytics_inputs, period, vector_db)
+        if inputs["cached"] is not None:
+            return inputs["cached"]
+        data = self._compute_analytics(period, inputs)
+        if not data.get("success"):
+            return data
         try:
-            spend_ranking = self.vector_db.get_vendor_spend_totals()
+            llm_text = await self.llm_service.quick_async(self._analytics_summary_prompt(data), system="Spend Analytics Summarizer")
+            await run_io(self._apply_analytics_summary, data, llm_text, vector_db)
+        except Exception as e:
+            data["llmSummary"] = f"LLM summary unavailable: {e}"
+        return self._store_analytics(inputs, data)
+
+    def _analytics_inputs(self, period: str, vector_db: VectorDatabase) -> Dict[str, Any]:
+        """Aggregates behind the analytics view, their fingerprint and the cached result if it still matches.
+
+        The fingerprint is a hash of the per-vendor totals and monthly spend
+        read from the sidecar tables, so ingests from any worker process are
+        detected. Cached results are returned as copies marked cached=True.
+        """
+        spend_ranking = vector_db.get_vendor_spend_totals()
+        monthly_spend = vector_db.get_monthly_spend()
+        fingerprint = hashlib.sha256(
+            json.dumps([spend_ranking, sorted(monthly_spend.items())], sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()[:16]
+        key = (vector_db.collection_name, period)
+        entry = self.analytics_cache.get(key)
+        cached = None
+        if entry is not None and entry["fingerprint"] == fingerprint:
+            cached = {**copy.deepcopy(entry["data"]), "cached": True}
+        return {"key": key, "fingerprint": fingerprint, "spend_ranking": spend_ranking, "monthly_spend": monthly_spend, "cached": cached}
+
+    def _store_analytics(self, inputs: Dict[str, Any], data: Dict[str, Any]) -> Dict[str, Any]:
+        data["fingerprint"] = inputs["fingerprint"]
+        data["cached"] = False
+        summary = data.get("llmSummary") or ""
+        # A failed summary is retried on the next request instead of being pinned to these numbers
+        if summary and not summary.startswith(("LLM summary unavailable", "Error generating content")):
+            self.analytics_cache.put(inputs["key"], {"fingerprint": inputs["fingerprint"], "data": copy.deepcopy(data)})
+        return data
+
+    def _compute_analytics(self, period: str, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            spend_ranking = inputs["spend_ranking"]
             if not spend_ranking:
                 return {"success": False, "message": "No spend data indexed"}
 
@@ -480,28 +790,9 @@ class VendorKnowledgeOrchestrator:
             total_invoices_all = sum(v["invoice_count"] for v in spend_ranking) or 1
             average_invoice = total_spend_all / total_invoices_all
 
-            raw = self.vector_db.collection.get(include=["metadatas"]).get("metadatas", [])
             from collections import defaultdict
-            import datetime
-            monthly_totals = defaultdict(float)
-            for meta in raw:
-                if not isinstance(meta, dict):
-                    continue
-                if meta.get("type") != "invoice":
-                    continue
-                date_str = meta.get("invoice_date")
-                amount_raw = meta.get("total_amount")
-                try:
-                    amount = float(str(amount_raw).replace(",", "")) if amount_raw is not None else 0.0
-                except Exception:
-                    amount = 0.0
-                try:
-                    dt = datetime.datetime.fromisoformat(date_str[:10]) if date_str else None
-                except Exception:
-                    dt = None
-                if dt:
-                    key = dt.strftime("%Y-%m")
-                    monthly_totals[key] += amount
+            # Per-month totals from the invoice fact table (dates already parsed to ISO)
+            monthly_totals = defaultdict(float, inputs["monthly_spend"])
             sorted_months = sorted(monthly_totals.keys())
             if period == "month":
                 last_key = sorted_months[-1] if sorted_months else None
@@ -552,30 +843,31 @@ class VendorKnowledgeOrchestrator:
                 "quarterlyTrend": quarterly_trend,
                 "period": period,
             }
-            # Gemini summary generation each call
-            try:
-                summary_prompt = (
-                    "You are a financial spend analytics assistant. Given the following JSON analytics object, "
-                    "produce a concise (<=120 words) plain English summary highlighting: overall spend, highest vendor, "
-                    "invoice volume, notable monthly or quarterly trend (increasing/decreasing), and any concentration risk. "
-                    "Avoid bullet points; use 2-3 sentences.\n\nJSON Data:\n" + str(data)
-                )
-                llm_text = self.llm_service.quick(summary_prompt, system="Spend Analytics Summarizer")
-                cleaned = llm_text.strip()
-                # Safety fallback: if blocked, build deterministic plain summary
-                if "Response blocked by safety filters" in cleaned:
-                    data["llmSummary"] = self._build_plain_analytics_summary(data)
-                else:
-                    data["llmSummary"] = cleaned
-            except Exception as e:
-                data["llmSummary"] = f"LLM summary unavailable: {e}" 
             return data
         except Exception as e:
             return {"success": False, "message": f"Analytics computation failed: {e}"}
 
-    def _build_plain_analytics_summary(self, analytics: Dict[str, Any]) -> str:
+    @staticmethod
+    def _analytics_summary_prompt(data: Dict[str, Any]) -> str:
+        return (
+            "You are a financial spend analytics assistant. Given the following JSON analytics object, "
+            "produce a concise (<=120 words) plain English summary highlighting: overall spend, highest vendor, "
+            "invoice volume, notable monthly or quarterly trend (increasing/decreasing), and any concentration risk. "
+            "Avoid bullet points; use 2-3 sentences.\n\nJSON Data:\n" + str(data)
+        )
+
+    def _apply_analytics_summary(self, data: Dict[str, Any], llm_text: str, vector_db: VectorDatabase) -> None:
+        cleaned = llm_text.strip()
+        # Safety fallback: if blocked, build deterministic plain summary
+        if "Response blocked by safety filters" in cleaned:
+            data["llmSummary"] = self._build_plain_analytics_summary(data, vector_db)
+        else:
+            data["llmSummary"] = cleaned
+
+    def _build_plain_analytics_summary(self, analytics: Dict[str, Any], vector_db: Optional[VectorDatabase] = None) -> str:
         """Deterministic non-LLM summary used when safety blocks or LLM fails."""
         try:
+            vector_db = vector_db or self.vector_db
             insights = analytics.get("insights", {})
             highest = insights.get("highestSpend", {})
             total_spend = insights.get("totalSpend", 0)
@@ -591,7 +883,7 @@ class VendorKnowledgeOrchestrator:
                     direction = "rising" if diff > 0 else ("falling" if diff < 0 else "stable")
                     trend_part = f" Recent monthly trend appears {direction}."
             concentration = ""
-            ranking = self.vector_db.get_vendor_spend_totals()
+            ranking = vector_db.get_vendor_spend_totals()
             if ranking:
                 top_share = (ranking[0]["total_spend"] / total_spend) if total_spend else 0
                 if top_share > 0.5:
@@ -607,24 +899,51 @@ class VendorKnowledgeOrchestrator:
         return await self.process_vendor_data(incremental=True, user_id=user_id)
 
 
+def _vendor_in_query(query: str, known_vendors: List[str]) -> Tuple[Optional[str], List[str]]:
+    """(confidently matched vendor, shortlist for LLM disambiguation) from the in-memory matcher."""
+    vendor, _, candidates = vendor_matcher_for(known_vendors).match(query)
+    return vendor, [name for name, _ in candidates]
+
+
+def _vendor_disambiguation_prompt(query: str, known_vendors: List[str]) -> str:
+    return (
+        "Given this user question: '" + query + "'\n"
+        + "Which vendor from the following list does it most likely refer to?\n"
+        + ", ".join(known_vendors) + "\n"
+        + "Return exactly one vendor name from the list or 'None' if unsure."
+    )
+
+
+def _vendor_from_guess(vendor_guess: str, known_vendors: List[str]) -> Optional[str]:
+    return vendor_matcher_for(known_vendors).exact(vendor_guess)
+
+
 def detect_vendor_name(query: str, known_vendors: List[str], llm_service: Optional[LLMService] = None) -> Optional[str]:
-    query_lower = query.lower()
-    for vendor in known_vendors:
-        if vendor.lower() in query_lower:
-            return vendor
-    if llm_service and known_vendors:
-        prompt = (
-            "Given this user question: '" + query + "'\n"
-            + "Which vendor from the following list does it most likely refer to?\n"
-            + ", ".join(known_vendors) + "\n"
-            + "Return exactly one vendor name from the list or 'None' if unsure."
-        )
+    """Vendor named in the question: exact/fuzzy matcher first, Gemini only for low-confidence cases.
+
+    The LLM prompt lists the matcher's shortlist when there is one, so its size
+    no longer grows with the vendor count.
+    """
+    vendor, shortlist = _vendor_in_query(query, known_vendors)
+    if vendor:
+        return vendor
+    if llm_service and known_vendors and VENDOR_LLM_FALLBACK:
+        try:
+            response_text = llm_service.quick(_vendor_disambiguation_prompt(query, shortlist or known_vendors), system="Vendor name disambiguation")
+            return _vendor_from_guess(response_text.strip(), known_vendors)
+        except Exception as e:
+            print(f"LLM vendor detection failed: {e}")
+    return None
+
+
+async def detect_vendor_name_async(query: str, known_vendors: List[str], llm_service: Optional[LLMService] = None) -> Optional[str]:
+    vendor, shortlist = _vendor_in_query(query, known_vendors)
+    if vendor:
+        return vendor
+    if llm_service and known_vendors and VENDOR_LLM_FALLBACK:
         try:
-            response_text = llm_service.quick(prompt, system="Vendor name disambiguation")
-            vendor_guess = response_text.strip()
-            for vendor in known_vendors:
-                if vendor.lower() in vendor_guess.lower():
-                    return vendor
+            response_text = await llm_service.quick_async(_vendor_disambiguation_prompt(query, shortlist or known_vendors), system="Vendor name disambiguation")
+            return _vendor_from_guess(response_text.strip(), known_vendors)
         except Exception as e:
             print(f"LLM vendor detection failed: {e}")
     return None
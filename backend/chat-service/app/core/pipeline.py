@@ -0,0 +1,169 @@
+"""Streaming ingest: vendors -> chunks -> embeddings -> vector store, in fixed-size windows.
+
+`IngestPipeline.run` pulls vendors from a generator (local files, Drive
+masters or pushed payloads) one at a time. Their chunks are packed into
+windows of INGEST_WINDOW_CHUNKS. A producer thread embeds each window and
+hands it to the calling thread, which upserts it. The queue between them
+holds at most INGEST_QUEUE_WINDOWS windows: when the writer falls behind,
+the producer blocks instead of reading further. Memory therefore stays
+around (queue + 2) windows plus the vendor being parsed, however large the
+tenant.
+
+Every window is written as soon as it is embedded, so a crash keeps what
+was stored. Embeddings of stored text are also in the content-hash cache.
+Re-running the load (incremental=true skips stored chunk IDs) resumes
+cheaply. The numpy backend buffers upserts in memory and is flushed every
+INGEST_FLUSH_EVERY_WINDOWS windows, so each append + fsync covers many rows.
+Its sidecar rows are written only after the flush that persists them. The
+orchestrator records the Drive manifest after `run` returns, i.e. after the
+final flush.
+"""
+import itertools
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from app.config import INGEST_FLUSH_EVERY_WINDOWS, INGEST_QUEUE_WINDOWS, INGEST_WINDOW_CHUNKS
+from app.models.schema import KnowledgeChunk, Vendor
+
+_DONE = object()
+
+
+class IngestPipeline:
+    """One streaming ingest into one vector store; build a new instance per run."""
+
+    def __init__(
+        self,
+        data_loader,
+        embedding_service,
+        vector_db,
+        incremental: bool = False,
+        progress: Optional[Dict[str, Any]] = None,
+        window_chunks: int = INGEST_WINDOW_CHUNKS,
+        queue_windows: int = INGEST_QUEUE_WINDOWS,
+        flush_every_windows: int = INGEST_FLUSH_EVERY_WINDOWS,
+    ):
+        self.data_loader = data_loader
+        self.embedding_service = embedding_service
+        self.vector_db = vector_db
+        self.incremental = incremental
+        self.progress = progress if progress is not None else {}
+        self.window_chunks = max(1, window_chunks)
+        self.flush_every_windows = max(1, flush_every_windows)
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, queue_windows))
+        self._stop = threading.Event()
+        self._producer_error: Optional[BaseException] = None
+        self.stats: Dict[str, Any] = {
+            "vendors_loaded": 0,
+            "chunks_created": 0,
+            "skipped_existing": 0,
+            "embeddings_generated": 0,
+            "windows": 0,
+            "failed_windows": 0,
+            "producer_blocked_seconds": 0.0,
+        }
+        # Token/window counts, filled by the loader once every vendor has been chunked
+        self.chunk_stats: Dict[str, Any] = {}
+        self.embedding_stats: Dict[str, Any] = {"chunks": 0, "cache_hits": 0, "encoded": 0, "encode_seconds": 0.0}
+        self.write_stats: Dict[str, Any] = {"batches": 0, "chunks_written": 0, "batch_seconds": [], "total_seconds": 0.0}
+
+    def _count_vendors(self, vendors: Iterable[Vendor]) -> Iterator[Vendor]:
+        for vendor in vendors:
+            self.stats["vendors_loaded"] += 1
+            yield vendor
+
+    def _windows(self, vendors: Iterable[Vendor]) -> Iterator[List[KnowledgeChunk]]:
+        chunks = self.data_loader.iter_knowledge_chunks(self._count_vendors(vendors), stats=self.chunk_stats)
+        while not self._stop.is_set():
+            window = list(itertools.islice(chunks, self.window_chunks))
+            if not window:
+                return
+            self.stats["chunks_created"] += len(window)
+            if self.incremental:
+                existing_ids = self.vector_db.existing_ids([c.chunk_id for c in window])
+                self.stats["skipped_existing"] += len(existing_ids)
+                window = [c for c in window if c.chunk_id not in existing_ids]
+            if window:
+                yield window
+
+    def _put(self, item: Any) -> bool:
+        """Blocking put that gives up once the writer has stopped."""
+        started = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                self.stats["producer_blocked_seconds"] += time.perf_counter() - started
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, vendors: Iterable[Vendor]) -> None:
+        try:
+            with self.embedding_service.bulk_session():
+                for window in self._windows(vendors):
+                    self.progress["chunks_total"] = self.progress.get("chunks_total", 0) + len(window)
+                    batch: Dict[str, Any] = {}
+                    embedded = self.embedding_service.generate_embeddings(window, stats=batch)
+                    for key in ("chunks", "cache_hits", "encoded", "encode_seconds"):
+                        self.embedding_stats[key] += batch.get(key) or 0
+                    for key in ("mode", "workers", "batch_size"):
+                        if key in batch:
+                            self.embedding_stats[key] = batch[key]
+                    done = sum(1 for c in embedded if c.embedding is not None)
+                    self.stats["embeddings_generated"] += done
+                    self.progress["chunks_embedded"] = self.progress.get("chunks_embedded", 0) + done
+                    if not self._put(embedded):
+                        return
+        except BaseException as e:
+            self._producer_error = e
+        finally:
+            self._put(_DONE)
+
+    def run(self, vendors: Iterable[Vendor]) -> bool:
+        """Stream `vendors` into the store.
+
+        True when no window failed and either some chunk was written or every
+        chunk was already stored (an incremental run with nothing new).
+        """
+        started = time.perf_counter()
+        self.progress["stage"] = "streaming"
+        producer = threading.Thread(target=self._produce, args=(vendors,), name="ingest-embed", daemon=True)
+        producer.start()
+        try:
+            while True:
+                window = self._queue.get()
+                if window is _DONE:
+                    break
+                self.stats["windows"] += 1
+                flush = self.stats["windows"] % self.flush_every_windows == 0
+                stored = self.vector_db.store_embeddings(window, progress=self.progress, flush=flush)
+                if not stored and any(c.embedding is not None for c in window):
+                    self.stats["failed_windows"] += 1
+                written = self.vector_db.last_write_stats
+                for key in ("batches", "chunks_written", "total_seconds"):
+                    self.write_stats[key] += written.get(key, 0)
+                self.write_stats["batch_seconds"].extend(written.get("batch_seconds", []))
+            self.vector_db.flush()
+        finally:
+            self._stop.set()
+            producer.join()
+        if self._producer_error is not None:
+            raise self._producer_error
+        self.stats["producer_blocked_seconds"] = round(self.stats["producer_blocked_seconds"], 3)
+        self.stats["total_seconds"] = round(time.perf_counter() - started, 3)
+        self.write_stats["total_seconds"] = round(self.write_stats["total_seconds"], 4)
+        seconds = self.embedding_stats["encode_seconds"] = round(self.embedding_stats["encode_seconds"], 3)
+        self.embedding_stats["chunks_per_sec"] = round(self.embedding_stats["encoded"] / seconds, 2) if seconds else None
+        self.vector_db.last_write_stats = self.write_stats
+        up_to_date = self.stats["chunks_created"] > 0 and self.stats["chunks_created"] == self.stats["skipped_existing"]
+        return not self.stats["failed_windows"] and (self.write_stats["chunks_written"] > 0 or up_to_date)
+
+    def pipeline_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "window_chunks": self.window_chunks,
+            "queue_windows": self._queue.maxsize,
+            "flush_every_windows": self.flush_every_windows,
+        }
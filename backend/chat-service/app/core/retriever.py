@@ -1,18 +1,38 @@
+import os
+import json
+import time
 import chromadb
+import numpy as np
 from chromadb.config import Settings
-from typing import List, Dict, Any
+from typing import Any, Callable, Dict, List, Optional
 from app.models import KnowledgeChunk
+from app.core.aggregates import VendorAggregateStore
+from app.core.facts import InvoiceFactStore
+from app.core.centroids import VendorCentroidStore
+from app.config import VECTORDB_WRITE_BATCH_SIZE, VECTORDB_PERSIST_DIRECTORY, VECTORDB_BACKEND
 
 class VectorDatabase:
-    def __init__(self, persist_directory: str = "data/vectordb", collection_name: str = "vendor_invoices"):
+    # Chroma persists every upsert; backends that stage writes until _flush set this
+    buffers_writes = False
+
+    def __init__(self, persist_directory: str = "data/vectordb", collection_name: str = "vendor_invoices", write_batch_size: int = VECTORDB_WRITE_BATCH_SIZE):
         """Initialize ChromaDB vector database."""
         self.persist_directory = persist_directory
         self.collection_name = collection_name
+        self.write_batch_size = max(1, write_batch_size)
         self.vendor_names = set()  # track distinct vendors
-        
+        self.last_write_stats: Dict[str, Any] = {}
+        # Sidecar writes waiting for the staged rows they describe to be flushed (see _after_flush)
+        self._unflushed_sidecars: List[Callable[[], None]] = []
+        self._open_backend()
+        self._init_sidecars()
+        print(f"Vector database initialized with collection: {self.collection_name}")
+
+    def _open_backend(self) -> None:
+        """Open the vector backend (overridden by alternative backends, see numpy_store.py)."""
         # Initialize ChromaDB client with persistence
         self.client = chromadb.PersistentClient(
-            path=persist_directory,
+            path=self.persist_directory,
             settings=Settings(
                 anonymized_telemetry=False,
                 allow_reset=True
@@ -24,148 +44,257 @@ class VectorDatabase:
             name=self.collection_name,
             metadata={"description": "Vendor invoice knowledge base for VendorIQ"}
         )
-        
-        print(f"Vector database initialized with collection: {self.collection.name}")
-    
-    def store_embeddings(self, chunks: List[KnowledgeChunk]) -> bool:
-        """Store knowledge chunks with embeddings in the vector database.
-        Safely handles duplicate IDs by updating existing entries or generating unique IDs.
+
+    def _init_sidecars(self) -> None:
+        """Backend-independent state kept next to the vectors."""
+        # Per-vendor spend aggregates maintained on write (avoids full metadata scans on read), plus the
+        # persistent data versions that key cached answers (see vendor_data_version)
+        os.makedirs(self.persist_directory, exist_ok=True)
+        self.aggregates = VendorAggregateStore(os.path.join(self.persist_directory, f"{self.collection_name}_aggregates.sqlite3"))
+        # Typed invoice / line item facts for structured answers (no JSON re-decoding on read)
+        self.facts = InvoiceFactStore(os.path.join(self.persist_directory, f"{self.collection_name}_facts.sqlite3"))
+        # One centroid embedding per vendor for routing questions that do not name the vendor
+        self.centroids = VendorCentroidStore(os.path.join(self.persist_directory, f"{self.collection_name}_centroids.sqlite3"))
+
+    # --- Backend primitives (overridden by alternative backends, see numpy_store.py) ---
+    def _upsert(self, ids: List[str], embeddings: List[Any], documents: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def _delete(self, ids: List[str]) -> None:
+        self.collection.delete(ids=ids)
+
+    def _flush(self) -> None:
+        """Called at the end of store_embeddings unless flush=False (Chroma persists on every upsert)."""
+
+    def _query(self, query_embedding: List[float], n_results: int, where: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        kwargs: Dict[str, Any] = {"where": where} if where else {}
+        results = self.collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results,
+            include=["documents", "metadatas", "distances"],
+            **kwargs,
+        )
+        return {
+            "documents": results["documents"][0] if results["documents"] else [],
+            "metadatas": results["metadatas"][0] if results["metadatas"] else [],
+            "distances": results["distances"][0] if results["distances"] else [],
+        }
+
+    def _get(self, where: Dict[str, Any] | None = None, ids: List[str] | None = None, include: List[str] | None = None) -> Dict[str, Any]:
+        kwargs: Dict[str, Any] = {}
+        if where:
+            kwargs["where"] = where
+        if ids is not None:
+            kwargs["ids"] = ids
+        return self.collection.get(include=include if include is not None else ["documents", "metadatas"], **kwargs)
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def _reset_collection(self) -> None:
+        self.client.delete_collection(name=self.collection_name)
+        self.collection = self.client.get_or_create_collection(
+            name=self.collection_name,
+            metadata={"description": "Vendor invoice knowledge base for VendorIQ"}
+        )
+
+    def flush(self) -> None:
+        """Persist writes buffered by store_embeddings(..., flush=False)."""
+        self._commit()
+
+    def _after_flush(self, apply: Callable[[], None]) -> None:
+        """Run a sidecar write now, or, on a backend that buffers writes, once its rows are flushed.
+
+        Sidecar rows (facts, centroids, aggregates and the data versions) must
+        never describe rows that a crash could still lose, and the Drive
+        manifest is recorded only after the final flush of an ingest.
         """
-        try:
-            # Fetch existing IDs from collection to distinguish add vs update
-            try:
-                existing_data = self.collection.get(include=[])
-                existing_ids_set = set(existing_data.get("ids", []))
-            except Exception:
-                existing_ids_set = set()
+        if self.buffers_writes:
+            self._unflushed_sidecars.append(apply)
+        else:
+            apply()
 
-            add_ids: List[str] = []
-            add_embeddings: List[List[float]] = []
-            add_documents: List[str] = []
-            add_metadatas: List[Dict[str, Any]] = []
+    def _commit(self) -> None:
+        try:
+            self._flush()
+        except Exception:
+            # The staged rows were not persisted: drop the sidecar writes describing them
+            self._unflushed_sidecars.clear()
+            raise
+        applied, self._unflushed_sidecars = self._unflushed_sidecars, []
+        for apply in applied:
+            apply()
 
-            update_ids: List[str] = []
-            update_embeddings: List[List[float]] = []
-            update_documents: List[str] = []
-            update_metadatas: List[Dict[str, Any]] = []
+    def store_embeddings(self, chunks: List[KnowledgeChunk], progress: Optional[Dict[str, Any]] = None, flush: bool = True) -> bool:
+        """Store knowledge chunks with embeddings in the vector database.
 
+        Chunks are streamed to Chroma's native upsert in batches of at most
+        `write_batch_size`, so existing IDs are overwritten and new ones added
+        without first scanning the collection's IDs. Intra-call duplicate IDs
+        get a deterministic `-dup{idx}` suffix. Per-batch timings are kept in
+        `last_write_stats`. When a `progress` dict is given, its
+        "chunks_stored" counter grows after every batch. Streaming ingests
+        pass flush=False for most windows and flush every few windows.
+        """
+        started = time.perf_counter()
+        stats: Dict[str, Any] = {"batches": 0, "chunks_written": 0, "batch_seconds": [], "total_seconds": 0.0}
+        self.last_write_stats = stats
+        stored_before = progress.get("chunks_stored", 0) if progress is not None else 0
+        try:
+            self._delete_stale_windows(chunks)
             seen_batch_ids: set[str] = set()
+            batch: List[Dict[str, Any]] = []
 
             for idx, chunk in enumerate(chunks):
-                if not (chunk.embedding and len(chunk.embedding) > 0):
+                if chunk.embedding is None or len(chunk.embedding) == 0:
                     continue
-                original_id = chunk.chunk_id
-                cid = original_id
-                # Ensure intra-batch uniqueness
+                cid = chunk.chunk_id
+                # Ensure intra-call uniqueness (deterministic suffix based on index position)
                 if cid in seen_batch_ids:
-                    # create deterministic suffix based on index position
-                    suffix = f"-dup{idx}"
-                    cid = f"{original_id}{suffix}"
-                    # reflect new id in metadata only; do not mutate chunk_id field externally
-                # Prepare metadata
-                metadata = chunk.metadata.copy()
-                metadata["chunk_id"] = cid
-                metadata["vendor_name"] = chunk.vendor_name
-                for key, value in metadata.items():
-                    if isinstance(value, (list, dict)):
-                        import json
-                        metadata[key] = json.dumps(value)
-                    elif value is None:
-                        metadata[key] = ""
-                    elif not isinstance(value, (str, int, float, bool)):
-                        metadata[key] = str(value)
-
-                # Decide add vs update
-                if original_id in existing_ids_set and cid == original_id:
-                    update_ids.append(cid)
-                    update_embeddings.append(chunk.embedding)
-                    update_documents.append(chunk.content)
-                    update_metadatas.append(metadata)
-                else:
-                    add_ids.append(cid)
-                    add_embeddings.append(chunk.embedding)
-                    add_documents.append(chunk.content)
-                    add_metadatas.append(metadata)
-
+                    cid = f"{chunk.chunk_id}-dup{idx}"
                 seen_batch_ids.add(cid)
-                self.vendor_names.add(chunk.vendor_name)
+                batch.append({"id": cid, "chunk": chunk, "metadata": self._flatten_metadata(chunk, cid)})
+                if len(batch) >= self.write_batch_size:
+                    self._upsert_batch(batch, stats)
+                    batch = []
+                    if progress is not None:
+                        progress["chunks_stored"] = stored_before + stats["chunks_written"]
+            if batch:
+                self._upsert_batch(batch, stats)
+            if flush:
+                self._commit()
+            if progress is not None:
+                progress["chunks_stored"] = stored_before + stats["chunks_written"]
 
-            total_ops = len(add_ids) + len(update_ids)
-            if total_ops == 0:
+            stats["total_seconds"] = round(time.perf_counter() - started, 4)
+            if stats["chunks_written"] == 0:
                 print("No valid embeddings to store!")
                 return False
-
-            # Perform adds
-            if add_ids:
-                self.collection.add(
-                    ids=add_ids,
-                    embeddings=add_embeddings,
-                    documents=add_documents,
-                    metadatas=add_metadatas,
-                )
-
-            # Perform updates for existing IDs
-            if update_ids:
-                updated = False
-                try:
-                    # Preferred path if update API exists
-                    if hasattr(self.collection, "update"):
-                        self.collection.update(
-                            ids=update_ids,
-                            embeddings=update_embeddings,
-                            documents=update_documents,
-                            metadatas=update_metadatas,
-                        )
-                        updated = True
-                    elif hasattr(self.collection, "upsert"):
-                        # Some versions provide upsert combining add/update semantics
-                        self.collection.upsert(
-                            ids=update_ids,
-                            embeddings=update_embeddings,
-                            documents=update_documents,
-                            metadatas=update_metadatas,
-                        )
-                        updated = True
-                except Exception as ue:
-                    print(f"Update/upsert failed ({ue}); attempting delete+add fallback for {len(update_ids)} IDs")
-
-                if not updated:
-                    # Fallback: delete then add back
-                    try:
-                        self.collection.delete(ids=update_ids)
-                        self.collection.add(
-                            ids=update_ids,
-                            embeddings=update_embeddings,
-                            documents=update_documents,
-                            metadatas=update_metadatas,
-                        )
-                    except Exception as de:
-                        print(f"Fallback delete+add failed: {de}")
-                        return False
-
-            print(f"Successfully stored embeddings. Added: {len(add_ids)}, Updated: {len(update_ids)}, Total processed: {total_ops}")
+            print(f"Successfully stored embeddings. Upserted: {stats['chunks_written']} in {stats['batches']} batches ({stats['total_seconds']}s)")
             return True
 
         except Exception as e:
+            stats["total_seconds"] = round(time.perf_counter() - started, 4)
+            stats["error"] = str(e)
             print(f"Error storing embeddings: {str(e)}")
             return False
-    
+
+    @staticmethod
+    def _flatten_metadata(chunk: KnowledgeChunk, cid: str) -> Dict[str, Any]:
+        """Chroma metadata only holds scalars: JSON-encode lists/dicts, blank out None."""
+        metadata = chunk.metadata.copy()
+        metadata["chunk_id"] = cid
+        metadata["vendor_name"] = chunk.vendor_name
+        for key, value in metadata.items():
+            if isinstance(value, (list, dict)):
+                metadata[key] = json.dumps(value)
+            elif value is None:
+                metadata[key] = ""
+            elif not isinstance(value, (str, int, float, bool)):
+                metadata[key] = str(value)
+        return metadata
+
+    def _delete_stale_windows(self, chunks: List[KnowledgeChunk]) -> int:
+        """Delete stored line-item windows that the re-chunked invoices in `chunks` no longer have.
+
+        An invoice split into N windows is stored as `<id>`, `<id>-w1` ...
+        `<id>-w(N-1)`. When it is re-indexed with fewer windows (or as one
+        chunk) the upserts only overwrite the first ones, so windows with
+        index >= the new count are removed here. This stays correct when an
+        invoice's windows span several store_embeddings calls.
+
+        Stored windows are contiguous, so the stale ones are found by ID
+        (point lookups, no metadata scan): probe `<id>-w<count>` for every
+        invoice, then the next index only for invoices where it existed.
+        """
+        window_counts: Dict[str, int] = {}
+        for chunk in chunks:
+            if chunk.embedding is None or chunk.metadata.get("type") != "invoice":
+                continue
+            parent_id = chunk.metadata.get("parent_chunk_id") or chunk.chunk_id
+            window_counts[parent_id] = int(chunk.metadata.get("window_count") or 1)
+        stale_ids: List[str] = []
+        probe = dict(window_counts)
+        while probe:
+            candidates = {f"{parent_id}-w{index}": parent_id for parent_id, index in probe.items()}
+            found = self.existing_ids(list(candidates))
+            stale_ids.extend(found)
+            probe = {candidates[cid]: probe[candidates[cid]] + 1 for cid in found}
+        if stale_ids:
+            stale_vectors = self._stored_vectors(stale_ids)
+            self._delete(stale_ids)
+            self._after_flush(lambda: self.centroids.remove(stale_vectors))
+            print(f"Deleted {len(stale_ids)} stale invoice windows")
+        return len(stale_ids)
+
+    def _stored_vectors(self, ids: List[str]) -> List[tuple]:
+        """(chunk_id, vendor_name, embedding) of the given IDs that are already stored."""
+        data = self._get(ids=ids, include=["metadatas", "embeddings"])
+        embeddings = data.get("embeddings")
+        if embeddings is None:
+            embeddings = []
+        return [
+            (cid, (meta or {}).get("vendor_name") or "", emb)
+            for cid, meta, emb in zip(data.get("ids", []), data.get("metadatas", []), embeddings)
+        ]
+
+    def _upsert_batch(self, batch: List[Dict[str, Any]], stats: Dict[str, Any]) -> None:
+        t0 = time.perf_counter()
+        # Vectors about to be overwritten, so the centroids can swap them out
+        replaced = self._stored_vectors([b["id"] for b in batch])
+        self._upsert(
+            ids=[b["id"] for b in batch],
+            # One contiguous (batch, dim) float32 block per upsert
+            embeddings=np.stack([b["chunk"].embedding for b in batch]).astype(np.float32, copy=False),
+            documents=[b["chunk"].content for b in batch],
+            metadatas=[b["metadata"] for b in batch],
+        )
+        # Sidecars record each invoice once: line-item windows are keyed by their parent
+        # invoice ID and only the first window (carrying the full invoice metadata) is recorded
+        entries = [
+            {
+                "chunk_id": b["chunk"].metadata.get("parent_chunk_id") or b["id"],
+                "vendor_name": b["chunk"].vendor_name,
+                "type": b["chunk"].metadata.get("type"),
+                "metadata": b["chunk"].parent_metadata or b["chunk"].metadata,
+            }
+            for b in batch
+            if not b["chunk"].metadata.get("window_index")
+        ]
+        vectors = [(b["id"], b["chunk"].vendor_name, b["chunk"].embedding) for b in batch]
+        vendors = {b["chunk"].vendor_name for b in batch}
+
+        def record_sidecars() -> None:
+            self.facts.record(entries)
+            self.centroids.record(vectors, replaced=replaced)
+            # Last: bumps the data versions, so cached answers are invalidated only once every sidecar has the batch
+            self.aggregates.record(entries, written_vendors=vendors)
+            self.vendor_names.update(vendors)
+
+        self._after_flush(record_sidecars)
+        elapsed = round(time.perf_counter() - t0, 4)
+        stats["batches"] += 1
+        stats["chunks_written"] += len(batch)
+        stats["batch_seconds"].append(elapsed)
+        print(f"Upserted batch {stats['batches']} ({len(batch)} chunks) in {elapsed}s")
+
+    def existing_ids(self, ids: List[str]) -> set[str]:
+        """Return the subset of `ids` already stored (point lookups, no full ID scan)."""
+        found: set[str] = set()
+        for i in range(0, len(ids), self.write_batch_size):
+            try:
+                data = self._get(ids=ids[i:i + self.write_batch_size], include=[])
+                found.update(data.get("ids", []))
+            except Exception as e:
+                print(f"Error checking existing ids: {e}")
+        return found
+
     # Existing generic search retained (internal)
     def search(self, query_embedding: List[float], n_results: int = 5) -> Dict[str, Any]:
         """Search for similar chunks using vector similarity."""
         try:
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=n_results,
-                include=["documents", "metadatas", "distances"]
-            )
-            
-            return {
-                "documents": results["documents"][0] if results["documents"] else [],
-                "metadatas": results["metadatas"][0] if results["metadatas"] else [],
-                "distances": results["distances"][0] if results["distances"] else []
-            }
-            
+            return self._query(query_embedding, n_results)
+
         except Exception as e:
             print(f"Error searching vector database: {str(e)}")
             return {"documents": [], "metadatas": [], "distances": []}
@@ -177,26 +306,42 @@ class VectorDatabase:
     # Added filtered similarity search by vendor_name
     def search_similar_filtered(self, query_embedding: List[float], vendor_name: str, n_results: int = 5) -> Dict[str, Any]:
         try:
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=n_results,
-                where={"vendor_name": vendor_name},
-                include=["documents", "metadatas", "distances"],
-            )
-            return {
-                "documents": results["documents"][0] if results["documents"] else [],
-                "metadatas": results["metadatas"][0] if results["metadatas"] else [],
-                "distances": results["distances"][0] if results["distances"] else [],
-            }
+            return self._query(query_embedding, n_results, where={"vendor_name": vendor_name})
         except Exception as e:
             print(f"Error in filtered search: {e}")
             return {"documents": [], "metadatas": [], "distances": []}
 
+    def search_top_k_diverse(self, query_embedding: List[float], n_results: int = 5, max_per_vendor: int | None = None, candidate_multiplier: int = 4) -> Dict[str, Any]:
+        """Global top-k across all vendors in a single ANN query.
+
+        When `max_per_vendor` is set the query over-fetches
+        `n_results * candidate_multiplier` candidates and keeps at most
+        `max_per_vendor` chunks per vendor (in similarity order), so one
+        vendor cannot crowd out the rest. Cost is independent of vendor count.
+        """
+        n_candidates = n_results * max(1, candidate_multiplier) if max_per_vendor else n_results
+        raw = self.search(query_embedding, n_candidates)
+        if not max_per_vendor:
+            return raw
+        documents, metadatas, distances = [], [], []
+        per_vendor: Dict[str, int] = {}
+        for doc, meta, dist in zip(raw["documents"], raw["metadatas"], raw["distances"]):
+            vendor = (meta or {}).get("vendor_name") or "Unknown"
+            if per_vendor.get(vendor, 0) >= max_per_vendor:
+                continue
+            per_vendor[vendor] = per_vendor.get(vendor, 0) + 1
+            documents.append(doc)
+            metadatas.append(meta)
+            distances.append(dist)
+            if len(documents) >= n_results:
+                break
+        return {"documents": documents, "metadatas": metadatas, "distances": distances}
+
     def search_by_vendor(self, vendor_name: str, n_results: int = 10) -> Dict[str, Any]:
         """Search for chunks by vendor name."""
         try:
             # Avoid query_texts embedding dimension mismatch; just fetch all docs for vendor.
-            results = self.collection.get(where={"vendor_name": vendor_name}, include=["documents", "metadatas"])
+            results = self._get(where={"vendor_name": vendor_name})
             documents = results.get("documents", [])
             metadatas = results.get("metadatas", [])
             # Optionally cap to n_results for summary context
@@ -212,7 +357,7 @@ class VectorDatabase:
     def list_ids(self) -> List[str]:
         """List all chunk IDs in the collection."""
         try:
-            data = self.collection.get(include=[])
+            data = self._get(include=[])
             return data.get("ids", [])
         except Exception as e:
             print(f"Error listing ids: {str(e)}")
@@ -221,10 +366,9 @@ class VectorDatabase:
     def get_collection_stats(self) -> Dict[str, Any]:
         """Get statistics about the vector database collection."""
         try:
-            count = self.collection.count()
             return {
-                "total_chunks": count,
-                "collection_name": self.collection.name
+                "total_chunks": self.count(),
+                "collection_name": self.collection_name
             }
         except Exception as e:
             print(f"Error getting collection stats: {str(e)}")
@@ -233,24 +377,39 @@ class VectorDatabase:
     def delete_all(self) -> bool:
         """Delete all data from the collection (for testing/reset)."""
         try:
-            self.client.delete_collection(name=self.collection_name)
-            self.collection = self.client.get_or_create_collection(
-                name=self.collection_name,
-                metadata={"description": "Vendor invoice knowledge base for VendorIQ"}
-            )
+            self._reset_collection()
+            self._unflushed_sidecars.clear()
+            self.facts.clear()
+            self.centroids.clear()
+            self.vendor_names.clear()
+            # Last: bumps the data versions
+            self.aggregates.clear()
             print("Successfully cleared vector database")
             return True
         except Exception as e:
             print(f"Error clearing database: {str(e)}")
             return False
 
+    def vendor_data_version(self, vendor_name: Optional[str]) -> int:
+        """Version of one vendor's data (any write for that vendor or reset changes it); None = whole collection.
+
+        Read from the aggregates database, so it is the same in every worker
+        and after a restart or a reopened tenant handle.
+        """
+        return self.aggregates.data_version(vendor_name)
+
     def list_vendors(self) -> List[str]:
-        """Return distinct vendor names (cached; falls back to scan metadata)."""
+        """Return distinct vendor names (cached; falls back to aggregates, then a metadata scan)."""
         if self.vendor_names:
             return sorted(self.vendor_names)
         try:
-            data = self.collection.get(include=["metadatas"])
-            for meta in data.get("metadatas", []):
+            self.vendor_names.update(self.aggregates.vendor_names())
+            if self.vendor_names:
+                return sorted(self.vendor_names)
+        except Exception as e:
+            print(f"Error reading vendor aggregates: {e}")
+        try:
+            for meta in self.get_all_metadatas():
                 if isinstance(meta, dict) and meta.get("vendor_name"):
                     self.vendor_names.add(meta["vendor_name"])
             return sorted(self.vendor_names)
@@ -258,10 +417,18 @@ class VectorDatabase:
             print(f"Error listing vendors: {e}")
             return []
 
+    def get_all_metadatas(self) -> List[Dict[str, Any]]:
+        """Every stored chunk's metadata (full scan; prefer aggregates for hot paths)."""
+        try:
+            return self._get(include=["metadatas"]).get("metadatas", []) or []
+        except Exception as e:
+            print(f"Error reading metadatas: {e}")
+            return []
+
     def get_all_by_vendor(self, vendor_name: str) -> Dict[str, Any]:
         """Return all documents & metadatas for a vendor (no similarity query)."""
         try:
-            results = self.collection.get(where={"vendor_name": vendor_name}, include=["documents", "metadatas"])
+            results = self._get(where={"vendor_name": vendor_name})
             return {
                 "documents": results.get("documents", []),
                 "metadatas": results.get("metadatas", []),
@@ -271,66 +438,119 @@ class VectorDatabase:
             return {"documents": [], "metadatas": []}
 
     def get_vendor_spend_totals(self) -> List[Dict[str, Any]]:
-        """Aggregate total_amount across all invoice chunks grouped by vendor_name."""
+        """Per-vendor total spend & invoice count, descending by spend.
+
+        Served from the materialized aggregate table kept up to date by
+        `store_embeddings`; an index built before aggregates existed is
+        backfilled once from a metadata scan.
+        """
         try:
-            data = self.collection.get(include=["metadatas"])
-            totals: Dict[str, float] = {}
-            invoice_counts: Dict[str, int] = {}
-            all_vendors: set[str] = set()
-            for meta in data.get("metadatas", []):
-                if not isinstance(meta, dict):
-                    continue
-                vn = meta.get("vendor_name")
-                if vn:
-                    all_vendors.add(vn)
-                if meta.get("type") != "invoice":
-                    continue
-                vendor = meta.get("vendor_name") or "Unknown"
-                raw_amount = meta.get("total_amount")
-                amount = 0.0
-                def _parse_amount(val):
-                    if val is None:
-                        return 0.0
-                    s = str(val).strip()
-                    import re
-                    s = re.sub(r"[₹$,]", "", s)
-                    s = re.sub(r"[^0-9.]", "", s)
-                    try:
-                        return float(s) if s else 0.0
-                    except Exception:
-                        return 0.0
-                amount = _parse_amount(raw_amount)
-                # Fallback: sum line item amounts if invoice total missing/zero
-                if amount == 0.0 and meta.get("line_items"):
-                    import json
+            if self.aggregates.is_empty() and self.count() > 0:
+                self._rebuild_sidecars()
+            return self.aggregates.ranking()
+        except Exception as e:
+            print(f"Error computing vendor spend totals: {e}")
+            return []
+
+    def _rebuild_sidecars(self) -> None:
+        """Backfill aggregates & invoice facts from stored chunk metadata (one-off full scan)."""
+        data = self._get(include=["metadatas"])
+        entries = []
+        # parent_chunk_id -> {line item position: item}, merged from that invoice's windows
+        window_items: Dict[str, Dict[int, Any]] = {}
+        for cid, meta in zip(data.get("ids", []), data.get("metadatas", [])):
+            if not isinstance(meta, dict) or not meta.get("vendor_name"):
+                continue
+            parent_id = meta.get("parent_chunk_id")
+            if parent_id:
+                items = meta.get("line_items") or []
+                if isinstance(items, str):
                     try:
-                        line_items = meta.get("line_items")
-                        if isinstance(line_items, str):
-                            line_items = json.loads(line_items)
-                        li_total = 0.0
-                        if isinstance(line_items, list):
-                            for li in line_items:
-                                li_total += _parse_amount(li.get("amount"))
-                        if li_total > 0:
-                            amount = li_total
+                        items = json.loads(items)
                     except Exception:
-                        pass
-                totals[vendor] = totals.get(vendor, 0.0) + amount
-                invoice_counts[vendor] = invoice_counts.get(vendor, 0) + 1
-            ranking = [
-                {
-                    "vendor_name": v,
-                    "total_spend": totals[v],
-                    "invoice_count": invoice_counts.get(v, 0),
-                }
-                for v in totals.keys()
-            ]
-            # Add vendors with zero spend (no invoices indexed yet)
-            zero_vendors = [v for v in all_vendors if v not in totals]
-            for zv in zero_vendors:
-                ranking.append({"vendor_name": zv, "total_spend": 0.0, "invoice_count": 0})
-            ranking.sort(key=lambda x: x["total_spend"], reverse=True)
-            return ranking
+                        items = []
+                offset = int(meta.get("line_item_offset") or 0)
+                window_items.setdefault(parent_id, {}).update({offset + pos: li for pos, li in enumerate(items)})
+                if int(meta.get("window_index") or 0):
+                    continue
+                meta, cid = dict(meta), parent_id
+            entries.append({"chunk_id": cid, "vendor_name": meta["vendor_name"], "type": meta.get("type"), "metadata": meta})
+        for entry in entries:
+            slots = window_items.get(entry["chunk_id"])
+            if slots:
+                entry["metadata"]["line_items"] = [slots[pos] for pos in sorted(slots)]
+        self.aggregates.clear()
+        self.aggregates.record(entries)
+        self.facts.clear()
+        self.facts.record(entries)
+        print(f"Rebuilt vendor aggregates & invoice facts from {len(entries)} stored chunks")
+
+    def _ensure_centroids(self) -> VendorCentroidStore:
+        """Backfill vendor centroids from stored embeddings for indexes built before centroids existed."""
+        if self.centroids.is_empty() and self.count() > 0:
+            data = self._get(include=["metadatas", "embeddings"])
+            embeddings = data.get("embeddings")
+            if embeddings is None:
+                embeddings = []
+            self.centroids.record(
+                (cid, meta["vendor_name"], emb)
+                for cid, meta, emb in zip(data.get("ids", []), data.get("metadatas", []), embeddings)
+                if isinstance(meta, dict) and meta.get("vendor_name")
+            )
+            print(f"Rebuilt vendor centroids from {len(data.get('ids', []))} stored chunks")
+        return self.centroids
+
+    def route_vendors(self, query_embedding: np.ndarray, top_k: int = 3) -> List[Dict[str, Any]]:
+        """Vendors whose centroid embedding is closest to the query, best first ({"vendor_name", "score"})."""
+        try:
+            return [{"vendor_name": v, "score": s} for v, s in self._ensure_centroids().route(query_embedding, top_k)]
         except Exception as e:
-            print(f"Error computing vendor spend totals: {e}")
+            print(f"Error routing query to vendors: {e}")
+            return []
+
+    def search_similar_vendors(self, query_embedding: np.ndarray, vendor_names: List[str], n_results: int = 5) -> Dict[str, Any]:
+        """Top-k restricted to a set of vendors (single filtered query)."""
+        try:
+            return self._query(query_embedding, n_results, where={"vendor_name": {"$in": list(vendor_names)}})
+        except Exception as e:
+            print(f"Error in multi-vendor filtered search: {e}")
+            return {"documents": [], "metadatas": [], "distances": []}
+
+    def _ensure_facts(self) -> InvoiceFactStore:
+        if self.facts.is_empty() and self.count() > 0:
+            self._rebuild_sidecars()
+        return self.facts
+
+    def get_vendor_invoices(self, vendor_name: str, date_from: str | None = None, date_to: str | None = None) -> List[Dict[str, Any]]:
+        """Invoice facts for one vendor (indexed lookup; numeric amounts, ISO dates, drive links)."""
+        try:
+            return self._ensure_facts().invoices_for_vendor(vendor_name, date_from, date_to)
+        except Exception as e:
+            print(f"Error reading invoice facts: {e}")
             return []
+
+    def get_vendor_profile(self, vendor_name: str) -> Dict[str, Any] | None:
+        """Vendor summary facts (last_updated, invoice_count, total_amount) if indexed."""
+        try:
+            return self._ensure_facts().vendor_profile(vendor_name)
+        except Exception as e:
+            print(f"Error reading vendor facts: {e}")
+            return None
+
+    def get_monthly_spend(self) -> Dict[str, float]:
+        """Declared invoice totals per YYYY-MM across all vendors."""
+        try:
+            return self._ensure_facts().monthly_totals()
+        except Exception as e:
+            print(f"Error reading monthly spend: {e}")
+            return {}
+
+
+def create_vector_database(persist_directory: str = VECTORDB_PERSIST_DIRECTORY, collection_name: str = "vendor_invoices", backend: str = VECTORDB_BACKEND) -> VectorDatabase:
+    """Build the configured vector store backend ("chroma" default, or "numpy")."""
+    if backend == "numpy":
+        from app.core.numpy_store import NumpyVectorDatabase
+        return NumpyVectorDatabase(persist_directory, collection_name)
+    if backend != "chroma":
+        print(f"Unknown VECTORDB_BACKEND '{backend}', using chroma")
+    return VectorDatabase(persist_directory, collection_name)
@@ -0,0 +1,80 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.core.retriever import VectorDatabase, create_vector_database
+from app.config import VECTORDB_PERSIST_DIRECTORY, VECTORDB_PER_TENANT_COLLECTIONS, TENANT_MAX_OPEN_COLLECTIONS
+
+
+class TenantVectorStores:
+    """Per-tenant vector store handles kept in a bounded LRU.
+
+    Each tenant (the `userId` passed to the REST routes) gets its own
+    collection, `<base>_<tenant>`, so a filtered search only walks that
+    tenant's index. Requests without a tenant, or all requests when
+    per-tenant collections are disabled, use `default_store`. When more than
+    `max_open` tenant handles are open, the least recently used one is
+    dropped. Requests that still hold a reference keep working, and the
+    handle's memory is released once those references go away.
+    """
+
+    def __init__(
+        self,
+        default_store: VectorDatabase,
+        persist_directory: str = VECTORDB_PERSIST_DIRECTORY,
+        base_collection: str = "vendor_invoices",
+        max_open: int = TENANT_MAX_OPEN_COLLECTIONS,
+        enabled: bool = VECTORDB_PER_TENANT_COLLECTIONS,
+    ):
+        self.default_store = default_store
+        self.persist_directory = persist_directory
+        self.base_collection = base_collection
+        self.max_open = max(1, max_open)
+        self.enabled = enabled
+        self._stores: "OrderedDict[str, VectorDatabase]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.evicted = 0
+
+    def collection_name_for(self, tenant_id: str) -> str:
+        """Chroma-safe collection name (3-63 chars of [A-Za-z0-9_-]) for a tenant."""
+        slug = re.sub(r"[^A-Za-z0-9_-]", "_", tenant_id.strip())
+        name = f"{self.base_collection}_{slug}"
+        if len(name) > 63 or slug != tenant_id.strip():
+            name = f"{self.base_collection}_{hashlib.md5(tenant_id.encode()).hexdigest()}"
+        return name
+
+    def get(self, tenant_id: Optional[str]) -> VectorDatabase:
+        if not self.enabled or not tenant_id:
+            return self.default_store
+        with self._lock:
+            store = self._stores.get(tenant_id)
+            if store is not None:
+                self._stores.move_to_end(tenant_id)
+                return store
+        # Open outside the lock (Chroma/SQLite setup can be slow); first writer wins
+        store = create_vector_database(self.persist_directory, self.collection_name_for(tenant_id))
+        with self._lock:
+            existing = self._stores.get(tenant_id)
+            if existing is not None:
+                self._stores.move_to_end(tenant_id)
+                return existing
+            self._stores[tenant_id] = store
+            self.opened += 1
+            while len(self._stores) > self.max_open:
+                evicted_id, _ = self._stores.popitem(last=False)
+                self.evicted += 1
+                print(f"Evicted idle tenant vector store {evicted_id}")
+        return store
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "per_tenant_collections": self.enabled,
+                "open_tenants": len(self._stores),
+                "max_open": self.max_open,
+                "opened": self.opened,
+                "evicted": self.evicted,
+            }
@@ -0,0 +1,206 @@
+"""In-memory vendor name detection for questions.
+
+`VendorMatcher` is built once per vendor set. `vendor_matcher_for` caches one
+matcher per distinct list of known vendors, so a new matcher is built only
+when that list changes. Matching happens in two stages:
+
+1. An Aho-Corasick automaton over normalized vendor names (and the names
+   with legal suffixes such as "Pvt Ltd" removed) finds exact mentions in
+   one pass over the question. A mention must start and end on a word
+   boundary. Such a match scores 1.0.
+2. Otherwise every word n-gram of the question is scored against a
+   character-trigram index (Dice coefficient, or edit similarity of the
+   shortlisted names when higher). Spaces are ignored, so
+   "zen corp" can match "Zencorporations". A span of at least 4 characters
+   that is a prefix of exactly one vendor's name also scores well. This
+   stage handles typos and partial names.
+
+The orchestrator only falls back to the LLM when the best score is below
+VENDOR_MATCH_THRESHOLD or two vendors score within VENDOR_MATCH_MARGIN of
+each other.
+"""
+import re
+from bisect import bisect_left
+from collections import Counter, deque
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from app.config import VENDOR_MATCH_MARGIN, VENDOR_MATCH_THRESHOLD
+from app.core.cache import LRUCache
+
+LEGAL_SUFFIXES = {
+    "pvt", "private", "ltd", "limited", "llp", "llc", "inc", "co", "company",
+    "corp", "corporation", "plc", "gmbh", "enterprises", "the",
+}
+# Question vocabulary: a fuzzy span never starts or ends with one of these
+QUERY_WORDS = {
+    "a", "about", "all", "amount", "amounts", "an", "and", "any", "are", "bill", "billed", "bills", "bought", "buy",
+    "by", "did", "do", "does", "for", "from", "give", "has", "have", "how", "i", "in", "invoice", "invoices", "is",
+    "item", "items", "last", "list", "many", "me", "much", "month", "of", "on", "our", "paid", "pay", "payment",
+    "purchase", "purchased", "quarter", "show", "spend", "spent", "summary", "tell", "that", "the", "this", "to",
+    "top", "total", "us", "vendor", "vendors", "was", "we", "week", "what", "when", "which", "who", "with", "year",
+}
+MIN_FUZZY_CHARS = 4
+MAX_SPAN_WORDS = 5
+
+
+def normalize_name(text: str) -> str:
+    """Lower-case, punctuation to spaces, whitespace collapsed."""
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", text.lower()).split())
+
+
+def _trigrams(compact: str) -> Set[str]:
+    padded = f"  {compact} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _dice(a: Set[str], b: Set[str]) -> float:
+    return 2 * len(a & b) / (len(a) + len(b)) if a and b else 0.0
+
+
+class VendorMatcher:
+    """Exact (Aho-Corasick) + fuzzy (character trigram) vendor matcher for one vendor set."""
+
+    def __init__(self, vendors: Sequence[str]):
+        self.vendors = list(vendors)
+        # alias (normalized, space separated) -> vendor index
+        self.aliases: Dict[str, int] = {}
+        for idx, vendor in enumerate(self.vendors):
+            name = normalize_name(vendor)
+            if not name:
+                continue
+            self.aliases.setdefault(name, idx)
+            words = name.split()
+            while len(words) > 1 and words[-1] in LEGAL_SUFFIXES:
+                words.pop()
+            stripped = " ".join(w for w in words if w != "the")
+            if len(stripped.replace(" ", "")) >= MIN_FUZZY_CHARS:
+                self.aliases.setdefault(stripped, idx)
+        self._build_automaton()
+        self._build_trigram_index()
+
+    # --- exact mentions ---
+    def _build_automaton(self) -> None:
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[str]] = [[]]
+        for alias in self.aliases:
+            state = 0
+            for ch in alias:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append(alias)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def exact(self, text: str) -> Optional[str]:
+        """Longest vendor alias mentioned on word boundaries (earliest on ties)."""
+        text = normalize_name(text)
+        best: Optional[Tuple[int, int, str]] = None
+        state = 0
+        for end, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for alias in self._out[state]:
+                start = end - len(alias) + 1
+                if (start == 0 or text[start - 1] == " ") and (end + 1 == len(text) or text[end + 1] == " "):
+                    if best is None or len(alias) > best[0] or (len(alias) == best[0] and start < best[1]):
+                        best = (len(alias), start, alias)
+        return self.vendors[self.aliases[best[2]]] if best else None
+
+    # --- typos / partial names ---
+    def _build_trigram_index(self) -> None:
+        self._compact: Dict[str, Tuple[str, Set[str]]] = {}
+        self._postings: Dict[str, List[str]] = {}
+        for alias in self.aliases:
+            compact = alias.replace(" ", "")
+            if len(compact) < MIN_FUZZY_CHARS or compact in self._compact:
+                continue
+            grams = _trigrams(compact)
+            self._compact[compact] = (alias, grams)
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(compact)
+        self._sorted_compact = sorted(self._compact)
+
+    def _unique_prefix(self, span: str) -> Optional[Tuple[int, int]]:
+        """(vendor index, shortest name length) when `span` prefixes names of exactly one vendor."""
+        found: Dict[int, int] = {}
+        i = bisect_left(self._sorted_compact, span)
+        while i < len(self._sorted_compact) and self._sorted_compact[i].startswith(span):
+            compact = self._sorted_compact[i]
+            idx = self.aliases[self._compact[compact][0]]
+            found[idx] = min(found.get(idx, len(compact)), len(compact))
+            if len(found) > 1:
+                return None
+            i += 1
+        return next(iter(found.items())) if found else None
+
+    def fuzzy(self, text: str, limit: int = 5) -> List[Tuple[str, float]]:
+        """Best-scoring vendors for any word span of `text`, highest first."""
+        words = normalize_name(text).split()
+        scores: Dict[int, float] = {}
+        for i in range(len(words)):
+            if words[i] in QUERY_WORDS:
+                continue
+            for j in range(i + 1, min(len(words), i + MAX_SPAN_WORDS) + 1):
+                span = "".join(words[i:j])
+                if words[j - 1] in QUERY_WORDS or len(span) < MIN_FUZZY_CHARS or span.isdigit():
+                    continue
+                grams = _trigrams(span)
+                shared = Counter(c for g in grams for c in self._postings.get(g, ()))
+                for compact, _ in shared.most_common(limit * 4):
+                    alias, alias_grams = self._compact[compact]
+                    # Trigram overlap shortlists; edit similarity rescues short names with a typo
+                    score = max(_dice(grams, alias_grams), SequenceMatcher(None, span, compact).ratio())
+                    idx = self.aliases[alias]
+                    if score > scores.get(idx, 0.0):
+                        scores[idx] = score
+                prefix = self._unique_prefix(span)
+                if prefix is not None:
+                    idx, name_len = prefix
+                    # Unique prefix: confident, scaled by how much of the name was typed
+                    scores[idx] = max(scores.get(idx, 0.0), 0.7 + 0.3 * len(span) / name_len)
+        ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+        return [(self.vendors[idx], round(score, 4)) for idx, score in ranked]
+
+    def match(self, text: str, threshold: float = VENDOR_MATCH_THRESHOLD, margin: float = VENDOR_MATCH_MARGIN) -> Tuple[Optional[str], float, List[Tuple[str, float]]]:
+        """(confident vendor or None, its score, ranked fuzzy candidates)."""
+        vendor = self.exact(text)
+        if vendor:
+            return vendor, 1.0, [(vendor, 1.0)]
+        candidates = self.fuzzy(text)
+        if not candidates:
+            return None, 0.0, []
+        best, score = candidates[0]
+        ambiguous = len(candidates) > 1 and score - candidates[1][1] < margin
+        if score >= threshold and not ambiguous:
+            return best, score, candidates
+        return None, score, candidates
+
+
+_MATCHERS = LRUCache(max_size=64)
+
+
+def vendor_matcher_for(known_vendors: Sequence[str]) -> VendorMatcher:
+    """Matcher for this exact vendor set, built on first use and reused until the set changes."""
+    key = tuple(known_vendors)
+    matcher = _MATCHERS.get(key)
+    if matcher is None:
+        matcher = VendorMatcher(key)
+        _MATCHERS.put(key, matcher)
+    return matcher
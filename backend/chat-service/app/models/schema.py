@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+import numpy as np
+from pydantic import BaseModel, ConfigDict, field_validator
 from typing import List, Optional
 
 class LineItem(BaseModel):
@@ -29,8 +30,20 @@ class VendorDataset(BaseModel):
     vendors: List[Vendor]
 
 class KnowledgeChunk(BaseModel):
+    # Embeddings stay float32 ndarrays (rows of the encoder's output matrix), not lists of Python floats
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     chunk_id: str
     vendor_name: str
     content: str
     metadata: dict
-    embedding: Optional[List[float]] = None
+    embedding: Optional[np.ndarray] = None
+    # Windowed invoice chunks: the whole invoice's metadata, recorded once in the sidecar stores
+    # under metadata["parent_chunk_id"] (never written to the vector store itself)
+    parent_metadata: Optional[dict] = None
+
+    @field_validator("embedding", mode="before")
+    @classmethod
+    def _as_float32(cls, value):
+        # Lists (e.g. from older callers) are converted once; float32 arrays pass through uncopied
+        return None if value is None else np.asarray(value, dtype=np.float32)
@@ -1,6 +1,11 @@
-from fastapi import APIRouter, HTTPException, Query, Depends, Request
-from typing import Optional
+import asyncio
+import json
+from fastapi import APIRouter, HTTPException, Query, Depends, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import Any, Awaitable, Dict, Optional
 from app.core.orchestrator import VendorKnowledgeOrchestrator
+from app.core.executors import run_io
+from app.core.jobs import IngestJob, IngestJobManager
 
 # Unified router (no extra prefix to keep paths explicit)
 router = APIRouter(tags=["VendorIQ RAG Service"])
@@ -14,19 +19,68 @@ def get_orchestrator():
         _GLOBAL_ORCHESTRATOR = VendorKnowledgeOrchestrator()
     return _GLOBAL_ORCHESTRATOR
 
+def run_ingest_job(job: IngestJob) -> Dict[str, Any]:
+    """Job handler (worker thread): run a queued load/ingest against the tenant's collection."""
+    orchestrator = get_orchestrator()
+    if job.kind == "load":
+        return orchestrator.process_vendor_data(
+            incremental=job.incremental, user_id=job.tenant, refresh_token=job.params.get("refresh_token"), progress=job.progress
+        )
+    # Vendors are parsed one at a time as the ingest pipeline reads them
+    vendors = orchestrator.data_loader.iter_raw_vendor_arrays(
+        {"vendorName": name, "records": records} for name, records in job.vendors.items()
+    )
+    result = orchestrator.process_direct_dataset(vendors, incremental=job.incremental, user_id=job.tenant, progress=job.progress)
+    result["userId"] = job.tenant
+    result["vendorCount"] = len(job.vendors)
+    return result
+
+# Ingest jobs are serialized per tenant and coalesced while queued (see app/core/jobs.py)
+_JOB_MANAGER = IngestJobManager(run_ingest_job)
+
+def get_job_manager() -> IngestJobManager:
+    return _JOB_MANAGER
+
+async def accept_or_wait(job: IngestJob, wait: bool, response: Response, jobs: IngestJobManager, label: str) -> Dict[str, Any]:
+    """202 + job handle by default; with wait=true, block until the job finishes and return its result."""
+    if not wait:
+        response.status_code = 202
+        return {"jobId": job.id, "status": job.status, "coalesced": job.coalesced, "statusUrl": f"/api/v1/knowledge/jobs/{job.id}"}
+    await jobs.wait(job)
+    if job.status != "succeeded":
+        raise HTTPException(status_code=400, detail=job.error or f"{label} failed")
+    return {**job.result, "jobId": job.id}
+
+async def run_until_disconnect(request: Request, work: Awaitable[Any], poll_seconds: float = 0.5) -> Any:
+    """Await `work`, cancelling it (and its in-flight Gemini call) if the client goes away."""
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_seconds)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
+
 # Load / build knowledge base (cron/internal use)
-@router.post("/knowledge/load", summary="Load & Index Vendor Knowledge", description="Load vendor data (local sample or remote Drive master.json for a user), generate embeddings, store in vector DB")
+@router.post("/knowledge/load", summary="Load & Index Vendor Knowledge", description="Queue a job that loads vendor data (local sample or remote Drive master.json for a user), generates embeddings and stores them in the vector DB. Returns 202 with a job ID unless wait=true.")
 async def load_vendor_knowledge(
+    response: Response,
     incremental: bool = Query(False, description="Only index new chunks if true"),
     userId: str | None = Query(None, description="User whose Drive vendor master.json files will be loaded if refreshToken provided"),
     refreshToken: str | None = Query(None, description="Google OAuth refresh token for Drive access to vendor master.json files"),
-    orchestrator: VendorKnowledgeOrchestrator = Depends(get_orchestrator),
+    wait: bool = Query(False, description="Block until the job finishes and return its result (200) instead of 202"),
+    jobs: IngestJobManager = Depends(get_job_manager),
 ):
     try:
-        result = orchestrator.process_vendor_data(incremental=incremental, user_id=userId, refresh_token=refreshToken)
-        if not result["success"]:
-            raise HTTPException(status_code=400, detail=result["message"])
-        return result
+        job = jobs.submit("load", userId, incremental, params={"refresh_token": refreshToken})
+        return await accept_or_wait(job, wait, response, jobs, "Knowledge load")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Knowledge load failed: {str(e)}")
 
@@ -37,27 +91,67 @@ class DirectVendorPayload(BaseModel):
     records: list = Field(default_factory=list, description="Array of invoice objects (master.json content)")
 
 class DirectKnowledgeIngest(BaseModel):
-    userId: str | None = Field(None, description="Optional user identifier (for logging)")
+    userId: str | None = Field(None, description="Tenant whose collection receives the data (shared collection if omitted)")
     incremental: bool = Field(True, description="Skip existing chunks if true")
     vendors: list[DirectVendorPayload] = Field(default_factory=list, description="List of vendor master arrays")
 
-@router.post("/knowledge/ingest", summary="Direct Master JSON Ingest", description="Index raw vendor master arrays pushed from OCR service (bypasses Drive fetch).")
-async def direct_ingest(payload: DirectKnowledgeIngest, orchestrator: VendorKnowledgeOrchestrator = Depends(get_orchestrator)):
+@router.post("/knowledge/ingest", summary="Direct Master JSON Ingest", description="Queue indexing of raw vendor master arrays pushed from OCR service (bypasses Drive fetch). Returns 202 with a job ID unless wait=true.")
+async def direct_ingest(
+    payload: DirectKnowledgeIngest,
+    response: Response,
+    wait: bool = Query(False, description="Block until the job finishes and return its result (200) instead of 202"),
+    jobs: IngestJobManager = Depends(get_job_manager),
+):
     try:
-        dataset = orchestrator.data_loader.from_raw_vendor_arrays([
-            {"vendorName": v.vendorName, "records": v.records} for v in payload.vendors
-        ])
-        result = orchestrator.process_direct_dataset(dataset, incremental=payload.incremental)
-        if not result.get("success"):
-            raise HTTPException(status_code=400, detail=result.get("message", "Ingest failed"))
-        result["userId"] = payload.userId
-        result["vendorCount"] = len(payload.vendors)
-        return result
+        if not payload.vendors:
+            raise HTTPException(status_code=400, detail="Empty vendor dataset")
+        vendors = {v.vendorName: v.records for v in payload.vendors}
+        job = jobs.submit("ingest", payload.userId, payload.incremental, vendors=vendors)
+        return await accept_or_wait(job, wait, response, jobs, "Ingest")
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Direct ingest failed: {e}")
 
+@router.get("/knowledge/jobs/{job_id}", summary="Ingest Job Status", description="Status and progress counters (chunks embedded / stored, elapsed time) of a load or ingest job")
+async def ingest_job_status(job_id: str, jobs: IngestJobManager = Depends(get_job_manager)):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found (unknown or expired from history)")
+    return job.to_dict()
+
+@router.get("/knowledge/jobs", summary="List Ingest Jobs", description="Recent load / ingest jobs, newest first, with queue and worker counters")
+async def list_ingest_jobs(
+    userId: str | None = Query(None, description="Only jobs for this user"),
+    limit: int = Query(50, ge=1, le=500),
+    jobs: IngestJobManager = Depends(get_job_manager),
+):
+    return {"jobs": jobs.list(userId, limit), "stats": jobs.stats()}
+
+async def check_user_gate(userId: str | None) -> None:
+    """Optional gating: if userId supplied, verify Google connection via email-storage-service."""
+    if not userId:
+        return
+    import re, os, httpx
+    if not re.match(r"^[a-f0-9]{24}$", userId, re.IGNORECASE):
+        raise HTTPException(status_code=400, detail="Invalid userId format")
+    base_url = os.getenv("EMAIL_STORAGE_SERVICE_URL", "http://localhost:4002/api/v1")
+    sync_url = f"{base_url}/users/{userId}/sync-status"
+    try:
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            resp = await client.get(sync_url)
+        if resp.status_code == 200:
+            payload = resp.json()
+            if not payload.get("hasGoogleConnection"):
+                raise HTTPException(status_code=403, detail="Assistant disabled: Google account disconnected.")
+        else:
+            if resp.status_code == 404:
+                raise HTTPException(status_code=404, detail="User not found for gating")
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"User connection gating check failed: {e}")
+
 # Chat RAG endpoint 
 @router.get(
     "/query",
@@ -65,35 +159,19 @@ async def direct_ingest(payload: DirectKnowledgeIngest, orchestrator: VendorKnow
     description="Answer a question about a specific vendor using vector retrieval + LLM generation. Gated by user Google connection if userId provided.",
 )
 async def chat_query(
+    request: Request,
     question: str = Query(..., description="User question"),
     vendor_name: str | None = Query(None, description="Explicit vendor to query; if omitted auto-detection/aggregation used"),
-    userId: str | None = Query(None, description="User ID to authorize query (must have active Google connection)"),
+    userId: str | None = Query(None, description="User ID to authorize query (must have active Google connection); also selects the user's collection"),
     orchestrator: VendorKnowledgeOrchestrator = Depends(get_orchestrator),
 ):
     try:
-        # Optional gating: if userId supplied, verify Google connection via email-storage-service
-        if userId:
-            import re, os, httpx
-            if not re.match(r"^[a-f0-9]{24}$", userId, re.IGNORECASE):
-                raise HTTPException(status_code=400, detail="Invalid userId format")
-            base_url = os.getenv("EMAIL_STORAGE_SERVICE_URL", "http://localhost:4002/api/v1")
-            sync_url = f"{base_url}/users/{userId}/sync-status"
-            try:
-                async with httpx.AsyncClient(timeout=5.0) as client:
-                    resp = await client.get(sync_url)
-                if resp.status_code == 200:
-                    payload = resp.json()
-                    if not payload.get("hasGoogleConnection"):
-                        raise HTTPException(status_code=403, detail="Assistant disabled: Google account disconnected.")
-                else:
-                    if resp.status_code == 404:
-                        raise HTTPException(status_code=404, detail="User not found for gating")
-            except HTTPException:
-                raise
-            except Exception as e:
-                print(f"User connection gating check failed: {e}")
-
-        result = orchestrator.answer_query(question=question, vendor_name=vendor_name)
+        await check_user_gate(userId)
+
+        # Retrieval runs in worker threads (concurrent query embeddings get micro-batched), Gemini is awaited
+        result = await run_until_disconnect(
+            request, orchestrator.answer_query_async(question=question, vendor_name=vendor_name, user_id=userId)
+        )
         if not result["success"]:
             raise HTTPException(status_code=400, detail=result["message"])
         return result
@@ -102,14 +180,47 @@ async def chat_query(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
 
+@router.get(
+    "/query/stream",
+    summary="Query Vendor Knowledge (streaming)",
+    description=(
+        "Server-Sent Events variant of /query: a `sources` event as soon as retrieval finishes, `token` events as Gemini "
+        "generates the answer, then a `done` event with the final answer and timings (ms). Failures end with an `error` event."
+    ),
+)
+async def chat_query_stream(
+    question: str = Query(..., description="User question"),
+    vendor_name: str | None = Query(None, description="Explicit vendor to query; if omitted auto-detection/aggregation used"),
+    userId: str | None = Query(None, description="User ID to authorize query (must have active Google connection); also selects the user's collection"),
+    orchestrator: VendorKnowledgeOrchestrator = Depends(get_orchestrator),
+):
+    await check_user_gate(userId)
+
+    async def events():
+        try:
+            async for event, data in orchestrator.stream_answer(question=question, vendor_name=vendor_name, user_id=userId):
+                yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'message': f'Query failed: {e}'})}\n\n"
+
+    # Starlette cancels this generator (and the Gemini stream) when the client disconnects
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.delete(
     "/delete-context",
     summary="Clear Vector Database",
     description="Delete all stored embeddings and reset the vendor knowledge database.",
 )
-async def delete_context(orchestrator: VendorKnowledgeOrchestrator = Depends(get_orchestrator)):
+async def delete_context(
+    userId: str | None = Query(None, description="Clear only this user's collection (shared collection if omitted)"),
+    orchestrator: VendorKnowledgeOrchestrator = Depends(get_orchestrator),
+):
     try:
-        result = orchestrator.reset_database()
+        result = await run_io(orchestrator.reset_database, user_id=userId)
         if not result.get("success"):
             raise HTTPException(status_code=400, detail=result.get("message", "Failed to clear database."))
         return result
@@ -120,22 +231,28 @@ async def delete_context(orchestrator: VendorKnowledgeOrchestrator = Depends(get
 @router.get("/health", summary="Health Check", description="Service + vector DB status")
 async def health_check(orchestrator: VendorKnowledgeOrchestrator = Depends(get_orchestrator)):
     try:
-        stats = orchestrator.get_system_stats()
+        stats = await run_io(orchestrator.get_system_stats)
         return {
             "status": "ok" if stats.get("success") else "error",
             "service": "chat-rag-service",
             "vector": stats.get("stats", {}),
+            "jobs": get_job_manager().stats(),
         }
     except Exception as e:
         return {"status": "error", "service": "chat-rag-service", "error": str(e)}
 
+@router.get("/cache/stats", summary="Cache Stats", description="Answer cache and query-embedding cache hit ratios, sizes and LLM time saved")
+async def cache_stats(orchestrator: VendorKnowledgeOrchestrator = Depends(get_orchestrator)):
+    return await run_io(orchestrator.get_cache_stats)
+
 @router.get("/vendor/summary", summary="Vendor Summary", description="Aggregated stats and invoice excerpts for a single vendor from indexed knowledge chunks")
 async def vendor_summary(
     vendor_name: str = Query(..., description="Vendor name to summarize"),
+    userId: str | None = Query(None, description="User whose collection to read (shared collection if omitted)"),
     orchestrator: VendorKnowledgeOrchestrator = Depends(get_orchestrator),
 ):
     try:
-        result = orchestrator.get_vendor_summary(vendor_name)
+        result = await run_io(orchestrator.get_vendor_summary, vendor_name, user_id=userId)
         if not result.get("success"):
             raise HTTPException(status_code=404, detail=result.get("message", "Vendor summary not found"))
         return result
@@ -185,18 +302,18 @@ async def list_endpoints(request: Request):
     endpoints.sort(key=lambda x: x["path"])  # stable order
     return {"count": len(endpoints), "endpoints": endpoints}
 
-@router.get("/analytics", summary="Analytics Overview", description="Real-time spend & trend analytics across all vendors with live Gemini summary")
+@router.get("/analytics", summary="Analytics Overview", description="Spend & trend analytics across all vendors with a Gemini summary, cached until the underlying aggregates change")
 async def analytics_overview(
+    request: Request,
     period: str = Query("year", description="Range: month | quarter | year | all"),
-    userId: Optional[str] = Query(None, description="Reserved for future per-user scoping (currently unused)"),
+    userId: Optional[str] = Query(None, description="User whose collection to analyze (shared collection if omitted)"),
     orchestrator: VendorKnowledgeOrchestrator = Depends(get_orchestrator),
 ):
-    """Always compute fresh analytics and generate a Gemini summary; no caching layer."""
-    result = orchestrator.get_analytics(period=period)
+    """Analytics + Gemini summary per (collection, period); regenerated only when the aggregate fingerprint changes."""
+    result = await run_until_disconnect(request, orchestrator.get_analytics_async(period=period, user_id=userId))
     if not result.get("success"):
         raise HTTPException(status_code=400, detail=result.get("message", "Analytics unavailable"))
-    result["cached"] = False
+    result["cached"] = result.get("cached", False)
     result["period"] = period
-    # Indicate live generation
-    result["source"] = "live"
+    result["source"] = "cache" if result["cached"] else "live"
     return result
\ No newline at end of file
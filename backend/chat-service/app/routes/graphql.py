@@ -1,10 +1,10 @@
 from strawberry.fastapi import GraphQLRouter
 from app.graphql.schema import schema  # updated path to schema
-from app.core.orchestrator import VendorKnowledgeOrchestrator
+from app.routes.chat import get_job_manager, get_orchestrator
 
 def get_context():
-    # Provide a fresh orchestrator per request to avoid shared mutable state
-    return {"orchestrator": VendorKnowledgeOrchestrator()}
+    # Share the REST singleton: a fresh orchestrator per request reloaded the embedding model every time
+    return {"orchestrator": get_orchestrator(), "jobs": get_job_manager()}
 
 # FastAPI router to mount in main.py with context injection
 graphql_router = GraphQLRouter(schema, context_getter=get_context)
@@ -0,0 +1,123 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models import KnowledgeChunk  # noqa: E402
+
+
+def make_chunk(chunk_id: str, vendor: str, vector, chunk_type: str = "invoice", **metadata) -> KnowledgeChunk:
+    """A stored-ready chunk with a fixed embedding (no encoder needed)."""
+    return KnowledgeChunk(
+        chunk_id=chunk_id,
+        vendor_name=vendor,
+        content=f"{vendor} {chunk_id}",
+        metadata={"type": chunk_type, "total_amount": metadata.pop("total_amount", 100.0), **metadata},
+        embedding=np.asarray(vector, dtype=np.float32),
+    )
+
+
+@pytest.fixture
+def persist_dir(tmp_path):
+    return str(tmp_path / "vectordb")
+
+
+class HashEncoder:
+    """Deterministic stand-in for the SentenceTransformer model: one unit vector per distinct text."""
+
+    dim = 16
+
+    def __init__(self):
+        self.encoded: list = []
+        self.pools: list = []
+        self.max_seq_length = 384
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False, **kwargs):
+        self.encoded.extend(texts)
+        rows = []
+        for text in texts:
+            seed = int.from_bytes(text.encode("utf-8")[:32].ljust(8, b"\0")[:8], "little") ^ len(text)
+            v = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            rows.append(v / np.linalg.norm(v))
+        return np.stack(rows) if rows else np.zeros((0, self.dim), dtype=np.float32)
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def start_multi_process_pool(self, target_devices=None):
+        pool = {"workers": len(target_devices or ()), "stopped": False}
+        self.pools.append(pool)
+        return pool
+
+    def encode_multi_process(self, texts, pool, batch_size=32, chunk_size=None):
+        assert not pool["stopped"]
+        return self.encode(texts)
+
+    def stop_multi_process_pool(self, pool):
+        pool["stopped"] = True
+
+
+@pytest.fixture
+def embedding_service(tmp_path, monkeypatch):
+    """EmbeddingService over HashEncoder with its caches under tmp_path."""
+    pytest.importorskip("sentence_transformers")
+    from app.core import embedder
+    from app.core.embedding_cache import EmbeddingCache
+
+    cache_path = str(tmp_path / "embedding_cache.sqlite3")
+    monkeypatch.setattr(embedder, "EMBEDDING_CACHE_PATH", cache_path)
+    monkeypatch.setattr(embedder, "load_sentence_transformer", lambda model_name, backend="torch": HashEncoder())
+    return embedder.EmbeddingService(cache=EmbeddingCache(cache_path), server_url="")
+
+
+@pytest.fixture
+def data_loader(tmp_path):
+    """VendorDataLoader with a small, tokenizer-free chunk limit so invoices split into windows."""
+    from app.core.chunking import InvoiceChunker, TokenCounter
+    from app.core.loader import VendorDataLoader
+
+    counter = TokenCounter()
+    counter._loaded = True  # no tokenizer download: ~4 characters per token
+    return VendorDataLoader(str(tmp_path / "vendors"), chunker=InvoiceChunker(counter, max_tokens=120, overlap=0), manifest_path=str(tmp_path / "manifest.sqlite3"))
+
+
+@pytest.fixture(params=["chroma", "numpy"])
+def vector_db(request, persist_dir):
+    from app.core.retriever import create_vector_database
+
+    return create_vector_database(persist_dir, "vendor_invoices", backend=request.param)
+
+
+class CannedLLM:
+    """Stand-in for GeminiLLM that answers instantly and counts calls."""
+
+    def __init__(self, answer: str = "canned answer"):
+        self.answer = answer
+        self.calls = 0
+
+    def generate(self, prompt, system=None):
+        self.calls += 1
+        return self.answer
+
+    async def generate_async(self, prompt, system=None, timeout=None):
+        return self.generate(prompt, system)
+
+
+@pytest.fixture
+def orchestrator(embedding_service, tmp_path, persist_dir, monkeypatch):
+    """VendorKnowledgeOrchestrator over HashEncoder and CannedLLM, with per-tenant collections on."""
+    pytest.importorskip("google.generativeai")
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    from app.core import orchestrator as orchestrator_module
+
+    monkeypatch.setattr(orchestrator_module, "EmbeddingService", lambda: embedding_service)
+    vendors_dir = tmp_path / "vendors"
+    vendors_dir.mkdir(exist_ok=True)
+    o = orchestrator_module.VendorKnowledgeOrchestrator(data_directory=str(vendors_dir), vectordb_directory=persist_dir)
+    o.data_loader.manifest_path = str(tmp_path / "remote_masters.sqlite3")
+    o.llm_service.llm = CannedLLM()
+    o.tenant_stores.enabled = True
+    return o
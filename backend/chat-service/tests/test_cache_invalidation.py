@@ -0,0 +1,148 @@
+"""Answer cache keys must change with the stored data, across restarts, evictions and workers."""
+import pytest
+
+from app.core.retriever import create_vector_database
+from app.core.tenancy import TenantVectorStores
+from conftest import make_chunk
+
+VECTOR = [1.0, 0.0, 0.0, 0.0]
+
+
+@pytest.fixture
+def tenants(persist_dir):
+    # One open handle: opening a second tenant evicts the first
+    return TenantVectorStores(create_vector_database(persist_dir), persist_dir, max_open=1, enabled=True)
+
+
+def test_data_version_survives_eviction_and_reopen(tenants):
+    alice = tenants.get("alice")
+    alice.store_embeddings([make_chunk("a1", "Acme", VECTOR)])
+    written = alice.vendor_data_version("Acme")
+    assert written > alice.vendor_data_version("Globex") == 0
+
+    tenants.get("bob")
+    reopened = tenants.get("alice")
+    assert reopened is not alice
+    assert reopened.vendor_data_version("Acme") == written
+
+    reopened.store_embeddings([make_chunk("a1", "Acme", VECTOR, total_amount=250.0)])
+    assert reopened.vendor_data_version("Acme") > written
+
+
+def test_data_version_is_shared_between_handles(persist_dir):
+    # Two handles on one collection stand in for two uvicorn workers
+    first = create_vector_database(persist_dir, "vendor_invoices_shared")
+    second = create_vector_database(persist_dir, "vendor_invoices_shared")
+    first.store_embeddings([make_chunk("a1", "Acme", VECTOR)])
+    assert second.vendor_data_version("Acme") == first.vendor_data_version("Acme")
+    assert second.vendor_data_version(None) == first.vendor_data_version(None)
+
+    before = first.vendor_data_version("Acme")
+    second.delete_all()
+    assert first.vendor_data_version("Acme") > before
+    assert first.vendor_data_version(None) > before
+
+
+@pytest.fixture
+def llm_service(embedding_service, tenants, monkeypatch):
+    pytest.importorskip("google.generativeai")
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    from app.core.llm_service import LLMService
+
+    return LLMService(embedding_service, tenants.default_store)
+
+
+def test_cached_answer_misses_after_reingest_through_reopened_tenant(llm_service, tenants):
+    from app.core.orchestrator import VendorKnowledgeOrchestrator
+
+    question = "How much did Acme bill?"
+    sources = [{"chunk_id": "a1"}]
+    alice = tenants.get("alice")
+    alice.store_embeddings([make_chunk("a1", "Acme", VECTOR, total_amount=100.0)])
+    scope = VendorKnowledgeOrchestrator._answer_cache_scope(alice, "Acme")
+    llm_service.store_answer(question, sources, scope, {"success": True, "answer": "Acme billed 100"}, 0.5)
+    assert llm_service.cached_answer(question, sources, scope) is not None
+
+    tenants.get("bob")
+    reopened = tenants.get("alice")
+    reopened.store_embeddings([make_chunk("a1", "Acme", VECTOR, total_amount=250.0)])
+
+    assert llm_service.cached_answer(question, sources, VendorKnowledgeOrchestrator._answer_cache_scope(reopened, "Acme")) is None
+
+
+def test_semantic_cache_misses_after_reingest_and_audit_is_written(llm_service, tenants, tmp_path):
+    import json
+
+    from app.core.orchestrator import VendorKnowledgeOrchestrator
+
+    if llm_service.semantic_cache is None:
+        pytest.skip("semantic cache disabled")
+    llm_service.audit_log_path = str(tmp_path / "audit.jsonl")
+    sources = [{"chunk_id": "a1"}]
+    embedding = llm_service.embedding_service.generate_single_embedding("How much did Acme bill?")
+    alice = tenants.get("alice")
+    alice.store_embeddings([make_chunk("a1", "Acme", VECTOR, total_amount=100.0)])
+    scope = VendorKnowledgeOrchestrator._answer_cache_scope(alice, "Acme")
+    llm_service.store_answer("How much did Acme bill?", sources, scope, {"success": True, "answer": "Acme billed 100"}, 0.5, embedding)
+    # A paraphrase (same embedding here) is served from the semantic cache
+    assert llm_service.cached_answer("What did Acme bill?", sources, scope, embedding)["semantic_match"]
+
+    tenants.get("bob")
+    reopened = tenants.get("alice")
+    reopened.store_embeddings([make_chunk("a1", "Acme", VECTOR, total_amount=250.0)])
+    assert llm_service.cached_answer("What did Acme bill?", sources, VendorKnowledgeOrchestrator._answer_cache_scope(reopened, "Acme"), embedding) is None
+
+    llm_service.flush_audit()
+    with open(llm_service.audit_log_path) as fh:
+        events = [json.loads(line)["event"] for line in fh]
+    assert events == ["hit", "miss"]
+
+
+def test_analytics_cache_follows_aggregates_written_by_another_handle(orchestrator, persist_dir):
+    store = orchestrator.store_for("alice")
+    store.store_embeddings([make_chunk("a1", "Acme", VECTOR, total_amount=100.0, invoice_date="2024-01-05")])
+    assert orchestrator.get_analytics("all", user_id="alice")["cached"] is False
+    assert orchestrator.get_analytics("all", user_id="alice")["cached"] is True
+
+    # Another worker's ingest into the same tenant collection
+    other_worker = create_vector_database(persist_dir, store.collection_name)
+    other_worker.store_embeddings([make_chunk("a2", "Acme", VECTOR, total_amount=50.0, invoice_date="2024-02-05")])
+
+    fresh = orchestrator.get_analytics("all", user_id="alice")
+    assert fresh["cached"] is False
+    assert orchestrator.llm_service.llm.calls == 2
+
+
+def test_answer_cache_runs_off_the_event_loop(orchestrator):
+    import asyncio
+    import threading
+
+    from app.models import Invoice, Vendor
+
+    vendor = Vendor(vendor_name="Acme", last_updated="2024-01-01", invoices=[Invoice(vendor_name="Acme", invoice_number="INV-1", invoice_date="2024-01-01", total_amount="100")])
+    assert orchestrator.process_direct_dataset([vendor], user_id="u1")["success"]
+    llm = orchestrator.llm_service
+    threads = []
+    lookup, store = llm.cached_answer, llm.store_answer
+
+    def tracking_lookup(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return lookup(*args, **kwargs)
+
+    def tracking_store(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return store(*args, **kwargs)
+
+    llm.cached_answer, llm.store_answer = tracking_lookup, tracking_store
+
+    async def scenario():
+        loop_thread = threading.current_thread()
+        await orchestrator.answer_query_async("Why was the Acme delivery late?", "Acme", user_id="u1")
+        events = [event async for event, _ in orchestrator.stream_answer("Why was the Acme delivery late?", "Acme", user_id="u1")]
+        return loop_thread, events
+
+    loop_thread, events = asyncio.run(scenario())
+    assert events[-1] == "done"
+    # answer_query_async: lookup + store; stream_answer: lookup (a hit after the first answer)
+    assert len(threads) >= 3
+    assert loop_thread not in threads
@@ -0,0 +1,26 @@
+import numpy as np
+
+from conftest import make_chunk
+
+
+def _centroids(vector_db):
+    vendors, matrix = vector_db.centroids.matrix()
+    return dict(zip(vendors, matrix))
+
+
+def test_reindexed_chunk_replaces_its_contribution(vector_db):
+    vector_db.store_embeddings([make_chunk("a1", "Acme", [1, 0, 0]), make_chunk("a2", "Acme", [0, 1, 0])])
+    # a2 moves to another vendor and a1 changes direction
+    vector_db.store_embeddings([make_chunk("a1", "Acme", [0, 0, 1]), make_chunk("a2", "Globex", [0, 1, 0])])
+
+    centroids = _centroids(vector_db)
+    assert np.allclose(centroids["Acme"], [0, 0, 1], atol=1e-6)
+    assert np.allclose(centroids["Globex"], [0, 1, 0], atol=1e-6)
+    counts = dict(vector_db.centroids._conn.execute("SELECT vendor_name, chunk_count FROM vendor_centroids"))
+    assert counts == {"Acme": 1, "Globex": 1}
+
+
+def test_no_second_copy_of_chunk_vectors(vector_db):
+    vector_db.store_embeddings([make_chunk("a1", "Acme", [1, 0, 0])])
+    tables = {r[0] for r in vector_db.centroids._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert tables == {"vendor_centroids"}
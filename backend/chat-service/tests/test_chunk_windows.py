@@ -0,0 +1,94 @@
+import numpy as np
+
+from app.core.pipeline import IngestPipeline
+from app.models import Invoice, Vendor
+from app.models.schema import LineItem
+
+
+def _vendor(items: int) -> Vendor:
+    return Vendor(
+        vendor_name="Acme",
+        last_updated="2024-01-01",
+        invoices=[Invoice(
+            vendor_name="Acme",
+            invoice_number="INV-1",
+            invoice_date="2024-01-01",
+            total_amount="100",
+            line_items=[LineItem(item_description=f"part number {i} with a long description", quantity="1", unit_price="1", amount="1") for i in range(items)],
+        )],
+    )
+
+
+def _embed(chunks):
+    for i, c in enumerate(chunks):
+        c.embedding = np.random.default_rng(i).standard_normal(8).astype(np.float32)
+    return chunks
+
+
+def _invoice_ids(vector_db):
+    return sorted(vector_db._get(where={"type": "invoice"}, include=[])["ids"])
+
+
+def test_reindexing_with_fewer_windows_deletes_stale_ones(data_loader, vector_db):
+    long_chunks = _embed(list(data_loader.iter_knowledge_chunks([_vendor(30)])))
+    parent = next(c.metadata["parent_chunk_id"] for c in long_chunks if c.metadata.get("parent_chunk_id"))
+    windows = [c for c in long_chunks if c.metadata.get("parent_chunk_id") == parent]
+    assert len(windows) >= 4
+    # An invoice's windows may arrive over several store calls: none of them is stale
+    vector_db.store_embeddings(long_chunks[:2])
+    vector_db.store_embeddings(long_chunks[2:])
+    assert len(_invoice_ids(vector_db)) == len(windows)
+
+    shorter = _embed(list(data_loader.iter_knowledge_chunks([_vendor(12)])))
+    vector_db.store_embeddings(shorter)
+    kept = sorted(c.chunk_id for c in shorter if c.metadata.get("parent_chunk_id") == parent)
+    assert 1 < len(kept) < len(windows)
+    assert _invoice_ids(vector_db) == kept
+
+    # Now fits in one chunk: only the parent ID remains
+    vector_db.store_embeddings(_embed(list(data_loader.iter_knowledge_chunks([_vendor(1)]))))
+    assert _invoice_ids(vector_db) == [parent]
+
+
+def test_chunk_stats_belong_to_each_pipeline(data_loader, vector_db):
+    class Encoder:
+        def bulk_session(self):
+            import contextlib
+            return contextlib.nullcontext()
+
+        def generate_embeddings(self, chunks, stats=None):
+            return _embed(chunks)
+
+    first = IngestPipeline(data_loader, Encoder(), vector_db)
+    second = IngestPipeline(data_loader, Encoder(), vector_db)
+    first.run([_vendor(30)])
+    second.run([_vendor(1)])
+
+    assert first.chunk_stats["split_invoices"] == 1
+    assert second.chunk_stats["split_invoices"] == 0
+    assert first.chunk_stats["invoice_windows"] > second.chunk_stats["invoice_windows"] == 0
+
+
+def test_deleted_windows_leave_the_vendor_centroid(data_loader, vector_db):
+    vector_db.store_embeddings(_embed(list(data_loader.iter_knowledge_chunks([_vendor(30)]))))
+    vector_db.store_embeddings(_embed(list(data_loader.iter_knowledge_chunks([_vendor(1)]))))
+
+    count = vector_db.centroids._conn.execute("SELECT chunk_count FROM vendor_centroids WHERE vendor_name = 'Acme'").fetchone()[0]
+    assert count == vector_db.count() == 2
+
+
+def test_stale_windows_are_found_by_id(data_loader, vector_db, monkeypatch):
+    vector_db.store_embeddings(_embed(list(data_loader.iter_knowledge_chunks([_vendor(30)]))))
+    lookups = []
+    get = vector_db._get
+
+    def tracking_get(where=None, ids=None, include=None):
+        lookups.append(where)
+        return get(where=where, ids=ids, include=include)
+
+    # No metadata scan per store call: only point lookups by chunk ID
+    monkeypatch.setattr(vector_db, "_get", tracking_get)
+    vector_db.store_embeddings(_embed(list(data_loader.iter_knowledge_chunks([_vendor(12)]))))
+    assert lookups and all(where is None for where in lookups)
+    monkeypatch.undo()
+    assert 1 < len(_invoice_ids(vector_db)) < 4
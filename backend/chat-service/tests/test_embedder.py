@@ -0,0 +1,51 @@
+def test_query_encodes_original_text_and_caches_by_normalized_key(embedding_service):
+    first = embedding_service.generate_single_embedding("  What did ACME bill   in March? ")
+    again = embedding_service.generate_single_embedding("what did acme bill in march?")
+
+    assert embedding_service.model.encoded == ["  What did ACME bill   in March? "]
+    assert (first == again).all()
+
+
+def test_query_vectors_stay_out_of_the_chunk_cache(embedding_service):
+    embedding_service.generate_single_embedding("total spend last quarter")
+
+    assert embedding_service.cache.stats()["entries"] == 0
+    assert embedding_service.query_disk_cache.stats()["entries"] == 1
+    # A fresh process (empty memory LRU) is served from the query table without encoding
+    embedding_service.query_cache.clear()
+    embedding_service.model.encoded.clear()
+    embedding_service.generate_single_embedding("Total spend last quarter")
+    assert embedding_service.model.encoded == []
+
+
+def test_concurrent_bulk_sessions_share_one_pool(embedding_service, monkeypatch):
+    import threading
+
+    from app.core import embedder
+    from conftest import make_chunk
+
+    monkeypatch.setattr(embedder, "EMBEDDING_POOL_MIN_CHUNKS", 1)
+    monkeypatch.setattr(embedder, "EMBEDDING_POOL_WORKERS", 3)
+    both_encoded = threading.Barrier(2)
+    stats = []
+
+    def ingest(tenant):
+        with embedding_service.bulk_session():
+            batch = {}
+            embedding_service.generate_embeddings([make_chunk(f"{tenant}-{i}", tenant, [0.0] * 16) for i in range(4)], stats=batch)
+            stats.append(batch)
+            both_encoded.wait(timeout=5)
+
+    threads = [threading.Thread(target=ingest, args=(t,)) for t in ("acme", "beta")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    pools = embedding_service.model.pools
+    assert len(pools) == 1 and pools[0]["workers"] == 3
+    assert pools[0]["stopped"]
+    assert [s["mode"] for s in stats] == ["multi_process", "multi_process"]
+    # Each ingest sees only its own batch's counters
+    assert [s["chunks"] for s in stats] == [4, 4]
+    assert not hasattr(embedding_service, "last_batch_stats")
@@ -0,0 +1,66 @@
+import asyncio
+
+from app.core.jobs import IngestJobManager
+from app.models import Invoice, Vendor
+
+
+def _vendor(name: str = "Acme") -> Vendor:
+    return Vendor(
+        vendor_name=name,
+        last_updated="2024-01-01",
+        invoices=[Invoice(vendor_name=name, invoice_number="INV-1", invoice_date="2024-01-01", total_amount="100")],
+    )
+
+
+def test_coalesced_load_keeps_the_queued_refresh_token():
+    seen = []
+
+    def handler(job):
+        seen.append((dict(job.params), job.incremental))
+        return {"success": True}
+
+    async def scenario():
+        jobs = IngestJobManager(handler)
+        first = jobs.submit("load", "u1", True, {"refresh_token": "tok-1"})
+        # Queued behind nothing yet: both fold into the first job before its worker starts
+        second = jobs.submit("load", "u1", False, {"refresh_token": None})
+        third = jobs.submit("load", "u1", True, {"refresh_token": "tok-2"})
+        await jobs.wait(first)
+        return jobs, first, second, third
+
+    jobs, first, second, third = asyncio.run(scenario())
+    assert first is second is third
+    assert first.coalesced == 2
+    assert seen == [({"refresh_token": "tok-2"}, False)]
+    assert first.status == "succeeded"
+    # Finished jobs drop their payload
+    assert first.params == {}
+    assert jobs.stats()["succeeded"] == 1
+
+
+def test_failed_handler_marks_the_job_failed():
+    async def scenario():
+        jobs = IngestJobManager(lambda job: {"success": False, "message": "no vendors"})
+        job = jobs.submit("load", None, True, {"refresh_token": None})
+        return await jobs.wait(job)
+
+    job = asyncio.run(scenario())
+    assert job.status == "failed"
+    assert job.error == "no vendors"
+
+
+def test_incremental_reload_with_nothing_new_succeeds(orchestrator):
+    first = orchestrator.process_direct_dataset([_vendor()], incremental=True, user_id="u1")
+    assert first["success"] and first["chunks_written"] > 0
+
+    def handler(job):
+        return orchestrator.process_direct_dataset([_vendor()], incremental=job.incremental, user_id=job.tenant, progress=job.progress)
+
+    async def scenario():
+        jobs = IngestJobManager(handler)
+        return await jobs.wait(jobs.submit("ingest", "u1", True, vendors={"Acme": []}))
+
+    job = asyncio.run(scenario())
+    assert job.status == "succeeded", job.error
+    assert job.result["chunks_written"] == 0
+    assert "nothing new" in job.result["message"]
@@ -0,0 +1,140 @@
+import os
+
+import numpy as np
+
+from app.core.numpy_store import NumpyVectorDatabase
+from conftest import make_chunk
+
+
+def _unit(i: int, dim: int = 8) -> np.ndarray:
+    v = np.zeros(dim, dtype=np.float32)
+    v[i % dim] = 1.0
+    return v
+
+
+def test_flush_appends_only_new_rows(persist_dir):
+    store = NumpyVectorDatabase(persist_dir, "t")
+    store.store_embeddings([make_chunk("a", "Acme", _unit(0)), make_chunk("b", "Beta", _unit(1))])
+    matrix_file = store._read_meta()["matrix_file"]
+    size_before = os.path.getsize(os.path.join(store.store_dir, matrix_file))
+
+    store.store_embeddings([make_chunk("c", "Acme", _unit(2))])
+
+    assert store._read_meta()["matrix_file"] == matrix_file
+    assert os.path.getsize(os.path.join(store.store_dir, matrix_file)) == size_before + 8 * 4
+    assert store.count() == 3
+    hits = store.search_similar_filtered(_unit(2).tolist(), "Acme", n_results=1)
+    assert hits["metadatas"][0]["chunk_id"] == "c"
+
+
+def test_concurrent_writers_keep_each_others_rows(persist_dir):
+    # Two handles on one collection stand in for two workers: neither sees the other's rows until it reloads
+    first = NumpyVectorDatabase(persist_dir, "t")
+    second = NumpyVectorDatabase(persist_dir, "t")
+    first.store_embeddings([make_chunk("a", "Acme", _unit(0))])
+    second.store_embeddings([make_chunk("b", "Beta", _unit(1))])
+    first.store_embeddings([make_chunk("c", "Acme", _unit(2))])
+
+    reopened = NumpyVectorDatabase(persist_dir, "t")
+    assert sorted(reopened.list_ids()) == ["a", "b", "c"]
+    assert first.count() == second.count() == 3
+    result = reopened._get(ids=["b"], include=["embeddings"])
+    assert np.allclose(result["embeddings"][0], _unit(1))
+
+
+def test_reupsert_latest_row_wins_and_compacts(persist_dir):
+    store = NumpyVectorDatabase(persist_dir, "t")
+    store.store_embeddings([make_chunk("a", "Acme", _unit(0)), make_chunk("b", "Acme", _unit(1))])
+    store.store_embeddings([make_chunk("a", "Beta", _unit(3))])
+    assert store.count() == 2
+    assert store.search_similar_filtered(_unit(0).tolist(), "Acme", n_results=5)["metadatas"][0]["chunk_id"] == "b"
+    assert store.search_similar_filtered(_unit(3).tolist(), "Beta", n_results=5)["metadatas"][0]["chunk_id"] == "a"
+
+    # Replaced rows now outnumber live ones: the flush rewrites live rows only
+    store.store_embeddings([make_chunk("a", "Beta", _unit(4)), make_chunk("b", "Acme", _unit(5))])
+    assert int(store._read_meta()["rows"]) == 2
+    store.store_embeddings([make_chunk("a", "Beta", _unit(6)), make_chunk("b", "Acme", _unit(7))])
+    reopened = NumpyVectorDatabase(persist_dir, "t")
+    top = reopened.search_similar(_unit(6).tolist(), n_results=2)
+    assert [m["chunk_id"] for m in top["metadatas"]] == ["a", "b"]
+    assert top["distances"][0] < 1e-5
+
+
+def test_reset_is_seen_by_other_handles(persist_dir):
+    first = NumpyVectorDatabase(persist_dir, "t")
+    second = NumpyVectorDatabase(persist_dir, "t")
+    first.store_embeddings([make_chunk("a", "Acme", _unit(0))])
+    assert second.count() == 1
+    first.delete_all()
+    assert second.count() == 0
+    second.store_embeddings([make_chunk("b", "Acme", _unit(1))])
+    assert first.list_ids() == ["b"]
+
+
+def _centroid_count(store, vendor: str) -> int:
+    row = store.centroids._conn.execute("SELECT chunk_count FROM vendor_centroids WHERE vendor_name = ?", (vendor,)).fetchone()
+    return row[0] if row else 0
+
+
+def test_sidecars_wait_for_the_flush(persist_dir):
+    store = NumpyVectorDatabase(persist_dir, "t")
+    version = store.vendor_data_version("Acme")
+    store.store_embeddings([make_chunk("a", "Acme", _unit(0), total_amount=10.0)], flush=False)
+
+    # Rows are only staged: nothing may describe them yet
+    assert store.vendor_data_version("Acme") == version
+    assert _centroid_count(store, "Acme") == 0
+    assert store.list_vendors() == []
+
+    store.flush()
+    assert store.vendor_data_version("Acme") > version
+    assert _centroid_count(store, "Acme") == 1
+    assert store.list_vendors() == ["Acme"]
+
+
+def test_failed_flush_drops_the_staged_sidecars(persist_dir, monkeypatch):
+    store = NumpyVectorDatabase(persist_dir, "t")
+    version = store.vendor_data_version("Acme")
+    store.store_embeddings([make_chunk("a", "Acme", _unit(0))], flush=False)
+
+    def fail():
+        store._pending.clear()
+        raise OSError("disk full")
+
+    monkeypatch.setattr(store, "_flush", fail)
+    assert not store.store_embeddings([make_chunk("b", "Acme", _unit(1))])
+    monkeypatch.undo()
+    store.flush()
+
+    assert store.count() == 0
+    assert store.vendor_data_version("Acme") == version
+    assert _centroid_count(store, "Acme") == 0
+
+
+def test_snapshot_is_unchanged_by_a_later_flush(persist_dir):
+    store = NumpyVectorDatabase(persist_dir, "t")
+    store.store_embeddings([make_chunk(f"a{i}", "Acme", _unit(i)) for i in range(20)])
+    state = store._snapshot()
+
+    # A reader holding `state` while an ingest flushes more rows for the same vendor
+    store.store_embeddings([make_chunk(f"b{i}", "Acme", _unit(i)) for i in range(10)])
+
+    assert store._snapshot() is not state
+    rows = store._row_ranges(state, {"vendor_name": "Acme"})
+    assert len(rows) == 20 and rows.max() < state["matrix"].shape[0]
+    assert store._row_ranges(state, None) == [(0, 20)]
+    assert len(state["row_of"]) == len(state["ids"]) == 20
+    assert len(store._snapshot()["row_of"]) == 30
+
+
+def test_rewriting_a_staged_id_keeps_the_centroid(persist_dir):
+    store = NumpyVectorDatabase(persist_dir, "t")
+    store.store_embeddings([make_chunk("a", "Acme", _unit(0))])
+    store.store_embeddings([make_chunk("a", "Acme", _unit(1))], flush=False)
+    store.store_embeddings([make_chunk("a", "Acme", _unit(2))], flush=False)
+    store.flush()
+
+    assert _centroid_count(store, "Acme") == 1
+    vendors, centroids = store.centroids.matrix()
+    assert vendors == ["Acme"]
+    np.testing.assert_allclose(centroids[0], _unit(2), atol=1e-6)
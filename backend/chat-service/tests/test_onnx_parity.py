@@ -0,0 +1,32 @@
+"""ONNX Runtime vectors must match the PyTorch reference (needs the model weights)."""
+import numpy as np
+import pytest
+
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("optimum")
+pytest.importorskip("onnxruntime")
+
+from app.config import EMBEDDING_MODEL  # noqa: E402
+from app.core.embedder import load_sentence_transformer  # noqa: E402
+
+SAMPLE = [
+    "Invoice 1213 from Zencorporations dated 16.12.2021, total ₹2,809.30",
+    "Line items: 2 x A4 paper ream @ 250.00, 1 x stapler @ 120.00",
+    "Vendor: Acme Supplies Pvt Ltd, GSTIN 29ABCDE1234F1Z5",
+    "top vendors by spend",
+    "what items were purchased in invoice 1213",
+]
+
+
+def _encode(backend: str) -> np.ndarray:
+    try:
+        model = load_sentence_transformer(EMBEDDING_MODEL, backend)
+    except OSError as e:
+        pytest.skip(f"{EMBEDDING_MODEL} not available offline: {e}")
+    vectors = np.asarray(model.encode(SAMPLE, show_progress_bar=False), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_onnx_matches_torch():
+    cosines = np.sum(_encode("torch") * _encode("onnx"), axis=1)
+    assert cosines.min() >= 0.99, cosines
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from app.core import loader as loader_module
+
+USER_ID = "u" * 24
+
+
+class FakeDrive:
+    """Token endpoint, email-service vendor list, Drive files.list and alt=media downloads."""
+
+    def __init__(self, folder_count: int):
+        self.base = ""
+        self.masters: dict = {}
+        self.versions: dict = {}
+        self.set_folders(folder_count)
+        self.failing_downloads: set = set()
+        self.failing_lists: set = set()
+        self.list_calls = 0
+        self.downloads: list = []
+        self._lock = threading.Lock()
+
+    def set_folders(self, count: int) -> None:
+        self.masters = {
+            f"fold{i}": [{"vendor_name": f"Vendor {i}", "invoice_number": f"I{i}", "invoice_date": "2024-02-01", "total_amount": "10", "line_items": []}]
+            for i in range(count)
+        }
+        self.versions = dict.fromkeys(self.masters, "2024-01-01T00:00:00Z")
+
+    def connect(self, data_loader) -> None:
+        data_loader.email_service_base = f"{self.base}/api/v1"
+        data_loader.google_client_id = "client-id"
+        data_loader.google_client_secret = "client-secret"
+
+    def change(self, folder_id: str, version: str) -> None:
+        self.versions[folder_id] = version
+        self.masters[folder_id][0]["total_amount"] = "99"
+
+    def listing(self, parents):
+        return [
+            {"id": f"file-{p}", "name": "master.json", "parents": [p], "modifiedTime": self.versions[p],
+             "md5Checksum": hashlib.md5(self.versions[p].encode()).hexdigest()}
+            for p in parents if p in self.masters
+        ]
+
+
+@pytest.fixture
+def fake_drive(data_loader, monkeypatch):
+    drive = FakeDrive(3)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, body, status=200):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self._send({"access_token": "drive-token"})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == f"/api/v1/drive/users/{USER_ID}/vendors":
+                return self._send({"vendors": [{"id": f, "name": f"Vendor {f[4:]}"} for f in drive.masters]})
+            if self.headers.get("Authorization") != "Bearer drive-token":
+                return self._send({"error": "unauthorized"}, 401)
+            if url.path == "/drive/v3/files":
+                parents = re.findall(r"'([^']+)' in parents", parse_qs(url.query)["q"][0])
+                with drive._lock:
+                    drive.list_calls += 1
+                if drive.failing_lists & set(parents):
+                    return self._send({"error": "backendError"}, 500)
+                return self._send({"files": drive.listing(parents)})
+            match = re.fullmatch(r"/drive/v3/files/file-(.+)", url.path)
+            folder_id = match.group(1)
+            with drive._lock:
+                drive.downloads.append(folder_id)
+            if folder_id in drive.failing_downloads:
+                return self._send({"error": "backendError"}, 500)
+            return self._send(drive.masters[folder_id])
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    drive.base = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(loader_module, "DRIVE_API_BASE", f"{drive.base}/drive/v3")
+    monkeypatch.setattr(loader_module, "GOOGLE_TOKEN_URI", f"{drive.base}/token")
+    drive.connect(data_loader)
+    yield drive
+    server.shutdown()
+    server.server_close()
+
+
+def _load(data_loader, skip_unchanged=True, record=True):
+    report = {}
+    names = sorted(v.vendor_name for v in data_loader.iter_remote_master(USER_ID, "refresh-token", skip_unchanged=skip_unchanged, report=report))
+    if record:
+        data_loader.manifest.record(USER_ID, report["indexed"])
+    return names, report
+
+
+def test_unchanged_masters_are_not_downloaded_again(data_loader, fake_drive):
+    names, report = _load(data_loader)
+    assert names == ["Vendor 0", "Vendor 1", "Vendor 2"]
+    assert report["fetched"] == 3 and report["unchanged"] == 0
+
+    fake_drive.downloads.clear()
+    names, report = _load(data_loader)
+    assert names == []
+    assert report["unchanged"] == 3
+    assert fake_drive.downloads == []
+
+    # A full (non-incremental) load ignores the manifest
+    names, _ = _load(data_loader, skip_unchanged=False)
+    assert len(names) == 3
+
+
+def test_changed_master_is_downloaded_again(data_loader, fake_drive):
+    _load(data_loader)
+    fake_drive.downloads.clear()
+    fake_drive.change("fold1", "2024-03-01T00:00:00Z")
+
+    names, report = _load(data_loader)
+    assert names == ["Vendor 1"]
+    assert fake_drive.downloads == ["fold1"]
+    assert report["unchanged"] == 2 and report["fetched"] == 1
+    assert _load(data_loader)[0] == []
+
+
+def test_folders_are_listed_in_batches(data_loader, fake_drive):
+    fake_drive.set_folders(loader_module.DRIVE_LIST_FOLDERS_PER_QUERY * 2 + 5)
+
+    names, report = _load(data_loader)
+    assert fake_drive.list_calls == 3
+    assert report["masters_found"] == report["fetched"] == len(names) == 85
+
+
+def test_failed_download_is_retried_on_the_next_load(data_loader, fake_drive):
+    fake_drive.failing_downloads.add("fold2")
+
+    names, report = _load(data_loader)
+    assert names == ["Vendor 0", "Vendor 1"]
+    assert report["failed"] == 1
+    assert sorted(e["folder_id"] for e in report["indexed"]) == ["fold0", "fold1"]
+
+    fake_drive.failing_downloads.clear()
+    fake_drive.downloads.clear()
+    names, report = _load(data_loader)
+    assert names == ["Vendor 2"]
+    assert fake_drive.downloads == ["fold2"]
+
+
+def test_failed_listing_skips_only_its_batch(data_loader, fake_drive, monkeypatch):
+    monkeypatch.setattr(loader_module, "DRIVE_LIST_FOLDERS_PER_QUERY", 2)
+    fake_drive.failing_lists.add("fold2")
+
+    names, report = _load(data_loader)
+    assert names == ["Vendor 0", "Vendor 1"]
+    assert report["failed"] == 1 and report["masters_found"] == 2
+
+
+def test_bad_credentials_yield_nothing(data_loader, fake_drive):
+    data_loader.google_client_secret = None
+    names, report = _load(data_loader, record=False)
+    assert names == [] and report["vendors_listed"] == 0
+    assert fake_drive.list_calls == 0
+
+
+def test_incremental_reload_of_unchanged_masters_succeeds(orchestrator, fake_drive):
+    fake_drive.connect(orchestrator.data_loader)
+    first = orchestrator.process_vendor_data(incremental=True, user_id=USER_ID, refresh_token="refresh-token")
+    assert first["success"], first["message"]
+    assert len(orchestrator.data_loader.manifest.versions(USER_ID)) == 3
+
+    fake_drive.downloads.clear()
+    second = orchestrator.process_vendor_data(incremental=True, user_id=USER_ID, refresh_token="refresh-token")
+    assert second["success"], second["message"]
+    assert fake_drive.downloads == []
+
+    fake_drive.change("fold0", "2024-03-01T00:00:00Z")
+    third = orchestrator.process_vendor_data(incremental=True, user_id=USER_ID, refresh_token="refresh-token")
+    assert third["success"], third["message"]
+    assert fake_drive.downloads == ["fold0"]
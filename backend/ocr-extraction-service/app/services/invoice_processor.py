@@ -118,8 +118,12 @@ async def _trigger_knowledge_indexing(user_id: str, incremental: bool = True, re
     try:
         async with httpx.AsyncClient(timeout=30.0) as client:
             resp = await client.post(url, params=params)
-        if resp.status_code == 200:
-            logger.info("Triggered knowledge indexing", extra={"user_id": user_id, "incremental": incremental})
+        # 202: queued as a background job on the chat-service (poll /knowledge/jobs/{jobId})
+        if resp.status_code in (200, 202):
+            logger.info(
+                "Triggered knowledge indexing",
+                extra={"user_id": user_id, "incremental": incremental, "job_id": resp.json().get("jobId")},
+            )
         else:
             logger.warning(
                 "Knowledge indexing trigger failed",
@@ -144,8 +148,8 @@ async def _direct_ingest_vendor(user_id: str, vendor_name: str, records: List[Di
     try:
         async with httpx.AsyncClient(timeout=60.0) as client:
             resp = await client.post(url, json=payload)
-        if resp.status_code == 200:
-            logger.info("Direct ingest success", extra={"vendor": vendor_name, "records": len(records)})
+        if resp.status_code in (200, 202):
+            logger.info("Direct ingest queued", extra={"vendor": vendor_name, "records": len(records), "job_id": resp.json().get("jobId")})
         else:
             logger.warning("Direct ingest failed", extra={"vendor": vendor_name, "status": resp.status_code, "body": resp.text[:300]})
     except Exception as exc: